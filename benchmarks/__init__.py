@@ -0,0 +1,8 @@
+"""
+Benchmarks for kubernetes-log-watcher hot paths.
+
+Benchmarks run against a synthetic node (see ``benchmarks.node``) laid out in a temporary directory, so they need
+neither a Kubernetes cluster nor a log shipper. Run them from the repository root, e.g.:
+
+    $ python -m benchmarks.sync_cycle --sizes 100,1000,5000
+"""
@@ -0,0 +1,352 @@
+"""
+Pod churn simulator.
+
+Replays a churn profile (pod creates/deletes per second, pods per deployment, containers per pod) against the real
+``watch()`` loop and agents on a synthetic node. Time is virtual: ``time.sleep()`` and ``time.monotonic()`` are
+driven by the simulator, so an hour of churn replays in seconds and results do not depend on the host.
+
+    $ python -m benchmarks.churn --duration 600 --interval 60 --creates-per-second 0.5 --deletes-per-second 0.5
+
+A profile file (YAML or JSON) replays several phases in sequence, e.g. a quiet period followed by a rollout burst:
+
+    phases:
+      - {duration: 300, creates_per_second: 0.05, deletes_per_second: 0.05}
+      - {duration: 120, creates_per_second: 2, deletes_per_second: 2}
+
+Reported per agent: convergence latency of added and removed containers, number of file writes and bytes written.
+Also reported: Scalyr ``agent.json`` rewrites, pod API calls and watcher cycles.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+from collections import namedtuple
+from unittest import mock
+
+import yaml
+
+from kube_log_watcher.main import BUILTIN_AGENTS, sync_containers_log_agents, watch
+
+from benchmarks.node import CLUSTER_ID, FakeNode
+
+Phase = namedtuple('Phase', 'duration creates_per_second deletes_per_second')
+
+
+class VirtualClock:
+    """Replacement for ``time.sleep()`` and ``time.monotonic()`` calling ``on_tick(now)`` every simulated second."""
+
+    def __init__(self, on_tick, on_sleep):
+        self.now = 0.0
+        self.on_tick = on_tick
+        self.on_sleep = on_sleep
+        self.origin = time.monotonic()
+
+    def monotonic(self):
+        return self.origin + self.now
+
+    def sleep(self, seconds):
+        self.on_sleep(self.now)
+
+        end = self.now + float(seconds)
+        while self.now < end:
+            step = min(1.0, end - self.now)
+            self.now += step
+            self.on_tick(self.now)
+
+
+class OutputTracker:
+    """Count files (re)written below some paths by comparing stat fingerprints between probes."""
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.fingerprints = {}
+        self.writes = 0
+        self.bytes_written = 0
+        self.deletes = 0
+        self.rewrites = {}
+
+    def scan(self) -> dict:
+        fingerprints = {}
+        for path in self.paths:
+            if os.path.isfile(path):
+                files = [path]
+            else:
+                files = (os.path.join(root, f) for root, _, names in os.walk(path) for f in names)
+
+            for f in files:
+                try:
+                    st = os.lstat(f)
+                except OSError:
+                    continue
+                fingerprints[f] = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+        return fingerprints
+
+    def probe(self):
+        fingerprints = self.scan()
+
+        for path, fingerprint in fingerprints.items():
+            if self.fingerprints.get(path) != fingerprint:
+                self.writes += 1
+                self.bytes_written += fingerprint[2]
+                self.rewrites[path] = self.rewrites.get(path, 0) + 1
+
+        self.deletes += len(self.fingerprints.keys() - fingerprints.keys())
+        self.fingerprints = fingerprints
+
+
+def scalyr_container_ids(node) -> set:
+    configs = [node.scalyr_config_path]
+    if os.path.isdir(node.scalyr_fragments_path):
+        configs.extend(os.path.join(node.scalyr_fragments_path, f) for f in os.listdir(node.scalyr_fragments_path))
+
+    container_ids = set()
+    for path in configs:
+        try:
+            with open(path) as fp:
+                config = json.load(fp)
+        except (OSError, ValueError):
+            continue
+
+        container_ids.update(os.path.basename(os.path.dirname(log['path'])) for log in config.get('logs', []))
+
+    return container_ids
+
+
+def appdynamics_container_ids(node) -> set:
+    return {f[len('container-'):-len('-jobfile.job')] for f in os.listdir(node.appdynamics_dest_path)
+            if f.startswith('container-') and f.endswith('-jobfile.job')}
+
+
+def symlinker_container_ids(node) -> set:
+    return set(os.listdir(node.symlink_dir))
+
+
+# Agents writing shipper configs: (containers in config, paths to track). Other agents (e.g. ``growth``) run in the
+# watcher loop but are not reported.
+PROBES = {
+    'scalyr': (scalyr_container_ids, lambda node: [os.path.dirname(node.scalyr_config_path)]),
+    'appdynamics': (appdynamics_container_ids, lambda node: [node.appdynamics_dest_path]),
+    'symlinker': (symlinker_container_ids, lambda node: [node.symlink_dir]),
+}
+
+
+class ChurnSimulator:
+    def __init__(self, node, phases, agent_names, deployments=20, pods_per_deployment=3, containers_per_pod=2,
+                 interval=60, watcher_config_file=None):
+        self.node = node
+        self.phases = phases
+        self.agent_names = agent_names
+        self.pods_per_deployment = pods_per_deployment
+        self.containers_per_pod = containers_per_pod
+        self.deployments = ['app-{}'.format(i) for i in range(deployments)]
+        self.interval = interval
+        self.watcher_config_file = watcher_config_file
+        self.random = node.random
+
+        self.duration = sum(p.duration for p in phases)
+        self.pending_creates = self.pending_deletes = 0.0
+        self.cycles = 0
+
+        # container id -> virtual time of creation/deletion
+        self.created = {}
+        self.deleted = {}
+        agent_names = [a for a in agent_names if a in PROBES]
+
+        # agent -> list of latencies
+        self.add_latency = {a: [] for a in agent_names}
+        self.remove_latency = {a: [] for a in agent_names}
+        self.converged = {a: set() for a in agent_names}
+        self.trackers = {a: OutputTracker(PROBES[a][1](node)) for a in agent_names}
+
+        self.clock = VirtualClock(self.tick, self.probe)
+
+    def phase_at(self, now) -> Phase:
+        elapsed = 0
+        for phase in self.phases:
+            elapsed += phase.duration
+            if now <= elapsed:
+                return phase
+        return self.phases[-1]
+
+    def create_pod(self):
+        application = self.random.choice(self.deployments)
+        key = self.node.add_pod(application, containers=self.containers_per_pod)
+        for container_id in self.node.pod_containers[key][1:]:
+            self.created[container_id] = self.clock.now
+
+    def delete_pod(self):
+        if not self.node.pod_containers:
+            return
+        key = self.random.choice(sorted(self.node.pod_containers))
+        for container_id in self.node.pod_containers[key][1:]:
+            self.deleted[container_id] = self.clock.now
+        self.node.remove_pod(key)
+
+    def tick(self, now):
+        if now > self.duration:
+            raise KeyboardInterrupt
+
+        phase = self.phase_at(now)
+        self.pending_creates += phase.creates_per_second
+        self.pending_deletes += phase.deletes_per_second
+
+        while self.pending_creates >= 1:
+            self.create_pod()
+            self.pending_creates -= 1
+
+        while self.pending_deletes >= 1:
+            self.delete_pod()
+            self.pending_deletes -= 1
+
+    def probe(self, now):
+        """Called whenever the watcher goes to sleep, i.e. after every cycle and agents poll."""
+        for agent in self.trackers:
+            container_ids = PROBES[agent][0](self.node)
+
+            for container_id in container_ids - self.converged[agent]:
+                if container_id in self.created:
+                    self.add_latency[agent].append(now - self.created[container_id])
+
+            for container_id in self.converged[agent] - container_ids:
+                if container_id in self.deleted:
+                    self.remove_latency[agent].append(now - self.deleted[container_id])
+
+            self.converged[agent] = container_ids
+            self.trackers[agent].probe()
+
+    def sync(self, *args, **kwargs):
+        self.cycles += 1
+        return sync_containers_log_agents(*args, **kwargs)
+
+    def run(self) -> dict:
+        for application in self.deployments:
+            for _ in range(self.pods_per_deployment):
+                self.node.add_pod(application, containers=self.containers_per_pod)
+        initial_api_calls = self.node.api_calls
+
+        with self.node.installed(), \
+                mock.patch('time.sleep', self.clock.sleep), \
+                mock.patch('time.monotonic', self.clock.monotonic), \
+                mock.patch('kube_log_watcher.main.sync_containers_log_agents', self.sync):
+            watch(self.node.containers_path, self.agent_names, CLUSTER_ID, interval=self.interval,
+                  watcher_config_file=self.watcher_config_file)
+
+        return self.results(self.node.api_calls - initial_api_calls)
+
+    def results(self, api_calls) -> dict:
+        agents = {}
+        for agent, tracker in self.trackers.items():
+            agents[agent] = {
+                'add_latency': summary(self.add_latency[agent]),
+                'remove_latency': summary(self.remove_latency[agent]),
+                'writes': tracker.writes,
+                'bytes_written': tracker.bytes_written,
+                'deletes': tracker.deletes,
+            }
+
+        if 'scalyr' in self.trackers:
+            agents['scalyr']['agent_json_rewrites'] = self.trackers['scalyr'].rewrites.get(
+                self.node.scalyr_config_path, 0)
+
+        return {
+            'duration': self.duration,
+            'interval': self.interval,
+            'cycles': self.cycles,
+            'api_calls': api_calls,
+            'containers_created': len(self.created),
+            'containers_deleted': len(self.deleted),
+            'agents': agents,
+        }
+
+
+def summary(values) -> dict:
+    if not values:
+        return {'count': 0, 'p50': None, 'p95': None, 'max': None}
+
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50': statistics.median(values),
+        'p95': values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))],
+        'max': values[-1],
+    }
+
+
+def load_phases(args) -> list:
+    if not args.profile:
+        return [Phase(args.duration, args.creates_per_second, args.deletes_per_second)]
+
+    with open(args.profile) as fp:
+        profile = yaml.safe_load(fp)
+
+    return [Phase(p['duration'], p.get('creates_per_second', 0), p.get('deletes_per_second', 0))
+            for p in profile['phases']]
+
+
+def print_results(results, stream=sys.stdout):
+    def fmt(s):
+        if not s['count']:
+            return '{:>24}'.format('-')
+        return '{:>7.1f} {:>7.1f} {:>7.1f}s'.format(s['p50'], s['p95'], s['max'])
+
+    stream.write('simulated {duration}s at {interval}s interval: {cycles} cycles, {containers_created} containers '
+                 'created, {containers_deleted} deleted, {api_calls} pod API calls\n\n'.format(**results))
+
+    header = '{:<12} {:>24} {:>24} {:>8} {:>14} {:>8}'.format(
+        'agent', 'add p50/p95/max', 'remove p50/p95/max', 'writes', 'bytes written', 'deletes')
+    stream.write(header + '\n' + '-' * len(header) + '\n')
+
+    for agent, r in sorted(results['agents'].items()):
+        stream.write('{:<12} {} {} {:>8} {:>14} {:>8}\n'.format(
+            agent, fmt(r['add_latency']), fmt(r['remove_latency']), r['writes'], r['bytes_written'], r['deletes']))
+
+    if 'scalyr' in results['agents']:
+        stream.write('\nScalyr agent.json rewrites: {}\n'.format(results['agents']['scalyr']['agent_json_rewrites']))
+
+
+def main(argv=None):
+    argp = argparse.ArgumentParser(description='Replay pod churn against the watcher loop on a synthetic node.')
+    argp.add_argument('--profile', help='YAML/JSON churn profile with a list of phases. Overrides rate options.')
+    argp.add_argument('--duration', type=int, default=600, help='Simulated seconds. Default: %(default)s')
+    argp.add_argument('--creates-per-second', type=float, default=0.2, help='Pods created per second.')
+    argp.add_argument('--deletes-per-second', type=float, default=0.2, help='Pods deleted per second.')
+    argp.add_argument('--deployments', type=int, default=20, help='Initial deployments. Default: %(default)s')
+    argp.add_argument('--pods-per-deployment', type=int, default=3, help='Default: %(default)s')
+    argp.add_argument('--containers-per-pod', type=int, default=2, help='Default: %(default)s')
+    argp.add_argument('--interval', type=int, default=60, help='Watcher interval. Default: %(default)s')
+    argp.add_argument('--agents', default=','.join(sorted(BUILTIN_AGENTS)),
+                      help='Comma separated list of agents. Default: %(default)s')
+    argp.add_argument('--watcher-config', help='Watcher configuration file passed to watch().')
+    argp.add_argument('--seed', type=int, default=0, help='Random seed. Default: %(default)s')
+    argp.add_argument('--json', action='store_true', help='Print results as JSON.')
+    argp.add_argument('-v', '--verbose', action='store_true', help='Show watcher and agents logs.')
+
+    args = argp.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+
+    node = FakeNode(seed=args.seed)
+    try:
+        simulator = ChurnSimulator(
+            node, load_phases(args), [a.strip() for a in args.agents.split(',') if a.strip()],
+            deployments=args.deployments, pods_per_deployment=args.pods_per_deployment,
+            containers_per_pod=args.containers_per_pod, interval=args.interval,
+            watcher_config_file=args.watcher_config)
+        results = simulator.run()
+    finally:
+        node.cleanup()
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
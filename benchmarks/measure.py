@@ -0,0 +1,127 @@
+"""
+Measurement helpers for the benchmarks.
+
+Every case reports:
+
+* wall time (best and median of the repeated runs),
+* read/write syscalls as accounted by the kernel in ``/proc/self/io`` (``syscr + syscw``; Linux only),
+* filesystem operations (``open``, ``scandir``, ``mkdir``, ``rename``, ``remove``, ``symlink`` ...) counted through
+  Python audit events; ``stat`` calls are not visible this way,
+* peak Python heap allocation, measured with ``tracemalloc`` in one extra run so it does not distort the timings.
+"""
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+
+from collections import namedtuple
+
+FS_EVENTS = frozenset((
+    'open', 'os.listdir', 'os.scandir', 'os.mkdir', 'os.rename', 'os.remove', 'os.rmdir', 'os.symlink', 'os.link',
+    'os.truncate', 'os.chmod', 'os.utime', 'shutil.rmtree', 'shutil.copyfile',
+))
+
+Result = namedtuple('Result', 'case size best median syscalls fs_ops peak_memory extra')
+
+_counting = False
+_fs_ops = 0
+_hook_installed = False
+
+
+def _audit(event, args):
+    global _fs_ops
+
+    if _counting and event in FS_EVENTS:
+        _fs_ops += 1
+
+
+def _install_hook():
+    global _hook_installed
+
+    if not _hook_installed:
+        sys.addaudithook(_audit)
+        _hook_installed = True
+
+
+def io_syscalls():
+    """Return number of read/write syscalls issued by this process so far, or ``None`` if not available."""
+    try:
+        with open('/proc/self/io') as fp:
+            counters = dict(line.split(': ') for line in fp.read().splitlines())
+        return int(counters['syscr']) + int(counters['syscw'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _syscalls_overhead():
+    """Syscalls spent reading ``/proc/self/io`` itself, subtracted from every sample."""
+    start = io_syscalls()
+    end = io_syscalls()
+    return 0 if start is None or end is None else end - start
+
+
+def run(case, size, fn, setup=None, repeat=3, extra=None) -> Result:
+    """
+    Run ``fn(*setup())`` ``repeat`` times plus once under ``tracemalloc``.
+
+    :param setup: Called before every run (outside of measurement), returns positional args for ``fn``.
+    :type setup: callable
+
+    :param extra: Called after the last timed run with its return value; returns a dict of extra columns.
+    :type extra: callable
+    """
+    global _counting, _fs_ops
+
+    _install_hook()
+
+    timings = []
+    syscalls = fs_ops = None
+    result = None
+
+    for _ in range(repeat):
+        args = setup() if setup else ()
+
+        _fs_ops = 0
+        syscalls_start = io_syscalls()
+        _counting = True
+        start = time.perf_counter()
+
+        result = fn(*args)
+
+        timings.append(time.perf_counter() - start)
+        _counting = False
+        syscalls_end = io_syscalls()
+
+        fs_ops = _fs_ops
+        if syscalls_start is not None and syscalls_end is not None:
+            syscalls = syscalls_end - syscalls_start - _syscalls_overhead()
+
+    extra_columns = extra(result) if extra else {}
+
+    args = setup() if setup else ()
+    tracemalloc.start()
+    try:
+        fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return Result(case, size, min(timings), statistics.median(timings), syscalls, fs_ops, peak, extra_columns)
+
+
+def report(results, as_json=False, stream=sys.stdout):
+    if as_json:
+        json.dump([r._asdict() for r in results], stream, indent=2)
+        stream.write('\n')
+        return
+
+    header = '{:<36} {:>6} {:>10} {:>10} {:>10} {:>8} {:>12}  {}'.format(
+        'case', 'size', 'best ms', 'median ms', 'syscalls', 'fs ops', 'peak KiB', 'extra')
+    stream.write(header + '\n' + '-' * len(header) + '\n')
+
+    for r in results:
+        stream.write('{:<36} {:>6} {:>10.2f} {:>10.2f} {:>10} {:>8} {:>12.1f}  {}\n'.format(
+            r.case, r.size, r.best * 1000, r.median * 1000,
+            '-' if r.syscalls is None else r.syscalls, r.fs_ops, r.peak_memory / 1024,
+            ' '.join('{}={}'.format(k, v) for k, v in sorted(r.extra.items()))))
@@ -0,0 +1,335 @@
+"""
+Synthetic Kubernetes node for benchmarks.
+
+A ``FakeNode`` lays out a Docker containers directory (``config.v2.json``, ``hostconfig.json`` and json-file logs per
+container, plus one pause container per pod) together with the directories the builtin agents write to, and serves
+pod metadata from memory as a stand-in for the Kubernetes API.
+"""
+import contextlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import pykube
+
+import kube_log_watcher.kube as kube
+
+from kube_log_watcher.kube import PodNotFound
+
+CLUSTER_ID = 'bench-cluster'
+NODE_NAME = 'bench-node-1'
+SCALYR_API_KEY = 'bench-scalyr-key'
+
+PAUSE_IMAGE = 'gcr.io/google_containers/pause-amd64:3.1'
+
+NAMESPACES = ('default', 'kube-system', 'payments', 'checkout', 'search')
+LEVELS = ('DEBUG', 'INFO', 'INFO', 'INFO', 'WARN', 'ERROR')
+
+# Watcher env variables reaching outside the node: host paths and files, and reload hooks signalling or calling local
+# processes.
+OUTSIDE_ENV_SUFFIXES = ('_PATH', '_FILE', '_DIR', '_RELOAD')
+
+
+def log_line(payload, stream='stdout', timestamp='2020-02-28T10:00:00.000000000Z'):
+    """Return one line as written by the Docker ``json-file`` log driver."""
+    return json.dumps({'log': payload + '\n', 'stream': stream, 'time': timestamp}, separators=(',', ':')) + '\n'
+
+
+class FakeNode:
+    """
+    Synthetic node living in a temporary directory.
+
+    :param root: Base directory. A new temporary directory is created if not set.
+    :type root: str
+
+    :param log_size: Approximate size in bytes of every generated container log file.
+    :type log_size: int
+
+    :param json_ratio: Fraction of deployments emitting JSON log payloads instead of plain text.
+    :type json_ratio: float
+
+    :param api_latency: Seconds to sleep on every pod lookup, to simulate a remote API server.
+    :type api_latency: float
+
+    :param seed: Seed for generated ids and names, so runs are reproducible.
+    :type seed: int
+    """
+
+    def __init__(self, root=None, log_size=4096, json_ratio=0.5, api_latency=0.0, seed=0):
+        self.root = root or tempfile.mkdtemp(prefix='kube-log-watcher-bench-')
+        self.log_size = log_size
+        self.json_ratio = json_ratio
+        self.api_latency = api_latency
+        self.random = random.Random(seed)
+
+        self.containers_path = os.path.join(self.root, 'containers')
+        self.scalyr_dest_path = os.path.join(self.root, 'scalyr', 'logs')
+        self.scalyr_config_path = os.path.join(self.root, 'scalyr', 'etc', 'agent.json')
+        self.scalyr_fragments_path = os.path.join(os.path.dirname(self.scalyr_config_path), 'agent.d')
+        self.scalyr_api_key_file = os.path.join(self.root, 'scalyr', 'secret', 'api-key')
+        self.appdynamics_dest_path = os.path.join(self.root, 'appdynamics', 'jobs')
+        self.symlink_dir = os.path.join(self.root, 'symlinks')
+
+        for path in (self.containers_path, os.path.dirname(self.scalyr_config_path),
+                     os.path.dirname(self.scalyr_api_key_file)):
+            os.makedirs(path, exist_ok=True)
+        self.reset_outputs()
+
+        with open(self.scalyr_api_key_file, 'w') as fp:
+            fp.write(SCALYR_API_KEY)
+
+        # (namespace, pod name) -> pod object as returned by the API server.
+        self.pods = {}
+        # (namespace, pod name) -> container ids (including the pause container).
+        self.pod_containers = {}
+        self.api_calls = 0
+
+    @property
+    def container_ids(self) -> set:
+        return {c for ids in self.pod_containers.values() for c in ids[1:]}
+
+    def environ(self) -> dict:
+        """Env variables pointing the builtin agents at this node."""
+        return {
+            'CLUSTER_NODE_NAME': NODE_NAME,
+            'WATCHER_SCALYR_API_KEY_FILE': self.scalyr_api_key_file,
+            'WATCHER_SCALYR_DEST_PATH': self.scalyr_dest_path,
+            'WATCHER_SCALYR_CONFIG_PATH': self.scalyr_config_path,
+            'WATCHER_SCALYR_CONFIG_FRAGMENTS_PATH': self.scalyr_fragments_path,
+            'WATCHER_APPDYNAMICS_DEST_PATH': self.appdynamics_dest_path,
+            'WATCHER_SYMLINK_DIR': self.symlink_dir,
+            'WATCHER_SYMLINK_MANIFEST_PATH': os.path.join(self.symlink_dir, 'manifest.jsonl'),
+        }
+
+    def sandboxed(self, environ: dict) -> dict:
+        """
+        Return ``environ`` without watcher variables reaching outside the node (see ``OUTSIDE_ENV_SUFFIXES``), and
+        with the agents pointed at this node.
+        """
+        env = {
+            k: v for k, v in environ.items()
+            if not (k.startswith('WATCHER_') and k.endswith(OUTSIDE_ENV_SUFFIXES))
+        }
+        env.update(self.environ())
+
+        return env
+
+    @contextlib.contextmanager
+    def installed(self, environ=None):
+        """
+        Point agents at this node and serve pods from it instead of the Kubernetes API.
+
+        :param environ: Extra env variables (e.g. of a recording) set on top of the current environment, before it is
+                        sandboxed. Undone on exit like everything else.
+        :type environ: dict
+        """
+        saved_environ = dict(os.environ)
+        saved_get_pod = kube.get_pod
+
+        env = self.sandboxed(dict(saved_environ, **(environ or {})))
+        os.environ.clear()
+        os.environ.update(env)
+        kube.get_pod = self.get_pod
+        try:
+            yield self
+        finally:
+            kube.get_pod = saved_get_pod
+            os.environ.clear()
+            os.environ.update(saved_environ)
+
+    def cleanup(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def reset_outputs(self):
+        """Remove everything agents wrote, so the next agents start from scratch."""
+        for path in (self.scalyr_dest_path, self.appdynamics_dest_path, self.symlink_dir):
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+
+        if os.path.exists(self.scalyr_config_path):
+            os.remove(self.scalyr_config_path)
+
+        shutil.rmtree(self.scalyr_fragments_path, ignore_errors=True)
+
+    def get_pod(self, name, namespace=kube.DEFAULT_NAMESPACE, kube_url=None) -> pykube.Pod:
+        self.api_calls += 1
+
+        if self.api_latency:
+            time.sleep(self.api_latency)
+
+        try:
+            return pykube.Pod(None, self.pods[(namespace, name)])
+        except KeyError:
+            raise PodNotFound('Cannot find pod: {}'.format(name))
+
+    def populate(self, containers, containers_per_pod=2, pods_per_deployment=3) -> list:
+        """
+        Add deployments until the node runs ``containers`` application containers (pause containers not included).
+
+        :return: Keys of the created pods.
+        :rtype: list
+        """
+        pods = []
+        deployment = 0
+
+        while containers > 0:
+            application = 'app-{}'.format(deployment)
+            for _ in range(pods_per_deployment):
+                if containers <= 0:
+                    break
+                count = min(containers_per_pod, containers)
+                pods.append(self.add_pod(application, containers=count))
+                containers -= count
+            deployment += 1
+
+        return pods
+
+    def add_pod(self, application, containers=1, namespace=None, labels=None, annotations=None) -> tuple:
+        """
+        Add a pod of ``application`` running ``containers`` containers next to its pause container.
+
+        :return: Pod key, i.e. ``(namespace, name)``.
+        :rtype: tuple
+        """
+        rnd = random.Random(application)
+        namespace = namespace or NAMESPACES[rnd.randrange(len(NAMESPACES))]
+        name = '{}-{:x}-{}'.format(application, rnd.getrandbits(32), self._random_suffix())
+        json_logs = rnd.random() < self.json_ratio
+
+        pod_labels = {
+            'application': application,
+            'component': 'main',
+            'environment': 'production',
+            'version': 'v{}'.format(rnd.randrange(1, 100)),
+            'release': str(rnd.randrange(1, 1000)),
+            'pod-template-hash': '{:x}'.format(rnd.getrandbits(32)),
+        }
+        pod_labels.update(labels or {})
+
+        pod_annotations = {
+            'kubernetes-log-watcher/scalyr-parser':
+                json.dumps([{'container': '{}-{}'.format(application, i), 'parser': 'json-java-parser'}
+                            for i in range(containers)]),
+            'kubernetes.io/psp': 'restricted',
+            'prometheus.io/scrape': 'true',
+        }
+        pod_annotations.update(annotations or {})
+
+        key = (namespace, name)
+        self.pods[key] = {
+            'metadata': {
+                'name': name,
+                'namespace': namespace,
+                'uid': self._random_id()[:36],
+                'labels': pod_labels,
+                'annotations': pod_annotations,
+            }
+        }
+
+        ids = [self.add_container(key, 'POD', PAUSE_IMAGE)]
+        for i in range(containers):
+            image = 'registry.example.org/team/{}:{}'.format(application, pod_labels['version'])
+            ids.append(self.add_container(key, '{}-{}'.format(application, i), image, json_logs=json_logs))
+        self.pod_containers[key] = ids
+
+        return key
+
+    def remove_pod(self, key):
+        """Remove pod from the API and its containers from disk."""
+        for container_id in self.pod_containers.pop(key, []):
+            shutil.rmtree(os.path.join(self.containers_path, container_id), ignore_errors=True)
+        self.pods.pop(key, None)
+
+    def add_container(self, pod_key, container_name, image, json_logs=False) -> str:
+        namespace, pod_name = pod_key
+        container_id = self._random_id()
+        container_path = os.path.join(self.containers_path, container_id)
+        log_path = os.path.join(container_path, '{}-json.log'.format(container_id))
+        created = time.strftime('%Y-%m-%dT%H:%M:%S.000000000Z', time.gmtime())
+
+        config = {
+            'ID': container_id,
+            'Created': created,
+            'Path': '/entrypoint.sh',
+            'Args': ['run'],
+            'State': {'Running': True, 'Paused': False, 'Pid': self.random.randrange(1000, 65000),
+                      'StartedAt': created, 'FinishedAt': '0001-01-01T00:00:00Z'},
+            'Image': 'sha256:' + self._random_id(),
+            'LogPath': log_path,
+            'Name': '/k8s_{}_{}_{}_0'.format(container_name, pod_name, namespace),
+            'Driver': 'overlay2',
+            'MountLabel': '',
+            'ProcessLabel': '',
+            'RestartCount': 0,
+            'Config': {
+                'Hostname': pod_name,
+                'Env': ['{}_SERVICE_HOST=10.3.{}.{}'.format(n.upper(), i, i) for i, n in enumerate(NAMESPACES)] + [
+                    'PATH=/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin',
+                    'JAVA_OPTS=-Xmx512m -XX:+UseG1GC',
+                ],
+                'Image': image,
+                'Labels': {
+                    'annotation.io.kubernetes.container.hash': '{:x}'.format(self.random.getrandbits(32)),
+                    'annotation.io.kubernetes.container.restartCount': '0',
+                    'annotation.io.kubernetes.container.terminationMessagePath': '/dev/termination-log',
+                    'io.kubernetes.container.logpath': log_path,
+                    'io.kubernetes.container.name': container_name,
+                    'io.kubernetes.docker.type': 'podsandbox' if container_name == 'POD' else 'container',
+                    'io.kubernetes.pod.name': pod_name,
+                    'io.kubernetes.pod.namespace': namespace,
+                    'io.kubernetes.pod.uid': self.pods.get(pod_key, {}).get('metadata', {}).get('uid', ''),
+                },
+            },
+            'MountPoints': {
+                '/var/run/secrets/kubernetes.io/serviceaccount': {
+                    'Source': '/var/lib/kubelet/pods/{}/volumes/serviceaccount'.format(container_id[:36]),
+                    'Destination': '/var/run/secrets/kubernetes.io/serviceaccount', 'RW': False,
+                },
+            },
+        }
+
+        os.makedirs(os.path.join(container_path, 'checkpoints'))
+        os.makedirs(os.path.join(container_path, 'mounts'))
+
+        with open(os.path.join(container_path, 'config.v2.json'), 'w') as fp:
+            json.dump(config, fp, separators=(',', ':'))
+
+        with open(os.path.join(container_path, 'hostconfig.json'), 'w') as fp:
+            json.dump({'LogConfig': {'Type': 'json-file', 'Config': {'max-size': '50m'}},
+                       'NetworkMode': 'container:' + container_id}, fp)
+
+        for name in ('hostname', 'hosts', 'resolv.conf'):
+            with open(os.path.join(container_path, name), 'w') as fp:
+                fp.write(pod_name + '\n')
+
+        with open(log_path, 'w') as fp:
+            fp.write(self._log_content(container_name, json_logs))
+
+        return container_id
+
+    def _log_content(self, container_name, json_logs) -> str:
+        lines = []
+        size = 0
+
+        while size < self.log_size:
+            level = LEVELS[self.random.randrange(len(LEVELS))]
+            if json_logs:
+                payload = json.dumps({'level': level, 'logger': 'org.example.' + container_name,
+                                      'message': 'handled request', 'duration_ms': self.random.randrange(500)})
+            else:
+                payload = '{} [main] org.example.Handler - handled request in {}ms'.format(
+                    level, self.random.randrange(500))
+            line = log_line(payload)
+            lines.append(line)
+            size += len(line)
+
+        return ''.join(lines)
+
+    def _random_id(self) -> str:
+        return '{:064x}'.format(self.random.getrandbits(256))
+
+    def _random_suffix(self) -> str:
+        return ''.join(self.random.choice('bcdfghjklmnpqrstvwxz2456789') for _ in range(5))
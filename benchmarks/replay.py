@@ -0,0 +1,112 @@
+"""
+Replay a recorded watcher cycle offline.
+
+Record the first cycle on a problematic node with ``--record`` (or ``WATCHER_RECORD_PATH``), copy the file, then:
+
+    $ python -m benchmarks.replay cycle.json.gz --repeat 5
+    $ python -m benchmarks.replay cycle.json.gz --profile cycle.prof   # cProfile of one cycle
+
+The recorded containers are materialised in a temporary directory (``config.v2.json`` and sparse log files of the
+recorded size), pod lookups are answered from the recorded responses, and agents run with the recorded tuning
+environment and watcher configuration, writing to the temporary directory. Paths, files and reload hooks of the
+current environment are never used.
+"""
+import argparse
+import cProfile
+import json
+import logging
+import os
+import pstats
+import sys
+
+import kube_log_watcher.recorder as recorder
+
+from kube_log_watcher.main import get_containers, load_agents, sync_containers_log_agents
+
+from benchmarks.measure import report, run
+from benchmarks.node import FakeNode
+
+
+def materialize(node, recording):
+    """Lay out recorded containers and pods on ``node``."""
+    for container in recording['containers']:
+        container_path = os.path.join(node.containers_path, container['id'])
+        os.makedirs(container_path, exist_ok=True)
+
+        with open(os.path.join(container_path, 'config.v2.json'), 'w') as fp:
+            json.dump(container['config'], fp)
+
+        log_file = os.path.join(container_path, os.path.basename(container['log_file']))
+        with open(log_file, 'w') as fp:
+            fp.truncate(container.get('log_size', 0))
+
+    for lookup in recording['pods']:
+        if lookup['pod'] is not None:
+            node.pods[(lookup['namespace'], lookup['name'])] = lookup['pod']
+
+
+def main(argv=None):
+    argp = argparse.ArgumentParser(description='Replay a recorded watcher cycle offline.')
+    argp.add_argument('recording', help='Recording file written by the watcher --record option.')
+    argp.add_argument('--agents', help='Comma separated list of agents. Default: agents of the recording.')
+    argp.add_argument('--repeat', type=int, default=3, help='Timed runs. Default: %(default)s')
+    argp.add_argument('--profile', help='Write cProfile stats of one cycle to this file and print the top entries.')
+    argp.add_argument('--json', action='store_true', help='Print results as JSON.')
+    argp.add_argument('-v', '--verbose', action='store_true', help='Show watcher and agents logs.')
+
+    args = argp.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+
+    recording = recorder.load(args.recording)
+    agent_names = args.agents.split(',') if args.agents else recording['agents']
+    cluster_id = recording['cluster_id']
+    strict_labels = recording['strict_labels']
+    watched = set(recording['watched_containers'])
+    configuration = dict(recording['watcher_config'] or {}, cluster_id=cluster_id)
+
+    node = FakeNode()
+    try:
+        materialize(node, recording)
+
+        # Recordings of older watchers may hold any variable, only tuning variables are replayed.
+        environ = {k: v for k, v in recording['environ'].items() if k in recorder.RECORDED_ENV}
+        with node.installed(environ):
+            containers = get_containers(node.containers_path)
+            size = len(containers)
+
+            def fresh_agents():
+                node.reset_outputs()
+                return load_agents(agent_names, configuration)
+
+            def cycle(agents):
+                return sync_containers_log_agents(agents, set(watched), containers, node.containers_path, cluster_id,
+                                                  strict_labels=strict_labels)
+
+            def fresh_cycle():
+                node.api_calls = 0
+                return (fresh_agents(),)
+
+            results = [
+                run('get_containers', size, get_containers, setup=lambda: (node.containers_path,),
+                    repeat=args.repeat),
+                run('sync_containers_log_agents', size, cycle, setup=fresh_cycle, repeat=args.repeat,
+                    extra=lambda res: {'new': len(res[0]), 'stale': len(res[1]), 'api_calls': node.api_calls}),
+            ]
+
+            if args.profile:
+                profiler = cProfile.Profile()
+                agents = fresh_agents()
+                profiler.runcall(cycle, agents)
+                profiler.dump_stats(args.profile)
+                pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+    finally:
+        node.cleanup()
+
+    sys.stdout.write('Recording of {} containers from watcher {} at {}\n'.format(
+        len(recording['containers']), recording['watcher_version'], recording['recorded_at']))
+    report(results, as_json=args.json)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
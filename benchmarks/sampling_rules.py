@@ -0,0 +1,115 @@
+"""
+Micro-benchmark of Scalyr sampling rules matching: linear scan over all rules (former implementation) against
+``SamplingRuleIndex``.
+
+    $ python -m benchmarks.sampling_rules --rules 500 --containers 1000
+"""
+import argparse
+import binascii
+import json
+import random
+import sys
+
+from kube_log_watcher.agents.scalyr import ScalyrAgent
+from kube_log_watcher.agents.scalyr_rules import SamplingRuleIndex
+
+from benchmarks.measure import report, run
+
+
+def linear_match(rules, container_data):
+    """Former ``ScalyrAgent.get_scalyr_sampling_rule()``: first matching rule in configuration order."""
+    for rule in rules:
+        if ('application' in rule) and (rule['application'] != container_data['application']):
+            continue
+
+        if ('component' in rule) and (rule['component'] != container_data['component']):
+            continue
+
+        if 'probability' in rule:
+            container_crc = binascii.crc32(container_data['container_id'].encode())
+            if ((container_crc % 100) + 1) > rule['probability'] * 100:
+                continue
+
+        return rule['value']
+
+
+def generate_rules(count, applications, rnd) -> list:
+    rules = []
+    for i in range(count):
+        rule = {
+            'value': json.dumps([{'container': 'main', 'sampling-rules': [
+                {'match_expression': 'DEBUG-{}'.format(i), 'sampling_rate': 0}]}]),
+        }
+
+        kind = rnd.random()
+        if kind < 0.7:
+            rule['application'] = rnd.choice(applications)
+            rule['component'] = rnd.choice(('main', 'worker', 'cron'))
+        elif kind < 0.95:
+            rule['application'] = rnd.choice(applications)
+        else:
+            rule['component'] = rnd.choice(('worker', 'cron'))
+
+        if rnd.random() < 0.3:
+            rule['probability'] = round(rnd.random(), 2)
+
+        rules.append(rule)
+
+    return rules
+
+
+def generate_containers(count, applications, rnd) -> list:
+    return [
+        {
+            'application': rnd.choice(applications),
+            'component': rnd.choice(('main', 'worker', 'cron', 'web')),
+            'container_id': '{:064x}'.format(rnd.getrandbits(256)),
+        }
+        for _ in range(count)
+    ]
+
+
+def main(argv=None):
+    argp = argparse.ArgumentParser(description='Benchmark Scalyr sampling rules matching.')
+    argp.add_argument('--rules', type=int, default=500, help='Number of sampling rules. Default: %(default)s')
+    argp.add_argument('--containers', type=int, default=1000, help='Number of containers. Default: %(default)s')
+    argp.add_argument('--applications', type=int, default=400, help='Distinct applications. Default: %(default)s')
+    argp.add_argument('--repeat', type=int, default=5, help='Timed runs per case. Default: %(default)s')
+    argp.add_argument('--seed', type=int, default=0, help='Random seed. Default: %(default)s')
+    argp.add_argument('--json', action='store_true', help='Print results as JSON.')
+
+    args = argp.parse_args(argv)
+
+    rnd = random.Random(args.seed)
+    applications = ['app-{}'.format(i) for i in range(args.applications)]
+    rules = ScalyrAgent.parse_scalyr_sampling_rules(generate_rules(args.rules, applications, rnd))
+    containers = generate_containers(args.containers, applications, rnd)
+
+    index = SamplingRuleIndex(rules)
+
+    def match_linear():
+        return [linear_match(rules, c) for c in containers]
+
+    def match_index():
+        matched = (index.match(c['application'], c['component'], c['container_id']) for c in containers)
+        return [rule.value if rule else None for rule in matched]
+
+    if match_linear() != match_index():
+        raise RuntimeError('SamplingRuleIndex matches differ from linear scan!')
+
+    def matched(result):
+        return {'matched': sum(1 for value in result if value is not None)}
+
+    size = len(containers)
+    results = [
+        run('linear scan ({} rules)'.format(len(rules)), size, match_linear, repeat=args.repeat, extra=matched),
+        run('index build ({} rules)'.format(len(rules)), size, SamplingRuleIndex, setup=lambda: (rules,),
+            repeat=args.repeat),
+        run('index match ({} rules)'.format(len(rules)), size, match_index, repeat=args.repeat, extra=matched),
+    ]
+
+    report(results, as_json=args.json)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Benchmark Scalyr config rendering: the former ``scalyr.json.jinja2`` template against ``ConfigBuilder``.
+
+Logs are created by the real Scalyr agent for a synthetic node, then rendered with the legacy template (kept in
+``benchmarks/templates``) and with the builder (cold cache, one changed log, pretty output):
+
+    $ python -m benchmarks.scalyr_config --sizes 2000
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+from jinja2 import Environment, FileSystemLoader
+from urllib.parse import quote_plus
+
+from kube_log_watcher.agents.scalyr import ScalyrAgent
+from kube_log_watcher.agents.scalyr_config import ConfigBuilder
+from kube_log_watcher.main import get_containers, get_new_containers_log_targets
+
+from benchmarks.measure import report, run
+from benchmarks.node import CLUSTER_ID, FakeNode
+
+LEGACY_TPL_NAME = 'scalyr.json.jinja2'
+
+
+def legacy_template():
+    env = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')))
+    env.filters['quote_plus'] = lambda x: quote_plus(x or '')
+    return env.get_template(LEGACY_TPL_NAME)
+
+
+def bench_node(node, size, repeat) -> list:
+    node.populate(size)
+    containers = get_containers(node.containers_path)
+    targets = get_new_containers_log_targets(containers, node.containers_path, CLUSTER_ID)
+
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID})
+    for target in targets:
+        agent.add_log_target(target)
+
+    settings = {
+        'scalyr_key': 'bench-api-key',
+        'server_attributes': agent.server_attributes,
+        'monitor_journald': agent.journald,
+        'scalyr_server': agent.scalyr_server,
+        'enable_profiling': agent.enable_profiling,
+    }
+
+    tpl = legacy_template()
+    builder = ConfigBuilder()
+
+    legacy = json.loads(tpl.render(logs=agent.logs.values(), **settings))
+    if legacy != json.loads(builder.render(agent.logs, **settings)):
+        raise RuntimeError('ConfigBuilder output differs from the legacy template output!')
+
+    def output_size(config):
+        return {'bytes': len(config.encode()), 'logs': len(agent.logs)}
+
+    def template_render():
+        return tpl.render(logs=agent.logs.values(), **settings)
+
+    def builder_render(builder):
+        return builder.render(agent.logs, **settings)
+
+    def warm_builder(indent=None):
+        builder = ConfigBuilder(indent=indent)
+        builder.render(agent.logs, **settings)
+
+        # one container changed since last render
+        container_id = next(iter(agent.logs))
+        agent.logs[container_id] = dict(agent.logs[container_id])
+
+        return builder,
+
+    return [
+        run('jinja template', size, template_render, repeat=repeat, extra=output_size),
+        run('builder (cold)', size, builder_render, setup=lambda: (ConfigBuilder(),), repeat=repeat,
+            extra=output_size),
+        run('builder (1 changed log)', size, builder_render, setup=warm_builder, repeat=repeat, extra=output_size),
+        run('builder pretty (cold)', size, builder_render, setup=lambda: (ConfigBuilder(indent=4),), repeat=repeat,
+            extra=output_size),
+        run('builder pretty (1 changed log)', size, builder_render, setup=lambda: warm_builder(indent=4),
+            repeat=repeat, extra=output_size),
+    ]
+
+
+def main(argv=None):
+    argp = argparse.ArgumentParser(description='Benchmark Scalyr config rendering.')
+    argp.add_argument('--sizes', default='2000', help='Comma separated list of log counts. Default: %(default)s')
+    argp.add_argument('--repeat', type=int, default=5, help='Timed runs per case. Default: %(default)s')
+    argp.add_argument('--json', action='store_true', help='Print results as JSON.')
+    argp.add_argument('-v', '--verbose', action='store_true', help='Show agent logs.')
+
+    args = argp.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+
+    results = []
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        node = FakeNode()
+        try:
+            with node.installed():
+                results.extend(bench_node(node, size, args.repeat))
+        finally:
+            node.cleanup()
+
+    report(results, as_json=args.json)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Startup time of ``python -m kube_log_watcher`` up to the first completed watcher cycle on a synthetic node.
+
+The watcher runs in a new interpreter exactly like in production, except that pods are served from a JSON file
+instead of the Kubernetes API. Reported wall time is from spawning the process until the watcher logs the end of its
+first cycle; ``config_loaded_ms`` is the time until it logged its configuration, i.e. interpreter start and imports.
+
+    $ python -m benchmarks.startup --size 1000 --agents 'scalyr;appdynamics;scalyr,appdynamics,symlinker'
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.measure import report, run
+from benchmarks.node import CLUSTER_ID, FakeNode
+
+# Run as ``python -c BOOTSTRAP <pods file> <watcher args>``.
+BOOTSTRAP = '''
+import json
+import runpy
+import sys
+
+import pykube
+
+import kube_log_watcher.kube as kube
+
+with open(sys.argv[1]) as fp:
+    pods = json.load(fp)
+
+
+def get_pod(name, namespace=kube.DEFAULT_NAMESPACE, kube_url=None):
+    try:
+        return pykube.Pod(None, pods['{}/{}'.format(namespace, name)])
+    except KeyError:
+        raise kube.PodNotFound('Cannot find pod: {}'.format(name))
+
+
+kube.get_pod = get_pod
+sys.argv = ['kube_log_watcher'] + sys.argv[2:]
+runpy.run_module('kube_log_watcher', run_name='__main__', alter_sys=True)
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_watcher(node, pods_file, agents, template_cache_dir=None) -> tuple:
+    """
+    Run the watcher until its first cycle completed.
+
+    :return: Secs until the configuration was logged and until the first cycle completed.
+    :rtype: tuple
+    """
+    env = node.sandboxed(dict(os.environ, LOGLEVEL='INFO'))
+    if template_cache_dir:
+        env['WATCHER_TEMPLATE_CACHE_DIR'] = template_cache_dir
+
+    cmd = [sys.executable, '-c', BOOTSTRAP, pods_file, '--containers-path', node.containers_path,
+           '--agents', agents, '--cluster-id', CLUSTER_ID, '--interval', '3600']
+
+    configured = None
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    try:
+        for line in proc.stderr:
+            if configured is None and 'Loaded configuration' in line:
+                configured = time.perf_counter() - start
+            elif 'Watching ' in line:
+                return configured, time.perf_counter() - start
+            elif 'Failed in watch' in line:
+                break
+    finally:
+        proc.kill()
+        proc.wait()
+
+    raise RuntimeError('Watcher did not complete its first cycle with agents {}'.format(agents))
+
+
+def main(argv=None):
+    argp = argparse.ArgumentParser(description='Benchmark watcher startup until the first completed cycle.')
+    argp.add_argument('--size', type=int, default=1000,
+                      help='Number of application containers. Default: %(default)s')
+    argp.add_argument('--agents', default='scalyr;appdynamics;appdynamics,scalyr,symlinker',
+                      help='Semicolon separated list of agent sets, one case each. Default: %(default)s')
+    argp.add_argument('--template-cache', action='store_true',
+                      help='Also run every case with WATCHER_TEMPLATE_CACHE_DIR set.')
+    argp.add_argument('--repeat', type=int, default=3, help='Timed runs per case. Default: %(default)s')
+    argp.add_argument('--json', action='store_true', help='Print results as JSON.')
+
+    args = argp.parse_args(argv)
+
+    def timings(result):
+        return {'config_loaded_ms': round(result[0] * 1000, 1)}
+
+    results = []
+    node = FakeNode()
+    try:
+        node.populate(args.size)
+
+        pods_file = os.path.join(node.root, 'pods.json')
+        with open(pods_file, 'w') as fp:
+            json.dump({'{}/{}'.format(*key): pod for key, pod in node.pods.items()}, fp)
+
+        def setup():
+            node.reset_outputs()
+            return ()
+
+        for agents in (a.strip() for a in args.agents.split(';') if a.strip()):
+            results.append(run('startup {}'.format(agents), args.size,
+                               lambda: start_watcher(node, pods_file, agents),
+                               setup=setup, repeat=args.repeat, extra=timings))
+
+            if args.template_cache:
+                cache_dir = tempfile.mkdtemp(dir=node.root, prefix='templates-')
+                results.append(run('startup {} (template cache)'.format(agents), args.size,
+                                   lambda: start_watcher(node, pods_file, agents, template_cache_dir=cache_dir),
+                                   setup=setup, repeat=args.repeat, extra=timings))
+    finally:
+        node.cleanup()
+
+    report(results, as_json=args.json)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
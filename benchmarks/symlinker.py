@@ -0,0 +1,85 @@
+"""
+Micro-benchmark of the Symlinker agent flush: scan of all link directories (former implementation) against the
+in-memory link index, plus the one-off startup scan building the index.
+
+    $ python -m benchmarks.symlinker --sizes 100,1000,5000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from pathlib import Path
+
+from kube_log_watcher.agents.symlinker import Symlinker
+
+from benchmarks.measure import report, run
+
+
+def legacy_flush(symlink_dir):
+    """Former ``Symlinker.flush()``: glob every container directory for its link and remove dangling ones."""
+    for container_dir in Path(symlink_dir).iterdir():
+        link = next(container_dir.glob('**/*.log'))
+        if not link.exists():
+            shutil.rmtree(str(container_dir))
+
+
+def make_target(root, i) -> dict:
+    container_id = '{:064x}'.format(i)
+    log_file_path = os.path.join(root, 'containers', container_id, '{}-json.log'.format(container_id))
+    os.makedirs(os.path.dirname(log_file_path))
+    with open(log_file_path, 'w') as fp:
+        fp.write('{}\n')
+
+    return {
+        'id': container_id,
+        'kwargs': {
+            'container_id': container_id,
+            'application': 'app-{}'.format(i // 6),
+            'component': 'main',
+            'namespace': 'default',
+            'environment': 'production',
+            'version': 'v1',
+            'container_name': 'app-{}-{}'.format(i // 6, i % 2),
+            'pod_name': 'app-{}-{:x}'.format(i // 6, i // 2),
+            'log_file_path': log_file_path,
+        },
+    }
+
+
+def main(argv=None):
+    argp = argparse.ArgumentParser(description='Benchmark Symlinker agent flush.')
+    argp.add_argument('--sizes', default='100,1000,5000',
+                      help='Comma separated numbers of containers. Default: %(default)s')
+    argp.add_argument('--repeat', type=int, default=5, help='Timed runs per case. Default: %(default)s')
+    argp.add_argument('--json', action='store_true', help='Print results as JSON.')
+
+    args = argp.parse_args(argv)
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        root = tempfile.mkdtemp(prefix='kube-log-watcher-bench-')
+        try:
+            symlink_dir = os.path.join(root, 'symlinks')
+            os.makedirs(symlink_dir)
+
+            agent = Symlinker({'symlink_dir': symlink_dir})
+            for i in range(size):
+                agent.add_log_target(make_target(root, i))
+
+            def new_agent():
+                return Symlinker({'symlink_dir': symlink_dir})
+
+            results.append(run('legacy flush', size, legacy_flush, setup=lambda: (symlink_dir,), repeat=args.repeat))
+            results.append(run('index flush', size, agent.flush, repeat=args.repeat))
+            results.append(run('index startup scan', size, new_agent, repeat=args.repeat,
+                               extra=lambda agent: {'links': len(agent.links)}))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report(results, as_json=args.json)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Benchmark the full sync cycle on a synthetic node.
+
+Measures ``get_containers()``, ``get_new_containers_log_targets()``, ``sync_containers_log_agents()`` (first and idle
+cycle) and every agent's ``flush()`` for each node size:
+
+    $ python -m benchmarks.sync_cycle --sizes 100,1000,5000 --agents scalyr,appdynamics,symlinker
+"""
+import argparse
+import logging
+import sys
+
+from kube_log_watcher.main import (
+    BUILTIN_AGENTS, get_containers, get_new_containers_log_targets, load_agents, sync_containers_log_agents)
+
+from benchmarks.measure import report, run
+from benchmarks.node import CLUSTER_ID, FakeNode
+
+
+def bench_node(node, size, agent_names, repeat) -> list:
+    results = []
+    configuration = {'cluster_id': CLUSTER_ID}
+
+    node.populate(size)
+    containers = get_containers(node.containers_path)
+
+    results.append(run('get_containers', size, get_containers, setup=lambda: (node.containers_path,), repeat=repeat))
+
+    def targets():
+        node.api_calls = 0
+        return get_new_containers_log_targets(containers, node.containers_path, CLUSTER_ID)
+
+    results.append(run('get_new_containers_log_targets', size, targets, repeat=repeat,
+                       extra=lambda res: {'api_calls': node.api_calls, 'targets': len(res)}))
+
+    def fresh_agents(names=agent_names):
+        node.reset_outputs()
+        return load_agents(names, configuration)
+
+    def sync(agents, watched=frozenset()):
+        return sync_containers_log_agents(agents, set(watched), containers, node.containers_path, CLUSTER_ID)
+
+    def synced_agents(names=agent_names):
+        agents = fresh_agents(names)
+        new_ids, _ = sync(agents)
+        return agents, new_ids
+
+    results.append(run('sync (first cycle)', size, sync, setup=lambda: (fresh_agents(),), repeat=repeat))
+    results.append(run('sync (idle cycle)', size, sync, setup=synced_agents, repeat=repeat))
+
+    all_targets = get_new_containers_log_targets(containers, node.containers_path, CLUSTER_ID)
+
+    for name in agent_names:
+        def loaded_agent(name=name):
+            agent, = fresh_agents([name])
+            for target in all_targets:
+                agent.add_log_target(target)
+            return agent,
+
+        def flushed_agent(name=name):
+            agent, = loaded_agent(name)
+            agent.flush()
+            return agent,
+
+        def flush(agent):
+            agent.flush()
+
+        results.append(run('{} flush (first run)'.format(name), size, flush, setup=loaded_agent, repeat=repeat))
+        results.append(run('{} flush (idle)'.format(name), size, flush, setup=flushed_agent, repeat=repeat))
+
+    return results
+
+
+def main(argv=None):
+    argp = argparse.ArgumentParser(description='Benchmark the watcher sync cycle on a synthetic node.')
+    argp.add_argument('--sizes', default='100,1000,5000',
+                      help='Comma separated list of application container counts. Default: %(default)s')
+    argp.add_argument('--agents', default=','.join(sorted(BUILTIN_AGENTS)),
+                      help='Comma separated list of agents. Default: %(default)s')
+    argp.add_argument('--repeat', type=int, default=3, help='Timed runs per case. Default: %(default)s')
+    argp.add_argument('--log-size', type=int, default=4096,
+                      help='Size in bytes of every generated container log. Default: %(default)s')
+    argp.add_argument('--api-latency', type=float, default=0.0,
+                      help='Simulated pod API latency in seconds. Default: %(default)s')
+    argp.add_argument('--json', action='store_true', help='Print results as JSON.')
+    argp.add_argument('-v', '--verbose', action='store_true', help='Show watcher and agents logs.')
+
+    args = argp.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+
+    agent_names = [a.strip() for a in args.agents.split(',') if a.strip()]
+    results = []
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        node = FakeNode(log_size=args.log_size, api_latency=args.api_latency)
+        try:
+            with node.installed():
+                results.extend(bench_node(node, size, agent_names, args.repeat))
+        finally:
+            node.cleanup()
+
+    report(results, as_json=args.json)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,7 @@
 from kube_log_watcher.agents.base import BaseWatcher
 
 from kube_log_watcher.agents.appdynamics import AppDynamicsAgent
+from kube_log_watcher.agents.growth import LogGrowthAgent
 from kube_log_watcher.agents.scalyr import ScalyrAgent
 from kube_log_watcher.agents.symlinker import Symlinker
 
@@ -8,6 +9,7 @@ from kube_log_watcher.agents.symlinker import Symlinker
 __all__ = (
     AppDynamicsAgent,
     BaseWatcher,
+    LogGrowthAgent,
     ScalyrAgent,
     Symlinker,
 )
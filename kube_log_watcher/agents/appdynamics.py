@@ -4,12 +4,26 @@ appdynamics controller.
 """
 import os
 import logging
+import time
 
+from concurrent.futures import ThreadPoolExecutor
+
+from kube_log_watcher import reload
 from kube_log_watcher.agents.base import BaseWatcher
 from kube_log_watcher.template_loader import load_template
+from kube_log_watcher.writer import ConfigWriter
 
 TPL_NAME = 'appdynamics.job.jinja2'
 
+APPDYNAMICS_DEFAULT_WORKERS = 4
+APPDYNAMICS_DEFAULT_RESYNC_INTERVAL = 600
+
+# Pod label selecting how the AppDynamics analytics agent parses Docker json-file lines of the pod containers.
+APPDYNAMICS_LABEL_LOG_FORMAT = 'appdynamics_log_format'
+# ``grok`` matches every line with a regex, ``keyvalue`` splits it with the KeyValue stage instead.
+APPDYNAMICS_LOG_FORMATS = ('grok', 'keyvalue')
+APPDYNAMICS_DEFAULT_LOG_FORMAT = 'grok'
+
 logger = logging.getLogger(__name__)
 
 
@@ -22,9 +36,26 @@ class AppDynamicsAgent(BaseWatcher):
                                'WATCHER_APPDYNAMICS_DEST_PATH must be set.')
 
         self.cluster_id = configuration['cluster_id']
-        self.tpl = load_template(TPL_NAME)
+        self.reload = reload.from_env(self.name, 'WATCHER_APPDYNAMICS')
+        if self.reload and self.reload.window:
+            self.poll_interval = self.reload.window
+        self.writer = ConfigWriter(self.name, on_change=self.reload.notify if self.reload else None)
+        self.workers = int(os.environ.get('WATCHER_APPDYNAMICS_WORKERS', APPDYNAMICS_DEFAULT_WORKERS))
+        # Threads are started on first use and kept until ``close()``.
+        self._pool = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        self.resync_interval = int(
+            os.environ.get('WATCHER_APPDYNAMICS_RESYNC_INTERVAL', APPDYNAMICS_DEFAULT_RESYNC_INTERVAL))
+        self._last_resync = time.monotonic()
+
+        self.log_format = os.environ.get('WATCHER_APPDYNAMICS_LOG_FORMAT', APPDYNAMICS_DEFAULT_LOG_FORMAT).lower()
+        if self.log_format not in APPDYNAMICS_LOG_FORMATS:
+            raise RuntimeError('AppDyanmics watcher agent initialization failed. Env variable '
+                               'WATCHER_APPDYNAMICS_LOG_FORMAT must be one of {}.'.format(
+                                   ', '.join(APPDYNAMICS_LOG_FORMATS)))
 
         self.logs = {}
+        # container ids with job file not written yet
+        self._pending = set()
         self._first_run = True
 
         logger.info('AppDynamics watcher agent initialization complete!')
@@ -33,6 +64,11 @@ class AppDynamicsAgent(BaseWatcher):
     def name(self):
         return 'AppDynamics'
 
+    @property
+    def tpl(self):
+        # Compiled on first use only, and once per process.
+        return load_template(TPL_NAME)
+
     @property
     def first_run(self):
         return self._first_run
@@ -42,19 +78,37 @@ class AppDynamicsAgent(BaseWatcher):
         Update our log targets, and pick relevant log fields from ``target['kwargs']``
         """
         log = {}
-        log['kwargs'] = target['kwargs']
         pod_labels = target['pod_labels']
         container_id = target['id']
 
-        log['kwargs']['app_name'] = pod_labels.get('appdynamics_app')
-        log['kwargs']['app_tier'] = pod_labels.get('appdynamics_tier')
+        # Copy, the target is shared with the other agents.
+        log['kwargs'] = dict(
+            target['kwargs'],
+            app_name=pod_labels.get('appdynamics_app'),
+            app_tier=pod_labels.get('appdynamics_tier'),
+            log_format=self.get_log_format(target),
+        )
 
         log['job_file_path'] = self._get_job_file_path(container_id)
 
         self.logs[target['id']] = log
+        self._pending.add(target['id'])
+
+    def get_log_format(self, target):
+        log_format = target['pod_labels'].get(APPDYNAMICS_LABEL_LOG_FORMAT)
+        if not log_format:
+            return self.log_format
+
+        if log_format.lower() not in APPDYNAMICS_LOG_FORMATS:
+            logger.warning('AppDynamics watcher agent found invalid log format %s for container %s, using %s',
+                           log_format, target['id'], self.log_format)
+            return self.log_format
+
+        return log_format.lower()
 
     def remove_log_target(self, container_id):
         job_file = self._get_job_file_path(container_id)
+        self._pending.discard(container_id)
 
         try:
             del self.logs[container_id]
@@ -62,27 +116,64 @@ class AppDynamicsAgent(BaseWatcher):
             logger.exception('Failed to remove log target: %s', container_id)
 
         try:
-            os.remove(job_file)
+            self.writer.remove(job_file)
             logger.debug('AppDynamics watcher agent Removed container(%s) job file', container_id)
         except OSError:
             logger.exception('AppDynamics watcher agent Failed to remove job file: %s', job_file)
 
     def flush(self):
-        for log in self.logs.values():
-            job_file = log['job_file_path']
-            if not os.path.exists(job_file) or self._first_run:
-                try:
-                    job = self.tpl.render(**log['kwargs'])
+        """
+        Write job files of containers added since the previous flush, on a pool of ``workers`` threads. Job files of
+        known containers are only checked every ``resync_interval`` secs and written again if missing, failed writes
+        are retried on the next flush.
+        """
+        self._resync()
 
-                    with open(job_file, 'w') as fp:
-                        fp.write(job)
+        pending = sorted(self._pending)
 
-                except Exception:
-                    logger.exception('AppDynamics watcher agent failed to write job file %s', job_file)
-                else:
-                    logger.debug('AppDynamics watcher agent updated job file %s', job_file)
+        if self._pool is not None and len(pending) > 1:
+            written = list(self._pool.map(self._write_job, pending))
+        else:
+            written = [self._write_job(container_id) for container_id in pending]
 
+        self._pending = {container_id for container_id, ok in zip(pending, written) if not ok}
         self._first_run = False
 
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def _resync(self):
+        """Queue containers whose job file is missing, e.g. removed by an AppDynamics agent restart."""
+        if not self.resync_interval or time.monotonic() - self._last_resync < self.resync_interval:
+            return
+
+        self._last_resync = time.monotonic()
+
+        missing = {
+            container_id for container_id, log in self.logs.items()
+            if container_id not in self._pending and not os.path.exists(log['job_file_path'])
+        }
+        if missing:
+            logger.warning('AppDynamics watcher agent found %d missing job files, writing them again.', len(missing))
+            self._pending.update(missing)
+
+    def _write_job(self, container_id) -> bool:
+        log = self.logs[container_id]
+        job_file = log['job_file_path']
+        try:
+            job = self.tpl.render(**log['kwargs'])
+
+            written = self.writer.write(job_file, job)
+        except Exception:
+            logger.exception('AppDynamics watcher agent failed to write job file %s', job_file)
+            return False
+
+        if written:
+            logger.debug('AppDynamics watcher agent updated job file %s', job_file)
+
+        return True
+
     def _get_job_file_path(self, container_id):
         return os.path.join(self.dest_path, 'container-{}-jobfile.job'.format(container_id))
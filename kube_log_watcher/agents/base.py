@@ -6,8 +6,17 @@ Base watcher agent.
 class BaseWatcher:
     """
     BaseWatcher implementing a contextmanager.
+
+    Agents setting ``poll_interval`` (secs) get ``poll()`` called that often between watcher cycles, e.g. to pick up
+    changed credentials without waiting for the next cycle.
+
+    Agents with a ``reload`` notifier (see ``kube_log_watcher.reload``) run the log shipper reload hook after flush and
+    on poll, if their config changed.
     """
 
+    poll_interval = None
+    reload = None
+
     def __init__(self, configuration):
         pass
 
@@ -25,6 +34,9 @@ class BaseWatcher:
     def __exit__(self, *exc):
         self.flush()
 
+        if self.reload:
+            self.reload.poll()
+
     def add_log_target(self, target: dict):
         raise NotImplementedError()
 
@@ -33,3 +45,10 @@ class BaseWatcher:
 
     def flush(self):
         raise NotImplementedError()
+
+    def poll(self):
+        if self.reload:
+            self.reload.poll()
+
+    def close(self):
+        """Release resources (e.g. worker threads) when the agent is replaced on a watcher configuration reload."""
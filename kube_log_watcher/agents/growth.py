@@ -0,0 +1,197 @@
+"""
+Log growth watcher agent: measures how fast each watched container log grows, and reports top talkers by container,
+namespace and application. It does not configure any log shipper, and can run next to the other agents.
+"""
+import logging
+import os
+import time
+
+from collections import namedtuple
+
+from kube_log_watcher import metrics
+from kube_log_watcher.agents.base import BaseWatcher
+
+GROWTH_DEFAULT_TOP = 10
+GROWTH_DEFAULT_REPORT_INTERVAL = 300
+
+# Docker ``json-file`` log driver renames the full log to ``<log>.1`` and starts a new one.
+ROTATED_SUFFIX = '.1'
+
+GROWTH_METRIC = 'watcher_log_growth_bytes_per_second'
+GROWTH_TOP_METRIC = 'watcher_log_growth_top_bytes_per_second'
+
+SCOPES = ('container', 'namespace', 'application')
+
+metrics.describe(GROWTH_METRIC, metrics.GAUGE, 'Growth of all watched container logs.')
+metrics.describe(GROWTH_TOP_METRIC, metrics.GAUGE, 'Top growing logs by container, namespace and application.')
+
+LogSample = namedtuple('LogSample', 'time inode size')
+
+logger = logging.getLogger(__name__)
+
+
+class LogGrowthTracker:
+    """
+    Bytes/sec written to container logs between two ``sample()`` calls.
+
+    Each log file is stat'ed once per sample. If the log was rotated since the previous sample, bytes written to the
+    end of the rotated ``<log>.1`` file are counted as well. If it was truncated in place, only its current size is.
+
+    :param clock: Monotonic clock in seconds.
+    :type clock: callable
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+
+        # container id -> (log path, {scope: name})
+        self._logs = {}
+        # container id -> LogSample
+        self._samples = {}
+        # container id -> bytes/sec since previous sample
+        self.rates = {}
+
+    def add(self, container_id, path, namespace=None, application=None, name=None):
+        """
+        Track log of a container.
+
+        :param name: Container name in reports, e.g. ``<namespace>/<pod>/<container>``. Default is ``container_id``.
+        :type name: str
+        """
+        self._logs[container_id] = (path, {
+            'container': name or container_id,
+            'namespace': namespace or 'none',
+            'application': application or 'none',
+        })
+
+    def remove(self, container_id):
+        self._logs.pop(container_id, None)
+        self._samples.pop(container_id, None)
+        self.rates.pop(container_id, None)
+
+    def __contains__(self, container_id):
+        return container_id in self._logs
+
+    def __len__(self):
+        return len(self._logs)
+
+    def sample(self) -> dict:
+        """
+        Stat all tracked logs and update ``rates``. Logs seen for the first time get a rate on the next sample.
+
+        :return: Container id -> bytes/sec since previous sample.
+        :rtype: dict
+        """
+        now = self.clock()
+        rates = {}
+
+        for container_id, (path, _) in self._logs.items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Rotated right now, or container is gone. Keep previous sample.
+                continue
+
+            current = LogSample(now, st.st_ino, st.st_size)
+            previous = self._samples.get(container_id)
+            self._samples[container_id] = current
+
+            if previous is None or current.time <= previous.time:
+                continue
+
+            rates[container_id] = self._written(path, previous, current) / (current.time - previous.time)
+
+        self.rates = rates
+
+        return rates
+
+    def top(self, n, scope='container') -> list:
+        """
+        Return top ``n`` ``(name, bytes/sec)`` by ``scope`` (one of ``SCOPES``), fastest growing first.
+        """
+        totals = {}
+        for container_id, rate in self.rates.items():
+            name = self._logs[container_id][1][scope]
+            totals[name] = totals.get(name, 0) + rate
+
+        return sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+    def total(self) -> float:
+        return sum(self.rates.values())
+
+    @staticmethod
+    def _written(path, previous, current) -> int:
+        if current.inode == previous.inode:
+            # Truncated in place (e.g. copytruncate) if smaller.
+            return current.size - previous.size if current.size >= previous.size else current.size
+
+        try:
+            rotated = os.stat(path + ROTATED_SUFFIX)
+        except OSError:
+            rotated = None
+
+        if rotated is not None and rotated.st_ino == previous.inode and rotated.st_size >= previous.size:
+            return (rotated.st_size - previous.size) + current.size
+
+        # Rotated more than once since previous sample, count what is left.
+        return current.size
+
+
+def format_rate(rate) -> str:
+    for unit in ('B/s', 'KiB/s', 'MiB/s'):
+        if rate < 1024:
+            return '{:.1f} {}'.format(rate, unit)
+        rate /= 1024
+
+    return '{:.1f} GiB/s'.format(rate)
+
+
+class LogGrowthAgent(BaseWatcher):
+    """
+    Watcher agent sampling container log growth every watcher cycle.
+
+    Top talkers are exposed as metrics after every cycle, and logged every ``WATCHER_GROWTH_REPORT_INTERVAL`` secs.
+    """
+
+    def __init__(self, configuration):
+        self.top_n = int(os.environ.get('WATCHER_GROWTH_TOP', GROWTH_DEFAULT_TOP))
+        self.report_interval = int(os.environ.get('WATCHER_GROWTH_REPORT_INTERVAL', GROWTH_DEFAULT_REPORT_INTERVAL))
+
+        self.tracker = LogGrowthTracker()
+        self._last_report = None
+
+        logger.info('Log growth watcher agent initialization complete!')
+
+    @property
+    def name(self):
+        return 'LogGrowth'
+
+    def add_log_target(self, target: dict):
+        kwargs = target['kwargs']
+        self.tracker.add(
+            target['id'], kwargs['log_file_path'], namespace=kwargs['namespace'], application=kwargs['application'],
+            name='{}/{}/{}'.format(kwargs['namespace'], kwargs['pod_name'], kwargs['container_name']))
+
+    def remove_log_target(self, container_id: str):
+        self.tracker.remove(container_id)
+
+    def flush(self):
+        self.tracker.sample()
+
+        metrics.gauge(GROWTH_METRIC, self.tracker.total())
+        metrics.remove(GROWTH_TOP_METRIC)
+        for scope in SCOPES:
+            for talker, rate in self.tracker.top(self.top_n, scope):
+                metrics.gauge(GROWTH_TOP_METRIC, rate, scope=scope, talker=talker)
+
+        now = self.tracker.clock()
+        if self.tracker.rates and (self._last_report is None or now - self._last_report >= self.report_interval):
+            self._last_report = now
+            self.report()
+
+    def report(self):
+        logger.info('Container logs grow %s on %d containers.', format_rate(self.tracker.total()), len(self.tracker))
+        for scope in SCOPES:
+            top = self.tracker.top(self.top_n, scope)
+            logger.info('Top log growth by %s: %s', scope,
+                        ', '.join('{} {}'.format(name, format_rate(rate)) for name, rate in top))
@@ -1,18 +1,26 @@
 """
 Scalyr watcher agent for providing config file and variables required to ship logs to Scalyr.
 """
-import binascii
 import json
 import logging
 import os
 import shutil
+import time
 
+from kube_log_watcher import metrics, reload
 from kube_log_watcher.agents.base import BaseWatcher
-from kube_log_watcher.template_loader import load_template
-
-TPL_NAME = 'scalyr.json.jinja2'
+from kube_log_watcher.agents.scalyr_checkpoints import CheckpointReader
+from kube_log_watcher.agents.scalyr_config import ConfigBuilder
+from kube_log_watcher.agents.scalyr_rules import (
+    AdaptiveSampler, AnnotationIndex, RegexCostAnalyser, SamplingRuleIndex, ADAPTIVE_SAMPLING_DEFAULT_LEVELS,
+    ADAPTIVE_SAMPLING_DEFAULT_WINDOW)
+from kube_log_watcher.writer import ConfigWriter, FlushScheduler, fingerprint
 
 SCALYR_CONFIG_PATH = '/etc/scalyr-agent-2/agent.json'
+# Scalyr agent merges all *.json files in ``agent.d`` directory next to agent.json into its configuration.
+SCALYR_FRAGMENTS_DIR = 'agent.d'
+SCALYR_FRAGMENT_PREFIX = 'container-'
+SCALYR_FRAGMENT_SUFFIX = '.json'
 
 # If exists! we expect serialized json str: '[{"container": "my-container", "parser": "my-custom-parser"}]'
 SCALYR_ANNOTATION_PARSER = 'kubernetes-log-watcher/scalyr-parser'
@@ -22,6 +30,13 @@ SCALYR_ANNOTATION_PARSER = 'kubernetes-log-watcher/scalyr-parser'
 SCALYR_ANNOTATION_SAMPLING_RULES = 'kubernetes-log-watcher/scalyr-sampling-rules'
 # '[{"container": "my-container", "redaction-rules":[{ "match_expression": "<expression here>" }]}]'
 SCALYR_ANNOTATION_REDACTION_RULES = 'kubernetes-log-watcher/scalyr-redaction-rules'
+# '[{"container": "my-container", "write-rate": 10000, "write-burst": 200000}]'
+SCALYR_ANNOTATION_RATE_LIMIT = 'kubernetes-log-watcher/scalyr-rate-limit'
+# Log config keys of per-log rate limits (bytes/sec and bytes), by key in annotation and watcher config entries.
+SCALYR_ANNOTATION_RATE_LIMIT_KEYS = {'write-rate': 'max_write_rate', 'write-burst': 'max_write_burst'}
+SCALYR_CONFIG_RATE_LIMIT_KEYS = {'write_rate': 'max_write_rate', 'write_burst': 'max_write_burst'}
+# ``scalyr_rate_limits`` entry applied to namespaces without their own entry.
+SCALYR_RATE_LIMIT_ANY_NAMESPACE = '*'
 JWT_REDACTION_RULE = {
     "match_expression": "eyJ[a-zA-Z0-9/+_=-]{5,}\\.eyJ[a-zA-Z0-9/+_=-]{5,}\\.[a-zA-Z0-9/+_=-]{5,}",
     "replacement": "+++JWT_TOKEN_REDACTED+++"
@@ -29,28 +44,41 @@ JWT_REDACTION_RULE = {
 SCALYR_DEFAULT_PARSER = 'json'
 SCALYR_DEFAULT_WRITE_RATE = 10000
 SCALYR_DEFAULT_WRITE_BURST = 200000
+SCALYR_DEFAULT_API_KEY_POLL_INTERVAL = 10
+SCALYR_DEFAULT_CHECKPOINTS_INTERVAL = 300
+# JSON payload detection: bytes sampled from the start of the log, min. complete lines and share of JSON lines, and
+# detections of a short log before it is shipped as text for good.
+SCALYR_DETECT_JSON_SAMPLE_SIZE = 8192
+SCALYR_DETECT_JSON_MIN_LINES = 3
+SCALYR_DETECT_JSON_RATIO = 0.8
+SCALYR_DETECT_JSON_MAX_ATTEMPTS = 10
+
+JSON_DETECTION_METRIC = 'watcher_scalyr_json_detection_total'
+COPY_FROM_START_METRIC = 'watcher_scalyr_copy_from_start_total'
+SHIPPING_LAG_METRIC = 'watcher_scalyr_shipping_lag_bytes'
+NODE_SHIPPING_LAG_METRIC = 'watcher_scalyr_node_shipping_lag_bytes'
 
 logger = logging.getLogger(__name__)
 
+# Parsed Scalyr annotations, shared by all containers with the same annotation value.
+ANNOTATION_INDEX = AnnotationIndex()
 
-def container_annotation(annotations, container_name, pod_name, annotation_key, result_key, default=None):
-    if annotations and annotation_key in annotations:
-        try:
-            result_candidates = json.loads(annotations[annotation_key])
-            if type(result_candidates) is not list:
-                logger.warning(
-                    'Scalyr watcher agent found invalid %s annotation in pod: %s. Expected `list` found: `%s`',
-                    annotation_key, pod_name, type(result_candidates))
-            else:
-                for candidate in result_candidates:
-                    if candidate.get('container') == container_name:
-                        return candidate.get(result_key, default)
-        except json.JSONDecodeError:
-            logger.exception(
-                'Scalyr watcher agent failed to load annotation %s for container %s in pod %s',
-                annotation_key, container_name, pod_name)
+# container id -> True if log payload is JSON, False if text; kept across agent reloads, entries of containers gone
+# meanwhile are pruned on the first flush of the new agent.
+DETECTED_JSON_PAYLOAD = {}
+
+# container id -> copy_from_start decision of the policy; kept and pruned like ``DETECTED_JSON_PAYLOAD``.
+COPY_FROM_START = {}
 
-    return default
+metrics.describe(JSON_DETECTION_METRIC, metrics.COUNTER, 'Container log payload detection by result.')
+metrics.describe(COPY_FROM_START_METRIC, metrics.COUNTER,
+                 'Container logs shipped from start or from current end, as decided by copy_from_start policy.')
+metrics.describe(SHIPPING_LAG_METRIC, metrics.GAUGE, 'Bytes of container log not yet uploaded by Scalyr agent.')
+metrics.describe(NODE_SHIPPING_LAG_METRIC, metrics.GAUGE, 'Bytes of all container logs not yet uploaded by Scalyr.')
+
+
+def container_annotation(annotations, container_name, pod_name, annotation_key, result_key, default=None):
+    return ANNOTATION_INDEX.lookup(annotations, container_name, pod_name, annotation_key, result_key, default)
 
 
 def get_parser(annotations, kwargs):
@@ -82,8 +110,200 @@ def get_redaction_rules(annotations, kwargs):
         logger.warning('Scalyr watcher agent found invalid redaction rule annotation in pod/container: %s/%s. '
                        'Expected `list` found: `%s`', kwargs['pod_name'], kwargs['container_name'], type(rules))
         rules = []
-    rules.append(JWT_REDACTION_RULE)
-    return rules
+    # Annotation values are shared between containers, do not modify them.
+    return rules + [JWT_REDACTION_RULE]
+
+
+def rate_limits(entry, keys, source) -> dict:
+    """
+    Return valid rate limits of annotation or watcher config ``entry``, as log config keys.
+
+    :param keys: Entry key -> log config key.
+    :type keys: dict
+    """
+    limits = {}
+    for key, log_key in keys.items():
+        value = entry.get(key)
+        if value is None:
+            continue
+
+        if type(value) is not int or value <= 0:
+            logger.warning('Scalyr watcher agent found invalid `%s` rate limit in %s. Expected positive `int` found: '
+                           '`%s`', key, source, value)
+            continue
+
+        limits[log_key] = value
+
+    return limits
+
+
+def get_rate_limit(annotations, kwargs) -> dict:
+    entry = ANNOTATION_INDEX.get(annotations, SCALYR_ANNOTATION_RATE_LIMIT, kwargs['pod_name']).get(
+        kwargs['container_name'])
+    if not entry:
+        return {}
+
+    return rate_limits(entry, SCALYR_ANNOTATION_RATE_LIMIT_KEYS,
+                       'pod/container: {}/{}'.format(kwargs['pod_name'], kwargs['container_name']))
+
+
+def parse_rate_limits(config) -> dict:
+    """
+    Validate ``scalyr_rate_limits`` watcher configuration: ``{<namespace or *>: {'write_rate': <bytes/sec>,
+    'write_burst': <bytes>}}``.
+
+    :return: Namespace -> rate limits as log config keys.
+    """
+    if not config:
+        return {}
+
+    if type(config) is not dict:
+        logger.warning('Cannot parse scalyr_rate_limits `%s`: expected namespaces mapping', config)
+        return {}
+
+    parsed = {}
+    for namespace, entry in config.items():
+        if type(entry) is not dict:
+            logger.warning('Cannot parse scalyr_rate_limits of namespace `%s`: `%s`', namespace, entry)
+            continue
+
+        source = 'scalyr_rate_limits of namespace {}'.format(namespace)
+        limits = rate_limits(entry, SCALYR_CONFIG_RATE_LIMIT_KEYS, source)
+        if limits:
+            parsed[str(namespace)] = limits
+
+    return parsed
+
+
+def parse_adaptive_sampling(config):
+    """
+    Create ``AdaptiveSampler`` from ``scalyr_adaptive_sampling`` watcher configuration: ``{'threshold': <bytes/sec>,
+    'release': <bytes/sec>, 'window': <secs>, 'levels': [[<sampling rule>, ...], ...]}``. Only ``threshold`` is
+    required, ``release`` defaults to half of it.
+
+    :return: Sampler, or ``None`` if not configured or invalid.
+    :rtype: AdaptiveSampler
+    """
+    if not config:
+        return None
+
+    try:
+        threshold = int(config['threshold'])
+        release = int(config.get('release', threshold // 2))
+        window = int(config.get('window', ADAPTIVE_SAMPLING_DEFAULT_WINDOW))
+        levels = config.get('levels') or ADAPTIVE_SAMPLING_DEFAULT_LEVELS
+
+        if threshold <= 0 or not 0 <= release <= threshold or window < 0:
+            raise ValueError('expected 0 <= `release` <= `threshold`, positive `threshold` and `window`')
+
+        for rules in levels:
+            if type(rules) not in (list, tuple) or not all(type(r) is dict and 'match_expression' in r for r in rules):
+                raise ValueError('`levels` must be lists of sampling rules')
+    except (AttributeError, KeyError, TypeError, ValueError) as error:
+        logger.warning('Cannot parse scalyr_adaptive_sampling `%s`: %s', config, repr(error))
+        return None
+
+    return AdaptiveSampler(levels, threshold=threshold, release=release, window=window)
+
+
+def log_payload(line: bytes):
+    """Return payload of a Docker json-file log line, or ``None`` if the line is not in this format."""
+    if not line.startswith(b'{'):
+        return None
+
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+    payload = entry.get('log') if type(entry) is dict else None
+    return payload if type(payload) is str else None
+
+
+def is_json_object(payload: str) -> bool:
+    payload = payload.strip()
+    if not payload.startswith('{'):
+        return False
+
+    try:
+        return type(json.loads(payload)) is dict
+    except ValueError:
+        return False
+
+
+def detect_json_payload(path, sample_size=SCALYR_DETECT_JSON_SAMPLE_SIZE):
+    """
+    Classify container log payload as JSON or text, from the complete lines in the first ``sample_size`` bytes.
+
+    :return: True if JSON, False if text, None if the log is shorter than ``sample_size`` and does not have enough
+             lines yet.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            sample = os.pread(fd, sample_size, 0)
+        finally:
+            os.close(fd)
+    except OSError:
+        return None
+
+    # Last line is most likely cut.
+    payloads = [p for p in (log_payload(line) for line in sample.split(b'\n')[:-1]) if p and p.strip()]
+    if len(payloads) < SCALYR_DETECT_JSON_MIN_LINES and len(sample) < sample_size:
+        return None
+
+    # Full sample with few (long) lines is decided by the lines it holds.
+    if not payloads:
+        return False
+
+    return sum(1 for p in payloads if is_json_object(p)) >= len(payloads) * SCALYR_DETECT_JSON_RATIO
+
+
+def parse_copy_from_start_policy(policy) -> dict:
+    """
+    Validate ``scalyr_copy_from_start`` watcher configuration: ``{'max_size': <bytes>, 'max_age': <seconds>}``.
+
+    :return: Policy with valid limits only, empty if not configured or invalid.
+    """
+    if not policy:
+        return {}
+
+    try:
+        parsed = {k: int(policy[k]) for k in ('max_size', 'max_age') if policy.get(k) is not None}
+        if any(v < 0 for v in parsed.values()):
+            raise ValueError('`max_size` and `max_age` must not be negative')
+    except (AttributeError, TypeError, ValueError) as error:
+        logger.warning('Cannot parse copy_from_start policy `%s`: %s', policy, repr(error))
+        return {}
+
+    return parsed
+
+
+def copy_from_start(policy, log_file_path, created, now=None) -> bool:
+    """
+    Decide if Scalyr should ship a log without checkpoint from the start, or only new lines from the current end.
+
+    :param policy: Parsed ``scalyr_copy_from_start`` policy, logs are always shipped from start if empty.
+    :type policy: dict
+
+    :param created: Container creation Unix timestamp, age limit is not applied if ``None``.
+    :type created: float
+
+    :return: False if the container is older than ``max_age`` or its log is bigger than ``max_size``.
+    """
+    if 'max_age' in policy and created is not None:
+        if (now if now is not None else time.time()) - created > policy['max_age']:
+            return False
+
+    if 'max_size' in policy:
+        try:
+            size = os.stat(log_file_path).st_size
+        except OSError:
+            return True
+
+        if size > policy['max_size']:
+            return False
+
+    return True
 
 
 class ScalyrAgent(BaseWatcher):
@@ -92,14 +312,22 @@ class ScalyrAgent(BaseWatcher):
         self.scalyr_sampling_rules = ScalyrAgent.parse_scalyr_sampling_rules(
             configuration.get('scalyr_sampling_rules') or [],
         )
+        self.sampling_rules = SamplingRuleIndex(self.scalyr_sampling_rules)
+        self.copy_from_start_policy = parse_copy_from_start_policy(configuration.get('scalyr_copy_from_start'))
+        self.rate_limits = parse_rate_limits(configuration.get('scalyr_rate_limits'))
         self.api_key_file = os.environ.get('WATCHER_SCALYR_API_KEY_FILE')
         self.api_key = None
+        self._api_key_fingerprint = None
+        # Check API key file for changes between watcher cycles (0 disables).
+        self.poll_interval = int(
+            os.environ.get('WATCHER_SCALYR_API_KEY_POLL_INTERVAL', SCALYR_DEFAULT_API_KEY_POLL_INTERVAL)) or None
         self.dest_path = os.environ.get('WATCHER_SCALYR_DEST_PATH')
         self.scalyr_server = os.environ.get('WATCHER_SCALYR_SERVER')
         self.json_parsers_mapping = self.make_json_parsers_mapping(
             os.environ.get('WATCHER_SCALYR_PARSE_LINES_JSON', ''),
         )
         self.enable_profiling = os.environ.get('WATCHER_SCALYR_ENABLE_PROFILING', '').lower() == 'true'
+        self.detect_json = os.environ.get('WATCHER_SCALYR_DETECT_JSON', '').lower() == 'true'
         cluster_alias = os.environ.get('CLUSTER_ALIAS', 'none')
         cluster_environment = os.environ.get('CLUSTER_ENVIRONMENT', 'production')
         node_name = os.environ.get('CLUSTER_NODE_NAME', 'unknown')
@@ -153,8 +381,61 @@ class ScalyrAgent(BaseWatcher):
             'parser': SCALYR_DEFAULT_PARSER
         }
 
-        self.tpl = load_template(TPL_NAME)
+        # Drop rules with expensive regex (limit in microseconds per log line).
+        self.regex_costs = None
+        regex_cost_limit = os.environ.get('WATCHER_SCALYR_REGEX_COST_LIMIT')
+        if regex_cost_limit:
+            self.regex_costs = RegexCostAnalyser(limit=float(regex_cost_limit) / 1000000)
+
+        self.adaptive_sampling = parse_adaptive_sampling(configuration.get('scalyr_adaptive_sampling'))
+        if self.adaptive_sampling and self.regex_costs:
+            self.adaptive_sampling.levels = [
+                self.regex_costs.filter(rules, 'sampling', 'scalyr_adaptive_sampling')
+                for rules in self.adaptive_sampling.levels]
+
+        # Export shipping lag from Scalyr agent checkpoints, read every ``checkpoints_interval`` secs.
+        self.checkpoints = None
+        self.checkpoints_interval = int(
+            os.environ.get('WATCHER_SCALYR_CHECKPOINTS_INTERVAL', SCALYR_DEFAULT_CHECKPOINTS_INTERVAL))
+        self._checkpoints_read = None
+        checkpoints_path = os.environ.get('WATCHER_SCALYR_CHECKPOINTS_PATH')
+        if checkpoints_path:
+            self.checkpoints = CheckpointReader(checkpoints_path)
+
+        self.fragments_path = None
+        if os.environ.get('WATCHER_SCALYR_CONFIG_FRAGMENTS', '').lower() == 'true':
+            self.fragments_path = os.environ.get(
+                'WATCHER_SCALYR_CONFIG_FRAGMENTS_PATH',
+                os.path.join(os.path.dirname(self.config_path), SCALYR_FRAGMENTS_DIR))
+            os.makedirs(self.fragments_path, exist_ok=True)
+            logger.info('Scalyr watcher agent writes log configs as fragments to %s', self.fragments_path)
+
+        indent = os.environ.get('WATCHER_SCALYR_CONFIG_INDENT')
+        self.builder = ConfigBuilder(indent=int(indent) if indent else None)
+        # Shipper reload hook run after config changes, polled at least every reload window.
+        self.reload = reload.from_env(self.name, 'WATCHER_SCALYR')
+        if self.reload and self.reload.window:
+            self.poll_interval = min(self.poll_interval or self.reload.window, self.reload.window)
+        self.writer = ConfigWriter(self.name, on_change=self.reload.notify if self.reload else None)
+
+        # Batch log changes under pod churn (0 writes every change right away). Deferred changes are written on poll.
+        flush_min_interval = int(os.environ.get('WATCHER_SCALYR_FLUSH_MIN_INTERVAL', 0))
+        flush_max_delay = os.environ.get('WATCHER_SCALYR_FLUSH_MAX_DELAY')
+        self.flush_scheduler = FlushScheduler(
+            self.name, min_interval=flush_min_interval,
+            max_delay=int(flush_max_delay) if flush_max_delay else None)
+        flush_tick = min(flush_min_interval, self.flush_scheduler.max_delay) or flush_min_interval
+        if flush_tick:
+            self.poll_interval = min(self.poll_interval or flush_tick, flush_tick)
         self.logs = {}
+        # container id -> (target, attempts) of containers with a log too short for JSON detection, detected again
+        # on flush up to ``SCALYR_DETECT_JSON_MAX_ATTEMPTS`` times.
+        self._undetected = {}
+        # (stat fingerprint, log paths) of the config file as last written or read by this agent.
+        self._config_state = None
+        # Fragment mode: containers with a fragment on disk, and containers with a changed log since last flush.
+        self._fragments = set()
+        self._dirty = set()
         self._first_run = True
 
         logger.info('Scalyr watcher agent initialization complete!')
@@ -200,25 +481,10 @@ class ScalyrAgent(BaseWatcher):
         return self._first_run
 
     def get_scalyr_sampling_rule(self, container_data):
-        for scalyr_sampling_rule in self.scalyr_sampling_rules:
-            if (
-                ('application' in scalyr_sampling_rule)
-                and (scalyr_sampling_rule['application'] != container_data['application'])
-            ):
-                continue
-
-            if (
-                ('component' in scalyr_sampling_rule)
-                and (scalyr_sampling_rule['component'] != container_data['component'])
-            ):
-                continue
+        rule = self.sampling_rules.match(
+            container_data['application'], container_data['component'], container_data['container_id'])
 
-            if 'probability' in scalyr_sampling_rule:
-                container_crc = binascii.crc32(container_data['container_id'].encode())
-                if ((container_crc % 100) + 1) > scalyr_sampling_rule['probability'] * 100:
-                    continue
-
-            return scalyr_sampling_rule['value']
+        return rule.value if rule else None
 
     def add_log_target(self, target: dict):
         """
@@ -234,7 +500,12 @@ class ScalyrAgent(BaseWatcher):
         annotations = kwargs.get('pod_annotations', {})
 
         parser = get_parser(annotations, kwargs)
-        if parser in self.json_parsers_mapping:
+        json_payload = self._detect_json_payload(target) if self.detect_json else None
+        if json_payload is not None:
+            parse_lines_as_json = json_payload
+            if json_payload:
+                parser = self.json_parsers_mapping.get(parser, parser)
+        elif parser in self.json_parsers_mapping:
             parse_lines_as_json = True
             parser = self.json_parsers_mapping[parser]
         elif '*' in self.json_parsers_mapping:
@@ -262,21 +533,43 @@ class ScalyrAgent(BaseWatcher):
             if v and (self.server_attributes.get(k) != v)
         }
 
-        sampling_rules = self.get_scalyr_sampling_rule(kwargs)
-        if sampling_rules is not None:
+        sampling_rule = self.sampling_rules.match(kwargs['application'], kwargs['component'], kwargs['container_id'])
+        if sampling_rule is not None:
             logger.warning('Overwriting container %s (%s/%s) sampling annotation',
                            kwargs['container_id'], kwargs['application'], kwargs['component'])
-            annotations[SCALYR_ANNOTATION_SAMPLING_RULES] = sampling_rules
+            sampling_rules = sampling_rule.containers.get(kwargs['container_name'], {}).get('sampling-rules')
+        else:
+            sampling_rules = get_sampling_rules(annotations, kwargs)
+
+        redaction_rules = get_redaction_rules(annotations, kwargs)
+
+        if self.regex_costs:
+            source = 'pod {}/{} container {}'.format(kwargs['namespace'], kwargs['pod_name'], kwargs['container_name'])
+            sampling_rules = self.regex_costs.filter(sampling_rules, 'sampling', source)
+            redaction_rules = self.regex_costs.filter(redaction_rules, 'redaction', source, keep=[JWT_REDACTION_RULE])
+
+        if self.adaptive_sampling:
+            self.adaptive_sampling.add(
+                target['id'], kwargs['log_file_path'], sampling_rules, namespace=kwargs['namespace'],
+                application=kwargs['application'],
+                name='{}/{}/{}'.format(kwargs['namespace'], kwargs['pod_name'], kwargs['container_name']))
+            sampling_rules = self.adaptive_sampling.rules(target['id'])
 
         log = {
             'path': log_path,
-            'sampling_rules': get_sampling_rules(annotations, kwargs),
-            'redaction_rules': get_redaction_rules(annotations, kwargs),
+            'sampling_rules': sampling_rules,
+            'redaction_rules': redaction_rules,
             'attributes': attributes,
             'parse_lines_as_json': parse_lines_as_json,
+            'copy_from_start': self._copy_from_start(target),
         }
 
+        # Pod annotation overrides namespace defaults.
+        log.update(self.rate_limits.get(kwargs['namespace'], self.rate_limits.get(SCALYR_RATE_LIMIT_ANY_NAMESPACE, {})))
+        log.update(get_rate_limit(annotations, kwargs))
+
         self.logs[target['id']] = log
+        self._dirty.add(target['id'])
 
     def remove_log_target(self, container_id: str):
         container_dir = os.path.join(self.dest_path, container_id)
@@ -286,17 +579,37 @@ class ScalyrAgent(BaseWatcher):
         except KeyError:
             logger.warning('Failed to remove log target: %s', container_id)
 
+        self.builder.discard(container_id)
+        self._undetected.pop(container_id, None)
+        DETECTED_JSON_PAYLOAD.pop(container_id, None)
+        COPY_FROM_START.pop(container_id, None)
+        if self.adaptive_sampling:
+            self.adaptive_sampling.remove(container_id)
+        metrics.remove(SHIPPING_LAG_METRIC, container_id=container_id)
+
         try:
             shutil.rmtree(container_dir)
         except OSError:
             logger.warning('Scalyr watcher agent failed to remove container directory %s', container_dir)
 
-    def flush(self):
-        current_paths = self._get_current_log_paths()
-        new_paths = {log['path'] for log in self.logs.values()}
+    def poll(self):
+        """
+        Rewrite config right away if the API key file changed, or deferred log changes are due, instead of waiting
+        for the next cycle.
+        """
+        if not self._first_run:
+            current = fingerprint(self.api_key_file)
+            if current is not None and current != self._api_key_fingerprint:
+                logger.debug('Scalyr watcher agent detected API key file change.')
+                self.flush()
+            elif self.flush_scheduler.due():
+                logger.debug('Scalyr watcher agent writing deferred log changes.')
+                self.flush()
 
-        with open(self.api_key_file) as f:
-            new_api_key = f.read()
+        super().poll()
+
+    def flush(self):
+        new_api_key = self._read_api_key()
 
         new_key = (self.api_key != new_api_key)
         if new_key:
@@ -304,30 +617,259 @@ class ScalyrAgent(BaseWatcher):
             if not self._first_run:
                 logger.info('Scalyr API key updated')
 
-        if self._first_run or new_key or (new_paths ^ current_paths):
+        if self._first_run:
+            self._prune_container_state()
+
+        adapted = self._adapt_sampling() | self._redetect_json_payload()
+        self._export_shipping_lag()
+
+        if self.fragments_path:
+            return self._flush_fragments(new_key)
+
+        current_paths = self._current_log_paths()
+        new_paths = {log['path'] for log in self.logs.values()}
+
+        if adapted or (new_paths ^ current_paths):
+            self.flush_scheduler.change(added=bool(adapted or (new_paths - current_paths)))
+
+        if self._first_run or new_key or self.flush_scheduler.due():
             logger.debug('Scalyr watcher agent new paths: %s', new_paths)
             logger.debug('Scalyr watcher agent current paths: %s', current_paths)
             try:
-                config = self.tpl.render(
-                    scalyr_key=self.api_key,
-                    server_attributes=self.server_attributes,
-                    logs=self.logs.values(),
-                    monitor_journald=self.journald,
-                    scalyr_server=self.scalyr_server,
-                    enable_profiling=self.enable_profiling,
-                )
-
-                with open(self.config_path, 'w') as fp:
-                    fp.write(config)
+                config = self._render_config(logs=self.logs)
+
+                written = self.writer.write(self.config_path, config)
             except Exception:
                 logger.exception('Scalyr watcher agent failed to write config file.')
             else:
                 self._first_run = False
-                logger.info('Scalyr watcher agent updated config file %s with +%s -%s log targets.',
-                            self.config_path,
-                            len(new_paths - current_paths),
-                            len(current_paths - new_paths)
-                            )
+                self._config_state = (fingerprint(self.config_path), new_paths)
+                self.flush_scheduler.done()
+                if written:
+                    logger.info('Scalyr watcher agent updated config file %s with +%s -%s log targets.',
+                                self.config_path,
+                                len(new_paths - current_paths),
+                                len(current_paths - new_paths)
+                                )
+                else:
+                    logger.info('Scalyr watcher agent config file %s is up to date.', self.config_path)
+        elif self.flush_scheduler.pending:
+            self.flush_scheduler.defer()
+            logger.debug('Scalyr watcher agent deferred config file update.')
+
+    def close(self):
+        if self.regex_costs:
+            self.regex_costs.close()
+
+    def _adapt_sampling(self) -> set:
+        """Update sampling rules of containers with a changed adaptive sampling level, return their IDs."""
+        if not self.adaptive_sampling:
+            return set()
+
+        try:
+            changed = self.adaptive_sampling.update()
+        except Exception:
+            logger.exception('Scalyr watcher agent failed to update adaptive sampling.')
+            return set()
+
+        for container_id in changed:
+            if container_id in self.logs:
+                # Log dicts are not modified in place, see ``ConfigBuilder``.
+                self.logs[container_id] = dict(
+                    self.logs[container_id], sampling_rules=self.adaptive_sampling.rules(container_id))
+                self._dirty.add(container_id)
+
+        return changed
+
+    def _redetect_json_payload(self) -> set:
+        """Detect payload of logs which were too short when added, rebuild their log entry and return their IDs."""
+        detected = set()
+        for container_id, (target, _) in list(self._undetected.items()):
+            if self._detect_json_payload(target) is None:
+                continue
+
+            # Decision is kept, the log entry is rebuilt without sampling again.
+            self.add_log_target(target)
+            detected.add(container_id)
+
+        return detected
+
+    def _prune_container_state(self):
+        """Drop decisions of containers removed while agents were reloaded."""
+        for state in (DETECTED_JSON_PAYLOAD, COPY_FROM_START):
+            for container_id in state.keys() - self.logs.keys():
+                del state[container_id]
+
+    def _export_shipping_lag(self):
+        if not self.checkpoints:
+            return
+
+        now = time.monotonic()
+        if self._checkpoints_read is not None and now - self._checkpoints_read < self.checkpoints_interval:
+            return
+        self._checkpoints_read = now
+
+        try:
+            lag = self.checkpoints.lag({container_id: log['path'] for container_id, log in self.logs.items()})
+        except Exception:
+            logger.exception('Scalyr watcher agent failed to read Scalyr agent checkpoints.')
+            return
+
+        metrics.remove(SHIPPING_LAG_METRIC)
+        for container_id, lag_bytes in lag.items():
+            attributes = self.logs[container_id]['attributes']
+            metrics.gauge(SHIPPING_LAG_METRIC, lag_bytes, container_id=container_id,
+                          namespace=attributes.get('namespace', ''), pod=attributes.get('pod', ''),
+                          container=attributes.get('container', ''))
+        metrics.gauge(NODE_SHIPPING_LAG_METRIC, sum(lag.values()))
+
+    def _read_api_key(self) -> str:
+        """
+        Return API key, reading the key file only if its stat fingerprint changed.
+
+        The fingerprint follows symlinks, so a Kubernetes secret update (swap of the ``..data`` symlink) is detected.
+        """
+        current = fingerprint(self.api_key_file)
+        if self.api_key is not None and current is not None and current == self._api_key_fingerprint:
+            return self.api_key
+
+        with open(self.api_key_file) as f:
+            api_key = f.read()
+
+        self._api_key_fingerprint = current
+
+        return api_key
+
+    def _render_config(self, logs):
+        return self.builder.render(
+            logs,
+            scalyr_key=self.api_key,
+            server_attributes=self.server_attributes,
+            monitor_journald=self.journald,
+            scalyr_server=self.scalyr_server,
+            enable_profiling=self.enable_profiling,
+        )
+
+    def _flush_fragments(self, new_key):
+        """
+        Write global settings to the main config file and one fragment per container log, touching only fragments of
+        containers added or removed since last flush.
+        """
+        if self._first_run:
+            # Containers removed while the watcher was not running.
+            self._fragments = self._get_current_fragments()
+            self._dirty.update(self.logs.keys())
+
+        if self._first_run or new_key:
+            try:
+                self.writer.write(self.config_path, self._render_config(logs={}))
+            except Exception:
+                logger.exception('Scalyr watcher agent failed to write config file.')
+                return
+
+        if self._dirty or (self._fragments - self.logs.keys()):
+            self.flush_scheduler.change(added=bool(self._dirty))
+
+        if not (self._first_run or new_key or self.flush_scheduler.due()):
+            if self.flush_scheduler.pending:
+                self.flush_scheduler.defer()
+                logger.debug('Scalyr watcher agent deferred config fragments update.')
+            return
+
+        added = 0
+        for container_id in sorted(self._dirty):
+            log = self.logs.get(container_id)
+            if log is None:
+                continue
+
+            fragment_file = self._fragment_file(container_id)
+            try:
+                if self.writer.write(fragment_file, self.builder.fragment(container_id, log)):
+                    added += 1
+            except Exception:
+                logger.exception('Scalyr watcher agent failed to write config fragment %s', fragment_file)
+            else:
+                self._fragments.add(container_id)
+                self._dirty.discard(container_id)
+
+        removed = 0
+        for container_id in sorted(self._fragments - self.logs.keys()):
+            fragment_file = self._fragment_file(container_id)
+            try:
+                self.writer.remove(fragment_file)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logger.exception('Scalyr watcher agent failed to remove config fragment %s', fragment_file)
+                continue
+
+            self._fragments.discard(container_id)
+
+        self._dirty.intersection_update(self.logs.keys())
+        self._first_run = False
+        self.flush_scheduler.done()
+
+        if added or removed:
+            logger.info('Scalyr watcher agent updated config fragments in %s with +%s -%s log targets.',
+                        self.fragments_path, added, removed)
+
+    def _fragment_file(self, container_id):
+        return os.path.join(
+            self.fragments_path, '{}{}{}'.format(SCALYR_FRAGMENT_PREFIX, container_id, SCALYR_FRAGMENT_SUFFIX))
+
+    def _get_current_fragments(self) -> set:
+        try:
+            return {
+                f[len(SCALYR_FRAGMENT_PREFIX):-len(SCALYR_FRAGMENT_SUFFIX)]
+                for f in os.listdir(self.fragments_path)
+                if f.startswith(SCALYR_FRAGMENT_PREFIX) and f.endswith(SCALYR_FRAGMENT_SUFFIX)
+            }
+        except OSError:
+            logger.exception('Scalyr watcher agent failed to list config fragments in %s', self.fragments_path)
+            return set()
+
+    def _detect_json_payload(self, target):
+        container_id = target['id']
+
+        if container_id not in DETECTED_JSON_PAYLOAD:
+            json_payload = detect_json_payload(target['kwargs']['log_file_path'])
+            attempts = self._undetected.pop(container_id, (None, 0))[1] + 1
+            if json_payload is None and attempts >= SCALYR_DETECT_JSON_MAX_ATTEMPTS:
+                logger.debug('Scalyr watcher agent ships container %s log as text, too few lines after %d attempts.',
+                             container_id, attempts)
+                json_payload = False
+
+            metrics.inc(JSON_DETECTION_METRIC,
+                        result={True: 'json', False: 'text', None: 'undecided'}[json_payload])
+            if json_payload is None:
+                # Log is (almost) empty, detected again on flush.
+                self._undetected[container_id] = (target, attempts)
+                return None
+
+            logger.debug('Scalyr watcher agent detected %s payload in container %s log.',
+                         'JSON' if json_payload else 'text', container_id)
+            DETECTED_JSON_PAYLOAD[container_id] = json_payload
+
+        return DETECTED_JSON_PAYLOAD[container_id]
+
+    def _copy_from_start(self, target) -> bool:
+        if not self.copy_from_start_policy:
+            return True
+
+        container_id = target['id']
+
+        if container_id not in COPY_FROM_START:
+            kwargs = target['kwargs']
+            decision = copy_from_start(
+                self.copy_from_start_policy, kwargs['log_file_path'], kwargs.get('container_created'))
+            metrics.inc(COPY_FROM_START_METRIC, result='start' if decision else 'end')
+            if not decision:
+                logger.info('Scalyr watcher agent ships only new lines of container %s log in pod %s/%s.',
+                            kwargs['container_name'], kwargs['namespace'], kwargs['pod_name'])
+            COPY_FROM_START[container_id] = decision
+
+        return COPY_FROM_START[container_id]
 
     def _adjust_target_log_path(self, target):
         try:
@@ -355,6 +897,22 @@ class ScalyrAgent(BaseWatcher):
             logger.exception('Scalyr watcher agent Failed to adjust log path.')
             return None
 
+    def _current_log_paths(self) -> set:
+        """
+        Return log paths in the config file, from memory unless the file changed since this agent wrote or read it.
+        """
+        current = fingerprint(self.config_path)
+        if current is not None and self._config_state and self._config_state[0] == current:
+            return self._config_state[1]
+
+        if self._config_state:
+            logger.warning('Scalyr watcher agent config file %s changed unexpectedly, reloading.', self.config_path)
+
+        paths = self._get_current_log_paths()
+        self._config_state = (current, paths) if current is not None else None
+
+        return paths
+
     def _get_current_log_paths(self) -> set:
         targets = set()
 
@@ -0,0 +1,128 @@
+"""
+Scalyr agent checkpoints: how far into each log the Scalyr agent has uploaded, and how far behind it is.
+
+The Scalyr agent keeps ``checkpoints.json`` (all logs) and ``active-checkpoints.json`` (recently active logs, written
+more often) in its data directory. Newer agents write one pair per copying worker, with the worker id as suffix
+(e.g. ``checkpoints-0.json``). Checkpoints are keyed by the log path in the agent config, and record an abstract
+``position`` together with the ``position_start`` and ``inode`` of every pending file of the log (current and rotated).
+"""
+import glob
+import json
+import logging
+import os
+
+from kube_log_watcher.writer import fingerprint
+
+CHECKPOINTS_GLOB = '*checkpoints*.json'
+
+logger = logging.getLogger(__name__)
+
+
+def parse_checkpoints(content) -> tuple:
+    """
+    Return ``(time, {log path: checkpoint})`` of a Scalyr checkpoints file content.
+    """
+    state = json.loads(content)
+    if type(state) is not dict or type(state.get('checkpoints')) is not dict:
+        raise ValueError('Unexpected checkpoints file format')
+
+    return state.get('time') or 0, state['checkpoints']
+
+
+def uploaded_offset(checkpoint, inode):
+    """
+    Return bytes uploaded from the log file with ``inode``, ``0`` if the checkpoint has no pending file with this inode
+    (e.g. not opened by the Scalyr agent since rotation), or ``None`` if the checkpoint format is unknown.
+    """
+    try:
+        position = checkpoint['position']
+        pending_files = checkpoint.get('pending_files')
+
+        if pending_files is None:
+            # Plain byte offset into the file.
+            return int(position)
+
+        for pending in pending_files:
+            if pending.get('inode') == inode:
+                return max(0, int(position) - int(pending['position_start']))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+    return 0
+
+
+class CheckpointReader:
+    """
+    Read Scalyr agent checkpoints, parsing the checkpoint files only when they changed.
+
+    :param data_path: Scalyr agent data directory, e.g. ``/var/lib/scalyr-agent-2``.
+    :type data_path: str
+    """
+
+    def __init__(self, data_path):
+        self.data_path = data_path
+        self.parsed = 0
+
+        # checkpoints file -> (stat fingerprint, time, checkpoints)
+        self._files = {}
+
+    def checkpoints(self) -> dict:
+        """
+        Return ``log path -> checkpoint``, the most recent one if a log is in more than one checkpoints file.
+        """
+        files = {}
+        for path in glob.glob(os.path.join(self.data_path, CHECKPOINTS_GLOB)):
+            current = fingerprint(path)
+            if current is None:
+                continue
+
+            cached = self._files.get(path)
+            if cached is None or cached[0] != current:
+                try:
+                    with open(path) as fp:
+                        cached = (current,) + parse_checkpoints(fp.read())
+                except Exception as error:
+                    # Most likely written right now, keep previous state.
+                    logger.debug('Cannot read Scalyr checkpoints file %s: %s', path, repr(error))
+                    if cached is None:
+                        continue
+                else:
+                    self.parsed += 1
+
+            files[path] = cached
+
+        self._files = files
+
+        result = {}
+        for _, _, checkpoints in sorted(files.values(), key=lambda cached: cached[1]):
+            result.update(checkpoints)
+
+        return result
+
+    def lag(self, log_paths) -> dict:
+        """
+        Return bytes not yet uploaded of each log in ``log_paths``, for logs with a checkpoint.
+
+        Only the current log file is compared, bytes left in rotated files are not counted.
+
+        :param log_paths: Key -> log path as in Scalyr agent config.
+        :type log_paths: dict
+        """
+        checkpoints = self.checkpoints()
+
+        result = {}
+        for key, path in log_paths.items():
+            checkpoint = checkpoints.get(path)
+            if checkpoint is None:
+                continue
+
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            offset = uploaded_offset(checkpoint, st.st_ino)
+            if offset is not None:
+                result[key] = max(0, st.st_size - offset)
+
+        return result
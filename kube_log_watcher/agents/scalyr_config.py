@@ -0,0 +1,187 @@
+"""
+Scalyr agent config builder.
+
+The config is assembled as Python objects and serialised with ``json``. Log entries are serialised once and cached by
+container id, so rendering the config after a change only serialises logs which are new or changed.
+"""
+import json
+
+from urllib.parse import quote_plus
+
+JOURNALD_MONITOR_MODULE = 'scalyr_agent.builtin_monitors.journald_monitor'
+
+AGENT_SETTINGS = (
+    ('max_log_offset_size', 536870912),
+    ('max_existing_log_offset_size', 536870912),
+    ('max_allowed_request_size', 5500000),
+    ('min_request_spacing_interval', 0.5),
+    ('max_request_spacing_interval', 1.0),
+    ('pipeline_threshold', 0.1),
+    ('compression_type', 'deflate'),
+    ('compression_level', 6),
+    ('max_line_size', 49900),
+    ('read_page_size', 131072),
+)
+
+
+def rename_logfile(attributes) -> str:
+    return '?' + '&'.join(
+        '{}={}'.format(k, quote_plus(attributes.get(k) or ''))
+        for k in ('application', 'component', 'version', 'container_id'))
+
+
+def log_entry(log) -> dict:
+    """Scalyr ``logs`` entry of a log created by the Scalyr agent ``add_log_target()``."""
+    entry = {
+        'path': log['path'],
+        'rename_logfile': rename_logfile(log['attributes']),
+    }
+
+    if log.get('sampling_rules'):
+        entry['sampling_rules'] = log['sampling_rules']
+    if log.get('redaction_rules'):
+        entry['redaction_rules'] = log['redaction_rules']
+    if log.get('parse_lines_as_json'):
+        entry['parse_lines_as_json'] = True
+
+    for key in ('max_write_rate', 'max_write_burst'):
+        if log.get(key):
+            entry[key] = log[key]
+
+    entry['copy_from_start'] = log.get('copy_from_start', True)
+    entry['attributes'] = log['attributes']
+
+    return entry
+
+
+def journald_monitor(monitor_journald) -> dict:
+    monitor = {}
+    if monitor_journald.get('journal_path'):
+        monitor['journal_path'] = str(monitor_journald['journal_path'])
+
+    # ``journal_fields`` (from ``extra_fields``) is not emitted, it is broken in Scalyr agent.
+    monitor['module'] = JOURNALD_MONITOR_MODULE
+    monitor['monitor_log_write_rate'] = monitor_journald['write_rate']
+    monitor['monitor_log_max_write_burst'] = monitor_journald['write_burst']
+
+    return monitor
+
+
+def journald_log(monitor_journald) -> dict:
+    log = {}
+    if monitor_journald.get('attributes'):
+        log['attributes'] = {k: str(v) for k, v in monitor_journald['attributes'].items()}
+
+    log['journald_unit'] = '.*'
+    log['parser'] = 'journald_monitor'
+
+    return log
+
+
+def config(scalyr_key, server_attributes, logs=(), monitor_journald=None, scalyr_server=None,
+           enable_profiling=False) -> dict:
+    """Full Scalyr agent config as a ``dict``, with ``logs`` entries built by ``log_entry()``."""
+    result = {'api_key': scalyr_key}
+    result.update(AGENT_SETTINGS)
+
+    if enable_profiling:
+        result['enable_profiling'] = True
+
+    result['implicit_metric_monitor'] = False
+    result['implicit_agent_process_metrics_monitor'] = False
+    result['include_raw_timestamp_field'] = False
+    result['server_attributes'] = server_attributes
+
+    if scalyr_server:
+        result['scalyr_server'] = scalyr_server
+
+    result['logs'] = [log_entry(log) for log in logs]
+    result['monitors'] = [journald_monitor(monitor_journald)] if monitor_journald else []
+    result['journald_logs'] = [journald_log(monitor_journald)] if monitor_journald else []
+
+    return result
+
+
+def render_config(scalyr_key, server_attributes, logs=(), monitor_journald=None, scalyr_server=None,
+                  enable_profiling=False, indent=None) -> str:
+    """Serialise ``config()`` in one go, without entries cache."""
+    return dumps(config(scalyr_key, server_attributes, logs, monitor_journald=monitor_journald,
+                        scalyr_server=scalyr_server, enable_profiling=enable_profiling), indent)
+
+
+def dumps(obj, indent=None) -> str:
+    if indent is None:
+        return json.dumps(obj, separators=(',', ':'))
+    return json.dumps(obj, indent=indent)
+
+
+class ConfigBuilder:
+    """
+    Render Scalyr config and config fragments, caching serialised log entries by container id.
+
+    Log dicts are treated as immutable: a log is serialised again only if a different dict is passed for its container.
+
+    :param indent: Indentation for pretty output, compact output if ``None``.
+    :type indent: int
+    """
+
+    def __init__(self, indent=None):
+        self.indent = indent
+        self.serialised = 0
+
+        # container id -> (log, serialised log entry)
+        self._entries = {}
+
+    def entry(self, container_id, log) -> str:
+        cached = self._entries.get(container_id)
+        if cached is not None and cached[0] is log:
+            return cached[1]
+
+        serialised = dumps(log_entry(log), self.indent)
+        self._entries[container_id] = (log, serialised)
+        self.serialised += 1
+
+        return serialised
+
+    def discard(self, container_id):
+        self._entries.pop(container_id, None)
+
+    def render(self, logs: dict, scalyr_key, server_attributes, monitor_journald=None, scalyr_server=None,
+               enable_profiling=False) -> str:
+        """
+        Render full config.
+
+        :param logs: Logs by container id, in config order.
+        :type logs: dict
+        """
+        settings = config(scalyr_key, server_attributes, monitor_journald=monitor_journald,
+                          scalyr_server=scalyr_server, enable_profiling=enable_profiling)
+        entries = [self.entry(container_id, log) for container_id, log in logs.items()]
+
+        return self._object(
+            (k, self._array(entries) if k == 'logs' else dumps(v, self.indent)) for k, v in settings.items())
+
+    def fragment(self, container_id, log) -> str:
+        """Render config fragment holding a single log entry (e.g. for Scalyr ``agent.d`` directory)."""
+        return self._object([('logs', self._array([self.entry(container_id, log)]))])
+
+    def _object(self, items) -> str:
+        """Join already serialised ``(key, value)`` items into a JSON object."""
+        if self.indent is None:
+            return '{' + ','.join('{}:{}'.format(json.dumps(k), v) for k, v in items) + '}'
+
+        return '{\n' + self._indented(',\n'.join('{}: {}'.format(json.dumps(k), v) for k, v in items)) + '\n}'
+
+    def _array(self, values) -> str:
+        """Join already serialised values into a JSON array."""
+        if not values:
+            return '[]'
+
+        if self.indent is None:
+            return '[' + ','.join(values) + ']'
+
+        return '[\n' + self._indented(',\n'.join(values)) + '\n]'
+
+    def _indented(self, text) -> str:
+        pad = ' ' * self.indent
+        return pad + text.replace('\n', '\n' + pad)
@@ -5,8 +5,12 @@ log shipping agent (e.g. Fluentd) that watches the directory structure
 containing the symlinks. Since all metadata is embedded in the
 filename, there is no need to dynamically generate configuration for
 the log shipping agent.
+
+In manifest mode (``WATCHER_SYMLINK_MANIFEST``) no links are created. A single JSON lines file maps every container log
+to its metadata instead, so the log shipping agent watches one file instead of a deep directory tree.
 """
 
+import json
 import logging
 import os
 import pathlib
@@ -14,6 +18,14 @@ import re
 import shutil
 
 from kube_log_watcher.agents.base import BaseWatcher
+from kube_log_watcher.writer import ConfigWriter
+
+SYMLINK_MANIFEST_NAME = 'manifest.jsonl'
+
+MANIFEST_FIELDS = (
+    'container_id', 'container_name', 'pod_name', 'namespace', 'application', 'component', 'environment', 'version',
+    'release', 'node_name', 'cluster_id',
+)
 
 logger = logging.getLogger(__name__)
 
@@ -33,7 +45,26 @@ class Symlinker(BaseWatcher):
             raise RuntimeError(
                 'Symlinker watcher agent initialization failed. Symlink base directory {} does not exist'
                 .format(self.symlink_dir))
-        logger.info('Symlinker watcher agent initialized')
+
+        # container directory name -> (link path, link target) of links on disk, kept in sync with every change.
+        self.links = {}
+        # Entries loaded from disk, verified on next flush.
+        self._unverified = set()
+
+        self.manifest_path = None
+        if os.environ.get('WATCHER_SYMLINK_MANIFEST', '').lower() == 'true':
+            self.manifest_path = os.environ.get(
+                'WATCHER_SYMLINK_MANIFEST_PATH', str(self.symlink_dir / SYMLINK_MANIFEST_NAME))
+            self.writer = ConfigWriter(self.name)
+            # container id -> manifest line
+            self.manifest = {}
+            self._manifest_changed = True
+
+            logger.info('Symlinker watcher agent writes log manifest to %s', self.manifest_path)
+        else:
+            self._load_links()
+
+            logger.info('Symlinker watcher agent initialized with %d existing links', len(self.links))
 
     @property
     def name(self):
@@ -42,7 +73,12 @@ class Symlinker(BaseWatcher):
     def add_log_target(self, target):
         logger.debug('Symlinker: add_log_target for %s called', target['id'])
         kw = target['kwargs']
-        top_dir = self.symlink_dir / sanitize(kw['container_id'])
+
+        if self.manifest_path:
+            return self._add_manifest_entry(target)
+
+        key = sanitize(kw['container_id'])
+        top_dir = self.symlink_dir / key
         link_dir = top_dir \
             / sanitize(kw['application'] or 'none') \
             / sanitize(kw['component'] or kw['application'] or 'none') \
@@ -52,21 +88,47 @@ class Symlinker(BaseWatcher):
             / sanitize(kw['container_name'])
         link = (link_dir / sanitize(kw['pod_name'])).with_suffix('.log')
 
-        if top_dir.exists():
-            if link.is_symlink and link.samefile(kw['log_file_path']):
+        if self.links.get(key) == (link, kw['log_file_path']):
+            # Single lstat, links may be removed behind our back (e.g. by a shipper cleanup or an operator).
+            if link.is_symlink():
                 logger.debug('Symlinker: link already exists for %s. Nothing to be done.', target['id'])
                 return
+
+            logger.info('Symlinker: symlink of %s is missing. Creating it again.', target['id'])
+            del self.links[key]
+            shutil.rmtree(str(top_dir), ignore_errors=True)
+
+        current_link, current_target = self.links.get(key, (None, None))
+        if current_link is not None and current_target == kw['log_file_path'] and self._move_link(current_link, link):
+            logger.info('Symlinker: metadata has changed for %s. Moved symlink to %s', target['id'], link)
+            self.links[key] = (link, kw['log_file_path'])
+            self._unverified.discard(key)
+            return
+
+        if key in self.links or top_dir.exists():
             logger.info('Symlinker: metadata has changed for %s. Creating new symlink.', target['id'])
-            shutil.rmtree(str(top_dir))
+            shutil.rmtree(str(top_dir), ignore_errors=True)
             logger.debug('Symlinker: Removed directory %s', top_dir)
 
         link_dir.mkdir(parents=True)
         link.symlink_to(kw['log_file_path'])
+        self.links[key] = (link, kw['log_file_path'])
+        self._unverified.discard(key)
         logger.debug('Symlinker: Created symlink %s -> %s', link, kw['log_file_path'])
 
     def remove_log_target(self, container_id):
         logger.debug('Symlinker: remove_log_target for %s called', container_id)
-        link_dir = str(self.symlink_dir / sanitize(container_id))
+
+        if self.manifest_path:
+            if self.manifest.pop(container_id, None) is not None:
+                self._manifest_changed = True
+            return
+
+        key = sanitize(container_id)
+        self.links.pop(key, None)
+        self._unverified.discard(key)
+
+        link_dir = str(self.symlink_dir / key)
         try:
             shutil.rmtree(link_dir)
             logger.debug('Symlinker: Removed directory %s', link_dir)
@@ -74,9 +136,89 @@ class Symlinker(BaseWatcher):
             logger.warning('%s watcher agent failed to remove link directory %s', self.name, link_dir)
 
     def flush(self):
-        for container_dir in pathlib.Path(self.symlink_dir).iterdir():
-            link = next(pathlib.Path(container_dir).glob('**/*.log'))
-            if link and link.exists():
+        """Remove container directories found on startup without a valid link, e.g. of containers gone meanwhile."""
+        if self.manifest_path:
+            return self._flush_manifest()
+
+        for key in sorted(self._unverified):
+            link, _ = self.links[key]
+            if link is not None and link.exists():
                 continue
-            else:
-                shutil.rmtree(str(container_dir))
+
+            shutil.rmtree(str(self.symlink_dir / key), ignore_errors=True)
+            del self.links[key]
+            logger.debug('Symlinker: Removed dangling link directory for %s', key)
+
+        self._unverified.clear()
+
+    def _load_links(self):
+        """Index links already on disk (e.g. after a restart) with a single scan of the symlink directory."""
+        for entry in os.scandir(str(self.symlink_dir)):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+
+            link = target = None
+            for root, _, files in os.walk(entry.path):
+                logs = [f for f in files if f.endswith('.log')]
+                if logs:
+                    link = pathlib.Path(root) / logs[0]
+                    break
+
+            if link is not None:
+                try:
+                    target = os.readlink(str(link))
+                except OSError:
+                    link = None
+
+            self.links[entry.name] = (link, target)
+            self._unverified.add(entry.name)
+
+    def _move_link(self, current, link) -> bool:
+        """
+        Rename ``current`` link to ``link`` in the same container directory, keeping the link inode so shippers
+        following it keep their offsets, and remove directories left empty.
+
+        :return: False if the link could not be moved.
+        :rtype: bool
+        """
+        top_dir = self.symlink_dir / current.relative_to(self.symlink_dir).parts[0]
+        try:
+            link.parent.mkdir(parents=True, exist_ok=True)
+            os.rename(str(current), str(link))
+        except OSError as e:
+            logger.warning('Symlinker: failed to move symlink %s to %s: %s', current, link, e)
+            return False
+
+        parent = current.parent
+        while parent != top_dir:
+            try:
+                parent.rmdir()
+            except OSError:
+                # Not empty, still holds the new link.
+                break
+            parent = parent.parent
+
+        return True
+
+    def _add_manifest_entry(self, target):
+        kw = target['kwargs']
+        entry = {'log_file_path': kw['log_file_path']}
+        entry.update((field, kw.get(field)) for field in MANIFEST_FIELDS)
+        line = json.dumps(entry, sort_keys=True)
+
+        if self.manifest.get(target['id']) != line:
+            self.manifest[target['id']] = line
+            self._manifest_changed = True
+
+    def _flush_manifest(self):
+        """Write manifest, one line per container log ordered by container id, if any entry changed."""
+        if not self._manifest_changed:
+            return
+
+        content = ''.join(self.manifest[container_id] + '\n' for container_id in sorted(self.manifest))
+        try:
+            self.writer.write(self.manifest_path, content)
+        except Exception:
+            logger.exception('Symlinker watcher agent failed to write manifest %s', self.manifest_path)
+        else:
+            self._manifest_changed = False
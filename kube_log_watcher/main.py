@@ -1,7 +1,9 @@
 import argparse
+import calendar
 import json
 import logging
 import os
+import re
 import sys
 import time
 import yaml
@@ -10,8 +12,10 @@ import sentry_sdk
 from typing import Tuple
 
 import kube_log_watcher.kube as kube
+import kube_log_watcher.metrics as metrics
+import kube_log_watcher.recorder as recorder
 
-from kube_log_watcher.agents import ScalyrAgent, AppDynamicsAgent, Symlinker
+from kube_log_watcher.agents import ScalyrAgent, AppDynamicsAgent, LogGrowthAgent, Symlinker
 
 
 CONTAINERS_PATH = '/mnt/containers/'
@@ -27,6 +31,7 @@ KUBERNETES_PREFIX = 'io.kubernetes.'
 
 BUILTIN_AGENTS = {
     'appdynamics': AppDynamicsAgent,
+    'growth': LogGrowthAgent,
     'scalyr': ScalyrAgent,
     'symlinker': Symlinker,
 }
@@ -35,6 +40,9 @@ BUILTIN_AGENTS = {
 CLUSTER_NODE_NAME = os.environ.get('CLUSTER_NODE_NAME')
 CLUSTER_ENVIRONMENT = os.environ.get('CLUSTER_ENVIRONMENT', 'production')
 
+# Docker ``Created`` field, RFC 3339 in UTC with up to nanoseconds precision.
+CREATED_RE = re.compile(r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?Z$')
+
 logger = logging.getLogger(__name__)
 
 
@@ -116,6 +124,17 @@ def get_container_image_parts(config: dict) -> Tuple[str]:
     return image, image_version
 
 
+def get_container_created(config: dict) -> float:
+    """Return container creation time as Unix timestamp, or ``None`` if missing or not in expected format."""
+    match = CREATED_RE.match(config.get('Created') or '')
+    if not match:
+        return None
+
+    seconds, fraction = match.groups()
+
+    return calendar.timegm(time.strptime(seconds, '%Y-%m-%dT%H:%M:%S')) + float(fraction or 0)
+
+
 def sync_containers_log_agents(
         agents: list, watched_containers: set, containers: list, containers_path: str, cluster_id: str,
         kube_url=None, strict_labels=None) -> Tuple[set, set]:
@@ -230,6 +249,7 @@ def get_new_containers_log_targets(
             kwargs['log_file_path'] = container['log_file']
 
             kwargs['image'], kwargs['image_version'] = get_container_image_parts(config['Config'])
+            kwargs['container_created'] = get_container_created(config)
 
             kwargs['application'] = pod_labels.get(APP_LABEL, '')
             kwargs['component'] = pod_labels.get(COMPONENT_LABEL)
@@ -259,6 +279,14 @@ def load_agents(agents, configuration):
     return [BUILTIN_AGENTS[agent.strip(' ')](configuration) for agent in agents]
 
 
+def close_agents(agents):
+    for agent in agents:
+        try:
+            agent.close()
+        except Exception:
+            logger.exception('Failed to close %s watcher agent', agent.name)
+
+
 def load_watcher_config(watcher_config_file):
     if watcher_config_file:
         try:
@@ -270,9 +298,40 @@ def load_watcher_config(watcher_config_file):
     return {}
 
 
+def idle(agents, interval):
+    """
+    Sleep ``interval`` secs until the next cycle, polling agents with a ``poll_interval`` meanwhile.
+    """
+    polled = [agent for agent in agents if getattr(agent, 'poll_interval', None)]
+    if not polled:
+        time.sleep(interval)
+        return
+
+    tick = min(agent.poll_interval for agent in polled)
+    deadline = time.monotonic() + interval
+
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+
+        time.sleep(min(tick, remaining))
+
+        for agent in polled:
+            try:
+                agent.poll()
+            except Exception:
+                logger.exception('Failed to poll %s watcher agent', agent.name)
+
+
 def watch(containers_path, agents_list, cluster_id, interval=60, kube_url=None,
-          strict_labels=None, watcher_config_file=None):
-    """Watch new containers and sync their corresponding log job/config files."""
+          strict_labels=None, watcher_config_file=None, record_path=None, metrics_file=None):
+    """
+    Watch new containers and sync their corresponding log job/config files.
+
+    If ``record_path`` is set, inputs of the first cycle are recorded to this file (see ``kube_log_watcher.recorder``).
+    If ``metrics_file`` is set, metrics are written to this file after every cycle.
+    """
     # TODO: Check if filesystem watcher is *better* solution than polling.
     watched_containers = set()
     watcher_config = load_watcher_config(watcher_config_file)
@@ -288,15 +347,20 @@ def watch(containers_path, agents_list, cluster_id, interval=60, kube_url=None,
                 logger.info('Reloading agents with new configuration')
                 watcher_config = new_watcher_config
                 configuration = dict(watcher_config, cluster_id=cluster_id)
+                close_agents(agents)
                 agents = load_agents(agents_list, configuration)
                 watched_containers = set()
 
             containers = get_containers(containers_path)
 
             # Write new job files!
-            new_container_ids, stale_container_ids = sync_containers_log_agents(
-                agents, watched_containers.copy(), containers, containers_path, cluster_id, kube_url=kube_url,
-                strict_labels=strict_labels)
+            with recorder.record(record_path, containers, watched_containers, containers_path=containers_path,
+                                 cluster_id=cluster_id, agents=list(agents_list), strict_labels=strict_labels,
+                                 watcher_config=watcher_config):
+                new_container_ids, stale_container_ids = sync_containers_log_agents(
+                    agents, watched_containers.copy(), containers, containers_path, cluster_id, kube_url=kube_url,
+                    strict_labels=strict_labels)
+            record_path = None
 
             watched_containers.update(new_container_ids)
             watched_containers = watched_containers - stale_container_ids  # remove old containers!
@@ -305,7 +369,11 @@ def watch(containers_path, agents_list, cluster_id, interval=60, kube_url=None,
             logger.info('Added %d new containers', len(new_container_ids))
             logger.info('Watching %d containers', len(watched_containers))
 
-            time.sleep(interval)
+            if metrics_file:
+                metrics.gauge('watcher_watched_containers', len(watched_containers))
+                metrics.write(metrics_file)
+
+            idle(agents, interval)
         except AssertionError:
             raise
         except KeyboardInterrupt:
@@ -369,6 +437,11 @@ def main():
     argp.add_argument('--interval', dest='interval', default=60, type=int,
                       help='Sleep interval for the watcher. Can be set via WATCHER_INTERVAL env variable.')
 
+    argp.add_argument('--record', dest='record_path',
+                      help='Record inputs of the first cycle (containers, pod metadata, watcher configuration) to '
+                           'this gzip compressed file, to replay the cycle offline. Can be set via '
+                           'WATCHER_RECORD_PATH env variable.')
+
     argp.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False,
                       help='Verbose output. Can be set via WATCHER_DEBUG env variable.')
 
@@ -403,10 +476,14 @@ def main():
 
     kube_url = os.environ.get('WATCHER_KUBE_URL', args.kube_url)
 
-    interval = os.environ.get('WATCHER_INTERVAL', args.interval)
+    interval = int(os.environ.get('WATCHER_INTERVAL', args.interval))
 
     watcher_config_file = os.environ.get('WATCHER_CONFIG')
 
+    record_path = os.environ.get('WATCHER_RECORD_PATH', args.record_path)
+
+    metrics_file = os.environ.get('WATCHER_METRICS_FILE')
+
     logger.info('Loaded configuration:')
     logger.info('\tContainers path: %s', containers_path)
     logger.info('\tAgents: %s', agents)
@@ -414,6 +491,8 @@ def main():
     logger.info('\tInterval: %s', interval)
     logger.info('\tStrict labels: %s', strict_labels_str)
     logger.info('\tWatcher configuration file: %s', watcher_config_file)
+    logger.info('\tRecord path: %s', record_path)
+    logger.info('\tMetrics file: %s', metrics_file)
 
     watch(
         containers_path,
@@ -423,4 +502,6 @@ def main():
         kube_url=kube_url,
         strict_labels=strict_labels,
         watcher_config_file=watcher_config_file,
+        record_path=record_path,
+        metrics_file=metrics_file,
     )
@@ -0,0 +1,89 @@
+"""
+Process-wide metrics registry.
+
+Agents record counters and gauges here. The watcher writes all of them after every cycle in Prometheus text format
+to ``WATCHER_METRICS_FILE`` if set (e.g. a node-exporter textfile collector directory).
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> (type, help)
+        self._descriptions = {}
+        # name -> {labels tuple: value}
+        self._values = {}
+
+    def describe(self, name, kind, description):
+        self._descriptions[name] = (kind, description)
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        with self._lock:
+            self._values.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+    def get(self, name, **labels):
+        return self._values.get(name, {}).get(tuple(sorted(labels.items())))
+
+    def remove(self, name, **labels):
+        """Remove series of ``name`` matching all ``labels`` (all series if no labels given)."""
+        with self._lock:
+            series = self._values.get(name, {})
+            for key in [k for k in series if set(labels.items()) <= set(k)]:
+                del series[key]
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted(self._values):
+                series = self._values[name]
+                if not series:
+                    continue
+
+                kind, description = self._descriptions.get(name, (GAUGE, ''))
+                if description:
+                    lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} {}'.format(name, kind))
+
+                for key in sorted(series):
+                    labels = ','.join('{}="{}"'.format(k, escape(v)) for k, v in key)
+                    lines.append('{}{} {}'.format(name, '{' + labels + '}' if labels else '', series[key]))
+
+        return '\n'.join(lines) + '\n' if lines else ''
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+REGISTRY = Registry()
+
+describe = REGISTRY.describe
+inc = REGISTRY.inc
+gauge = REGISTRY.gauge
+get = REGISTRY.get
+remove = REGISTRY.remove
+render = REGISTRY.render
+
+
+def write(path):
+    """Write all metrics to ``path`` atomically. Failures are logged."""
+    # Imported here, writer depends on this module.
+    from kube_log_watcher.writer import atomic_write
+
+    try:
+        atomic_write(path, render())
+    except Exception:
+        logger.exception('Failed to write metrics file %s', path)
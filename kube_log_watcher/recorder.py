@@ -0,0 +1,132 @@
+"""
+Record the inputs of a watcher cycle, so the same cycle can be replayed offline (see ``benchmarks.replay``).
+
+A recording is a gzip compressed JSON document holding the container records, every pod lookup response, the watcher
+configuration and the agents tuning environment (see ``RECORDED_ENV``) of one cycle.
+"""
+import contextlib
+import gzip
+import json
+import logging
+import os
+import time
+
+import kube_log_watcher
+import kube_log_watcher.kube as kube
+
+RECORDING_VERSION = 1
+
+# Only tuning variables changing how agents process containers are recorded. Credentials, host paths, URLs and
+# reload hooks never leave the node.
+RECORDED_ENV = frozenset((
+    'CLUSTER_ALIAS',
+    'CLUSTER_ENVIRONMENT',
+    'CLUSTER_NODE_NAME',
+    'WATCHER_STRICT_LABELS',
+    'WATCHER_SCALYR_API_KEY_POLL_INTERVAL',
+    'WATCHER_SCALYR_PARSE_LINES_JSON',
+    'WATCHER_SCALYR_ENABLE_PROFILING',
+    'WATCHER_SCALYR_DETECT_JSON',
+    'WATCHER_SCALYR_JOURNALD',
+    'WATCHER_SCALYR_JOURNALD_ATTRIBUTES',
+    'WATCHER_SCALYR_JOURNALD_EXTRA_FIELDS',
+    'WATCHER_SCALYR_JOURNALD_WRITE_RATE',
+    'WATCHER_SCALYR_JOURNALD_WRITE_BURST',
+    'WATCHER_SCALYR_REGEX_COST_LIMIT',
+    'WATCHER_SCALYR_CHECKPOINTS_INTERVAL',
+    'WATCHER_SCALYR_CONFIG_FRAGMENTS',
+    'WATCHER_SCALYR_CONFIG_INDENT',
+    'WATCHER_SCALYR_FLUSH_MIN_INTERVAL',
+    'WATCHER_SCALYR_FLUSH_MAX_DELAY',
+    'WATCHER_APPDYNAMICS_WORKERS',
+    'WATCHER_APPDYNAMICS_RESYNC_INTERVAL',
+    'WATCHER_APPDYNAMICS_LOG_FORMAT',
+    'WATCHER_SYMLINK_MANIFEST',
+    'WATCHER_GROWTH_TOP',
+    'WATCHER_GROWTH_REPORT_INTERVAL',
+))
+
+logger = logging.getLogger(__name__)
+
+
+def recorded_environ() -> dict:
+    return {k: v for k, v in os.environ.items() if k in RECORDED_ENV}
+
+
+def log_size(container: dict) -> int:
+    try:
+        return os.stat(container['log_file']).st_size
+    except OSError:
+        return 0
+
+
+@contextlib.contextmanager
+def record(path, containers: list, watched_containers: set, **inputs):
+    """
+    Record pod lookups made inside the block, and write them with the other cycle inputs to ``path``.
+
+    Does nothing if ``path`` is empty. Failing to write the recording is logged and never breaks the cycle.
+
+    :param path: Recording file path.
+    :type path: str
+
+    :param containers: Container records as returned by ``get_containers()``.
+    :type containers: list
+
+    :param watched_containers: Containers watched before this cycle.
+    :type watched_containers: set
+
+    :param inputs: Remaining cycle inputs (e.g. ``cluster_id``, ``agents``, ``watcher_config``).
+    """
+    if not path:
+        yield
+        return
+
+    pods = []
+    get_pod = kube.get_pod
+
+    def recording_get_pod(name, namespace=kube.DEFAULT_NAMESPACE, kube_url=None):
+        try:
+            pod = get_pod(name, namespace=namespace, kube_url=kube_url)
+        except kube.PodNotFound:
+            pods.append({'name': name, 'namespace': namespace, 'pod': None})
+            raise
+
+        pods.append({'name': name, 'namespace': namespace, 'pod': getattr(pod, 'obj', pod)})
+        return pod
+
+    kube.get_pod = recording_get_pod
+    try:
+        yield
+    finally:
+        kube.get_pod = get_pod
+
+    recording = dict(
+        inputs,
+        version=RECORDING_VERSION,
+        watcher_version=kube_log_watcher.__version__,
+        recorded_at=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        environ=recorded_environ(),
+        watched_containers=sorted(watched_containers),
+        containers=[dict(c, log_size=log_size(c)) for c in containers],
+        pods=pods,
+    )
+
+    try:
+        with gzip.open(path, 'wt') as fp:
+            json.dump(recording, fp, default=list)
+    except Exception:
+        logger.exception('Failed to write cycle recording %s', path)
+    else:
+        logger.info('Recorded cycle inputs of %d containers and %d pod lookups to %s', len(containers), len(pods),
+                    path)
+
+
+def load(path) -> dict:
+    with gzip.open(path, 'rt') as fp:
+        recording = json.load(fp)
+
+    if recording.get('version') != RECORDING_VERSION:
+        raise ValueError('Unsupported recording version: {}'.format(recording.get('version')))
+
+    return recording
@@ -0,0 +1,150 @@
+"""
+Log shipper reload notification after config writes.
+
+Agents configured with a reload hook mark a reload as pending whenever one of their config files changed on disk. The
+hook runs after the agent flush, at most once per ``window`` secs: a burst of writes within the window results in a
+single reload at the end of it (run from the agent ``poll()``).
+
+Hooks are configured per agent as ``<kind>:<target>``:
+
+- ``signal:<pidfile>[:<signal name>]`` sends a signal (default ``SIGHUP``) to the process in the pidfile.
+- ``touch:<path>`` creates the file or updates its modification time.
+- ``post:<url>`` sends an empty HTTP POST request, e.g. to a shipper endpoint on localhost.
+"""
+import logging
+import os
+import signal
+import time
+
+import requests
+
+from kube_log_watcher import metrics
+
+DEFAULT_RELOAD_WINDOW = 10
+RELOAD_POST_TIMEOUT = 5
+
+RELOADS_METRIC = 'watcher_shipper_reloads_total'
+
+metrics.describe(RELOADS_METRIC, metrics.COUNTER, 'Log shipper reload hook runs by agent and result.')
+
+logger = logging.getLogger(__name__)
+
+
+def signal_hook(pidfile, signal_name='SIGHUP'):
+    name = signal_name.upper()
+    if not name.startswith('SIG'):
+        name = 'SIG' + name
+
+    signum = getattr(signal, name, None)
+    if not isinstance(signum, signal.Signals):
+        raise ValueError('Unknown signal {}'.format(signal_name))
+
+    def run():
+        with open(pidfile) as fp:
+            os.kill(int(fp.read().strip()), signum)
+
+    return run
+
+
+def touch_hook(path):
+    def run():
+        with open(path, 'a'):
+            os.utime(path)
+
+    return run
+
+
+def post_hook(url):
+    def run():
+        requests.post(url, timeout=RELOAD_POST_TIMEOUT).raise_for_status()
+
+    return run
+
+
+HOOKS = {
+    'signal': signal_hook,
+    'touch': touch_hook,
+    'post': post_hook,
+}
+
+
+def parse_hook(spec):
+    """
+    Return reload hook callable of ``spec``, see module docs.
+
+    :raises ValueError: On unknown hook kind or invalid target.
+    """
+    kind, _, target = spec.partition(':')
+    if kind not in HOOKS or not target:
+        raise ValueError('Invalid reload hook `{}`, expected one of {} followed by `:<target>`'.format(
+            spec, ', '.join(sorted(HOOKS))))
+
+    if kind == 'signal':
+        return signal_hook(*target.split(':', 1))
+
+    return HOOKS[kind](target)
+
+
+class ReloadNotifier:
+    """
+    Run reload ``hook`` of an agent on ``poll()`` if a reload is pending, at most once per ``window`` secs.
+
+    :param agent_name: Agent name, for logs and metrics.
+    :type agent_name: str
+
+    :param hook: Callable reloading the log shipper.
+    :type hook: callable
+
+    :param window: Min. secs between two hook runs.
+    :type window: int
+    """
+
+    def __init__(self, agent_name, hook, window=DEFAULT_RELOAD_WINDOW, clock=time.monotonic):
+        self.agent_name = agent_name
+        self.hook = hook
+        self.window = window
+        self.clock = clock
+
+        self.pending = False
+        self.runs = 0
+        self._last_run = None
+
+    def notify(self):
+        """Config changed on disk, shipper needs to reload."""
+        self.pending = True
+
+    def poll(self):
+        """Run hook if a reload is pending and the window since the previous run is over."""
+        if not self.pending:
+            return
+
+        now = self.clock()
+        if self._last_run is not None and now - self._last_run < self.window:
+            return
+
+        self.pending = False
+        self._last_run = now
+        self.runs += 1
+
+        try:
+            self.hook()
+        except Exception as error:
+            metrics.inc(RELOADS_METRIC, agent=self.agent_name, result='failed')
+            logger.warning('%s watcher agent failed to notify log shipper: %s', self.agent_name, repr(error))
+        else:
+            metrics.inc(RELOADS_METRIC, agent=self.agent_name, result='ok')
+            logger.debug('%s watcher agent notified log shipper to reload', self.agent_name)
+
+
+def from_env(agent_name, prefix):
+    """
+    Return ``ReloadNotifier`` configured by ``<prefix>_RELOAD`` and ``<prefix>_RELOAD_WINDOW`` env variables, or
+    ``None`` if no hook is set.
+    """
+    spec = os.environ.get('{}_RELOAD'.format(prefix))
+    if not spec:
+        return None
+
+    window = int(os.environ.get('{}_RELOAD_WINDOW'.format(prefix), DEFAULT_RELOAD_WINDOW))
+
+    return ReloadNotifier(agent_name, parse_hook(spec), window=window)
@@ -1,13 +1,36 @@
+"""
+Jinja2 templates of the agents.
+
+The Jinja2 environment is only created when the first template is loaded, and every template is compiled once per
+process, so agents re-created on a watcher configuration reload reuse it. If ``WATCHER_TEMPLATE_CACHE_DIR`` is set,
+compiled templates are also kept there as bytecode and are not compiled again on the next start.
+"""
+import functools
 import os
 from urllib.parse import quote_plus
 
-from jinja2 import Environment, FileSystemLoader
-
 
 template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
-env = Environment(loader=FileSystemLoader(template_path))
-env.filters["quote_plus"] = lambda x: quote_plus(x or "")
 
 
+@functools.lru_cache(maxsize=None)
+def get_env():
+    # Imported here, so watchers running no template based agent do not load Jinja2 at all.
+    from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+    bytecode_cache = None
+    cache_dir = os.environ.get('WATCHER_TEMPLATE_CACHE_DIR')
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+    # Templates are shipped with the package and do not change while running.
+    env = Environment(loader=FileSystemLoader(template_path), bytecode_cache=bytecode_cache, auto_reload=False)
+    env.filters["quote_plus"] = lambda x: quote_plus(x or "")
+
+    return env
+
+
+@functools.lru_cache(maxsize=None)
 def load_template(tpl_name):
-    return env.get_template(tpl_name)
+    return get_env().get_template(tpl_name)
@@ -0,0 +1,219 @@
+"""
+Atomic, content-hashed config file writes shared by all agents.
+
+Files are rendered to a temporary file in the destination directory, fsynced and renamed over the destination, so a
+log shipper never observes a truncated config. Writes of content identical to what is already on disk are skipped.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from kube_log_watcher import metrics
+
+FILE_MODE = 0o644
+
+CONFIG_WRITES_METRIC = 'watcher_config_writes_total'
+DEFERRED_FLUSHES_METRIC = 'watcher_config_flushes_deferred_total'
+
+metrics.describe(CONFIG_WRITES_METRIC, metrics.COUNTER, 'Config file writes by agent and result (written/skipped).')
+metrics.describe(DEFERRED_FLUSHES_METRIC, metrics.COUNTER, 'Config changes not written yet to batch them by agent.')
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def fingerprint(path):
+    """
+    Return stat fingerprint of ``path`` (following symlinks), or ``None`` if the file does not exist.
+
+    :rtype: tuple
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def atomic_write(path, content: str):
+    """Write ``content`` to ``path`` via fsynced temp file and atomic rename."""
+    dir_name, base_name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name or '.', prefix='.{}.'.format(base_name), suffix='.tmp')
+
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(content)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    try:
+        dir_fd = os.open(dir_name or '.', os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        # Not supported by every filesystem, the rename itself is atomic anyway.
+        pass
+
+
+class ConfigWriter:
+    """
+    Write config files of one agent atomically, skipping unchanged content.
+
+    The hash of what is on disk is cached together with the file stat fingerprint, so a file is only read again if it
+    was changed by somebody else.
+
+    Different paths can be written concurrently from worker threads.
+
+    :param on_change: Called after a file was written or removed, e.g. ``ReloadNotifier.notify()``.
+    :type on_change: callable
+    """
+
+    def __init__(self, agent_name, on_change=None):
+        self.agent_name = agent_name
+        self.on_change = on_change
+        self.written = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+        # path -> (fingerprint, content hash)
+        self._known = {}
+
+    def current_hash(self, path):
+        """Return content hash of ``path`` on disk, or ``None`` if it does not exist or cannot be read."""
+        current = fingerprint(path)
+        if current is None:
+            self._known.pop(path, None)
+            return None
+
+        known = self._known.get(path)
+        if known and known[0] == current:
+            return known[1]
+
+        try:
+            with open(path) as fp:
+                digest = content_hash(fp.read())
+        except (OSError, UnicodeDecodeError):
+            return None
+
+        self._known[path] = (current, digest)
+        return digest
+
+    def write(self, path, content: str) -> bool:
+        """
+        Write ``content`` to ``path`` unless the file already holds the very same content.
+
+        :return: True if the file was written, False if skipped.
+        :rtype: bool
+        """
+        digest = content_hash(content)
+
+        if self.current_hash(path) == digest:
+            with self._lock:
+                self.skipped += 1
+            metrics.inc(CONFIG_WRITES_METRIC, agent=self.agent_name, result='skipped')
+            logger.debug('%s watcher agent skipped writing unchanged file %s', self.agent_name, path)
+            return False
+
+        atomic_write(path, content)
+
+        self._known[path] = (fingerprint(path), digest)
+        with self._lock:
+            self.written += 1
+        metrics.inc(CONFIG_WRITES_METRIC, agent=self.agent_name, result='written')
+
+        if self.on_change:
+            self.on_change()
+
+        return True
+
+    def remove(self, path):
+        """Remove ``path``, raises ``OSError`` like ``os.remove()``."""
+        self._known.pop(path, None)
+        os.remove(path)
+
+        if self.on_change:
+            self.on_change()
+
+
+class FlushScheduler:
+    """
+    Batch config changes of an agent under pod churn.
+
+    Changes are due right away if nothing was written for ``min_interval`` secs, so the first change after a quiet
+    period is not delayed. Otherwise they are collected until ``min_interval`` secs after the previous write, but new
+    targets wait at most ``max_delay`` secs. With ``min_interval`` of ``0`` every change is due right away.
+
+    :param agent_name: Agent name, for metrics.
+    :type agent_name: str
+
+    :param min_interval: Min. secs between two config rewrites.
+    :type min_interval: int
+
+    :param max_delay: Max. secs a new target waits to be written. Default is ``min_interval``.
+    :type max_delay: int
+    """
+
+    def __init__(self, agent_name, min_interval=0, max_delay=None, clock=time.monotonic):
+        self.agent_name = agent_name
+        self.min_interval = min_interval
+        self.max_delay = min_interval if max_delay is None else max_delay
+        self.clock = clock
+        self.deferred = 0
+
+        self._last_write = None
+        # Since when changes, and new targets, are waiting.
+        self._changed_since = None
+        self._added_since = None
+
+    @property
+    def pending(self) -> bool:
+        return self._changed_since is not None
+
+    def change(self, added=False):
+        """Record a change, ``added`` if it includes new targets."""
+        now = self.clock()
+
+        if self._changed_since is None:
+            self._changed_since = now
+        if added and self._added_since is None:
+            self._added_since = now
+
+    def due(self) -> bool:
+        """Return True if pending changes should be written now."""
+        if self._changed_since is None:
+            return False
+
+        now = self.clock()
+
+        if self._last_write is None or now - self._last_write >= self.min_interval:
+            return True
+
+        return self._added_since is not None and now - self._added_since >= self.max_delay
+
+    def defer(self):
+        """Pending changes are not written now, as they are not ``due()`` yet."""
+        self.deferred += 1
+        metrics.inc(DEFERRED_FLUSHES_METRIC, agent=self.agent_name)
+
+    def done(self):
+        """Pending changes were written."""
+        self._last_write = self.clock()
+        self._changed_since = self._added_since = None
@@ -34,7 +34,7 @@ setup(
     description=DESCRIPTION,
     long_description=open('README.rst').read(),
     license=open('LICENSE').read(),
-    packages=find_packages(exclude=['tests']),
+    packages=find_packages(exclude=['tests', 'benchmarks', 'benchmarks.*']),
     install_requires=get_requirements('requirements.txt'),
     setup_requires=['pytest-runner'],
     test_suite='tests',
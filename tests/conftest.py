@@ -74,7 +74,8 @@ TARGET_INVALID_ANNOT['kwargs']['pod_annotations'] = {SCALYR_ANNOTATION_PARSER: '
                             'annotation.some-annotation': 'v1',
                         },
                         'Image': 'repo/example.org/cont-1:1.1'
-                    }
+                    },
+                    'Created': '2017-02-14T10:00:00.500000001Z',
                 },
                 'id': 'cont-1',
                 'log_file': '/mnt/containers/cont-1/cont-1-json.log'
@@ -162,7 +163,7 @@ TARGET_INVALID_ANNOT['kwargs']['pod_annotations'] = {SCALYR_ANNOTATION_PARSER: '
                     'application': 'app-1', 'version': 'v1', 'container_path': '/mnt/containers/cont-1',
                     'log_file_path': '/mnt/containers/cont-1/cont-1-json.log', 'container_name': 'cont-1',
                     'pod_annotations': {'a/1': 'a-1', 'a/2': 'a-2'}, 'image': 'cont-1', 'image_version': '1.1',
-                    'environment': 'test', 'component': 'main'
+                    'container_created': 1487066400.5, 'environment': 'test', 'component': 'main'
                 }
             },
             {
@@ -174,6 +175,7 @@ TARGET_INVALID_ANNOT['kwargs']['pod_annotations'] = {SCALYR_ANNOTATION_PARSER: '
                     'application': 'app-2', 'version': 'v1', 'container_path': '/mnt/containers/cont-5',
                     'log_file_path': '/mnt/containers/cont-5/cont-5-json.log', 'container_name': 'cont-5',
                     'pod_annotations': {}, 'image': 'cont-5', 'image_version': 'latest',
+                    'container_created': None,
                     'environment': 'test', 'component': None
                 }
             },
@@ -190,6 +192,7 @@ TARGET_INVALID_ANNOT['kwargs']['pod_annotations'] = {SCALYR_ANNOTATION_PARSER: '
                     'container_path': '/mnt/containers/cont-3',
                     'log_file_path': '/mnt/containers/cont-3/cont-3-json.log', 'container_name': 'cont-3',
                     'pod_annotations': {}, 'image': 'cont-3', 'image_version': '1.1',
+                    'container_created': None,
                     'environment': 'test', 'component': None
                 }
             },
@@ -202,6 +205,7 @@ TARGET_INVALID_ANNOT['kwargs']['pod_annotations'] = {SCALYR_ANNOTATION_PARSER: '
                     'application': '', 'version': 'v1', 'container_path': '/mnt/containers/cont-4',
                     'log_file_path': '/mnt/containers/cont-4/cont-4-json.log', 'container_name': 'cont-4',
                     'pod_annotations': {}, 'image': 'cont-4', 'image_version': '1.1',
+                    'container_created': None,
                     'environment': 'production', 'component': None
                 }
             }
@@ -1,12 +1,15 @@
+import json
 import os
 
 import pytest
 
+import yaml
+
 from mock import MagicMock
 
 from kube_log_watcher.agents.appdynamics import AppDynamicsAgent
 
-from .conftest import CLUSTER_ID, APPDYNAMICS_DEST_PATH
+from .conftest import CLUSTER_ID, APPDYNAMICS_DEST_PATH, TARGET
 
 
 @pytest.fixture
@@ -21,19 +24,6 @@ def assert_agent(agent):
     assert agent.cluster_id == CLUSTER_ID
 
 
-def patch_open(monkeypatch, exc=None):
-    mock_open = MagicMock()
-    mock_fp = MagicMock()
-    mock_open.return_value.__enter__.return_value = mock_fp
-
-    if exc:
-        mock_fp.side_effect = exc
-
-    monkeypatch.setattr('builtins.open', mock_open)
-
-    return mock_open, mock_fp
-
-
 def test_add_log_target(monkeypatch, appdynamics_env, fx_appdynamics):
     target = fx_appdynamics['target']
     kwargs = fx_appdynamics['kwargs']
@@ -44,16 +34,16 @@ def test_add_log_target(monkeypatch, appdynamics_env, fx_appdynamics):
 
     assert_agent(agent)
 
-    mock_open, mock_fp = patch_open(monkeypatch)
+    write = MagicMock(return_value=True)
+    monkeypatch.setattr(agent.writer, 'write', write)
 
     with agent:
         agent.add_log_target(target)
 
     job_file = os.path.join(agent.dest_path, 'container-{}-jobfile.job'.format(target['id']))
 
-    mock_open.assert_called_with(job_file, 'w')
     job = agent.tpl.render(**kwargs)
-    mock_fp.write.assert_called_with(job)
+    write.assert_called_with(job_file, job)
 
     assert agent.first_run is False
 
@@ -79,3 +69,148 @@ def test_remove_log_target(monkeypatch, appdynamics_env, exc):
 
     job_file = os.path.join(agent.dest_path, 'container-{}-jobfile.job'.format(container_id))
     remove.assert_called_with(job_file)
+
+
+@pytest.mark.parametrize('workers', (1, 4))
+def test_flush_incremental(monkeypatch, tmp_path, workers):
+    monkeypatch.setenv('WATCHER_APPDYNAMICS_DEST_PATH', str(tmp_path))
+    monkeypatch.setenv('WATCHER_APPDYNAMICS_WORKERS', str(workers))
+
+    agent = AppDynamicsAgent({'cluster_id': CLUSTER_ID})
+    assert agent.workers == workers
+    assert (agent._pool is not None) is (workers > 1)
+
+    targets = [
+        dict(TARGET, id='container-{}'.format(i), kwargs=dict(TARGET['kwargs'], container_id='container-{}'.format(i)))
+        for i in range(5)
+    ]
+
+    with agent:
+        for target in targets:
+            agent.add_log_target(target)
+
+    job_files = sorted(os.listdir(str(tmp_path)))
+    assert job_files == ['container-container-{}-jobfile.job'.format(i) for i in range(5)]
+    assert agent.writer.written == 5
+    assert 'container_name: app-1-container-1' in (tmp_path / job_files[0]).read_text()
+
+    # Known containers are not rendered nor checked on disk again.
+    write = MagicMock(side_effect=[OSError, True])
+    monkeypatch.setattr(agent.writer, 'write', write)
+    monkeypatch.setattr('os.path.exists', MagicMock(side_effect=AssertionError))
+
+    with agent:
+        agent.remove_log_target('container-0')
+
+    assert write.call_count == 0
+    assert 'container-container-0-jobfile.job' not in os.listdir(str(tmp_path))
+
+    # Failed writes are retried.
+    with agent:
+        agent.add_log_target(dict(targets[0]))
+
+    with agent:
+        pass
+
+    assert [c[0][0] for c in write.call_args_list] == [str(tmp_path / 'container-container-0-jobfile.job')] * 2
+
+    with agent:
+        pass
+
+    assert write.call_count == 2
+
+    agent.close()
+    assert agent._pool is None
+
+
+def test_flush_resync(monkeypatch, tmp_path):
+    monkeypatch.setenv('WATCHER_APPDYNAMICS_DEST_PATH', str(tmp_path))
+    monkeypatch.setenv('WATCHER_APPDYNAMICS_RESYNC_INTERVAL', '600')
+
+    now = [1000.0]
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+
+    agent = AppDynamicsAgent({'cluster_id': CLUSTER_ID})
+
+    with agent:
+        agent.add_log_target(dict(TARGET, kwargs=dict(TARGET['kwargs'])))
+
+    job_file = tmp_path / 'container-container-1-jobfile.job'
+    job = job_file.read_text()
+    job_file.unlink()
+
+    # Not checked before the resync interval.
+    now[0] += 599
+    with agent:
+        pass
+    assert not job_file.exists()
+
+    now[0] += 1
+    with agent:
+        pass
+    assert job_file.read_text() == job
+
+    agent.close()
+
+
+def key_value_stage(stage, line):
+    """Split ``line`` like the AppDynamics analytics agent KeyValue stage."""
+    trim = ''.join(stage.get('trim', []))
+    pairs = (pair.split(stage['split'], 1) for pair in line.split(stage['separator']))
+    return {k.strip(trim): v.strip(trim) for k, v in pairs if k.strip(trim) in stage['include']}
+
+
+@pytest.mark.parametrize('env,labels,expected', (
+    (None, {}, 'grok'),
+    (None, {'appdynamics_log_format': 'keyvalue'}, 'keyvalue'),
+    (None, {'appdynamics_log_format': 'KeyValue'}, 'keyvalue'),
+    (None, {'appdynamics_log_format': 'xml'}, 'grok'),
+    ('keyvalue', {}, 'keyvalue'),
+    ('keyvalue', {'appdynamics_log_format': 'grok'}, 'grok'),
+))
+def test_log_format(monkeypatch, tmp_path, env, labels, expected):
+    monkeypatch.setenv('WATCHER_APPDYNAMICS_DEST_PATH', str(tmp_path))
+    if env:
+        monkeypatch.setenv('WATCHER_APPDYNAMICS_LOG_FORMAT', env)
+
+    agent = AppDynamicsAgent({'cluster_id': CLUSTER_ID})
+
+    target = dict(TARGET, kwargs=dict(TARGET['kwargs']), pod_labels=labels)
+    with agent:
+        agent.add_log_target(target)
+
+    assert agent.logs['container-1']['kwargs']['log_format'] == expected
+    # Target is shared with other agents, and left as is.
+    assert target['kwargs'] == TARGET['kwargs']
+
+    job = yaml.safe_load((tmp_path / 'container-container-1-jobfile.job').read_text())
+    assert job['source']['nameGlob'] == TARGET['kwargs']['log_file_name']
+
+    if expected == 'grok':
+        assert 'grok' in job
+        assert 'keyValue' not in job
+        assert 'transform' not in job
+        return
+
+    assert 'grok' not in job
+    aliases = {t['field']: t['alias'] for t in job['transform']}
+    assert set(aliases.values()) == {'logMessage', 'logStream'}
+
+    messages = (
+        'logging-app: 790 \n', 'a, "quoted":"b", c \\ {d}\n', '{"level":"info"}\n', '"quoted"\n',
+        # Partial lines (no trailing newline).
+        '{"level":"info"}', 'say "hi"', '}',
+    )
+    for message in messages:
+        line = json.dumps({'log': message, 'stream': 'stdout', 'time': '2016-11-14T10:06:53.681223265Z'},
+                          separators=(',', ':'))
+        parsed = key_value_stage(job['keyValue'], line)
+        assert {aliases[k]: v for k, v in parsed.items()} == {
+            'logMessage': json.dumps(message)[1:-1], 'logStream': 'stdout'}
+
+
+def test_log_format_invalid(monkeypatch, appdynamics_env):
+    monkeypatch.setenv('WATCHER_APPDYNAMICS_LOG_FORMAT', 'xml')
+
+    with pytest.raises(RuntimeError):
+        AppDynamicsAgent({'cluster_id': CLUSTER_ID})
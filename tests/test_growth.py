@@ -0,0 +1,145 @@
+import copy
+import logging
+import os
+
+from kube_log_watcher import metrics
+from kube_log_watcher.agents.growth import LogGrowthAgent, LogGrowthTracker, format_rate, GROWTH_TOP_METRIC
+
+from .conftest import CLUSTER_ID, TARGET
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def append(path, size):
+    with open(str(path), 'ab') as fp:
+        fp.write(b'x' * size)
+
+
+def test_tracker_rates(tmp_path):
+    clock = Clock()
+    tracker = LogGrowthTracker(clock=clock)
+
+    log_1, log_2 = tmp_path / 'cont-1-json.log', tmp_path / 'cont-2-json.log'
+    append(log_1, 100)
+    append(log_2, 100)
+
+    tracker.add('cont-1', str(log_1), namespace='default', application='app-1')
+    tracker.add('cont-2', str(log_2), namespace='default', application='app-2')
+    tracker.add('cont-3', str(tmp_path / 'missing.log'), namespace='kube')
+
+    # first sample has no rate
+    assert tracker.sample() == {}
+
+    clock.now += 10
+    append(log_1, 1000)
+    append(log_2, 50)
+
+    assert tracker.sample() == {'cont-1': 100.0, 'cont-2': 5.0}
+    assert tracker.total() == 105.0
+    assert tracker.top(1) == [('cont-1', 100.0)]
+    assert tracker.top(5, 'namespace') == [('default', 105.0)]
+    assert tracker.top(5, 'application') == [('app-1', 100.0), ('app-2', 5.0)]
+
+    tracker.remove('cont-1')
+    tracker.remove('cont-1')
+    assert 'cont-1' not in tracker
+    assert len(tracker) == 2
+    assert tracker.top(5) == [('cont-2', 5.0)]
+
+
+def test_tracker_rotation(tmp_path):
+    clock = Clock()
+    tracker = LogGrowthTracker(clock=clock)
+
+    log = tmp_path / 'cont-1-json.log'
+    append(log, 100)
+
+    tracker.add('cont-1', str(log))
+    tracker.sample()
+
+    # 50 bytes before rotation, 30 bytes in the new log
+    clock.now += 10
+    append(log, 50)
+    os.rename(str(log), str(log) + '.1')
+    append(log, 30)
+
+    assert tracker.sample() == {'cont-1': 8.0}
+
+    # rotated twice: only the current log is counted
+    clock.now += 10
+    os.rename(str(log), str(log) + '.1')
+    append(str(log) + '.1', 10)
+    os.rename(str(log) + '.1', str(log) + '.2')
+    append(log, 20)
+    os.rename(str(log), str(log) + '.1')
+    append(log, 40)
+
+    assert tracker.sample() == {'cont-1': 4.0}
+
+    # truncated in place
+    clock.now += 10
+    with open(str(log), 'wb') as fp:
+        fp.write(b'x' * 10)
+
+    assert tracker.sample() == {'cont-1': 1.0}
+
+    # log missing during rotation: previous sample is kept
+    clock.now += 10
+    os.rename(str(log), str(log) + '.1')
+    assert tracker.sample() == {}
+
+    clock.now += 10
+    append(log, 20)
+    assert tracker.sample() == {'cont-1': 1.0}
+
+
+def test_format_rate():
+    assert format_rate(10) == '10.0 B/s'
+    assert format_rate(2048) == '2.0 KiB/s'
+    assert format_rate(3 * 1024 ** 2) == '3.0 MiB/s'
+    assert format_rate(5 * 1024 ** 3) == '5.0 GiB/s'
+
+
+def test_agent(monkeypatch, tmp_path, caplog):
+    monkeypatch.setenv('WATCHER_GROWTH_TOP', '1')
+
+    agent = LogGrowthAgent({'cluster_id': CLUSTER_ID})
+    clock = Clock()
+    agent.tracker.clock = clock
+
+    log = tmp_path / 'cont-1-json.log'
+    append(log, 100)
+
+    target = copy.deepcopy(TARGET)
+    target['kwargs']['log_file_path'] = str(log)
+
+    with agent:
+        agent.add_log_target(target)
+
+    clock.now += 60
+    append(log, 600)
+
+    with caplog.at_level(logging.INFO, logger='kube_log_watcher.agents.growth'):
+        with agent:
+            pass
+
+    name = 'default/pod-1/app-1-container-1'
+    assert metrics.get(GROWTH_TOP_METRIC, scope='container', talker=name) == 10.0
+    assert metrics.get(GROWTH_TOP_METRIC, scope='application', talker='app-1') == 10.0
+    assert 'Top log growth by container: {} 10.0 B/s'.format(name) in caplog.text
+
+    # not reported again before report interval
+    caplog.clear()
+    clock.now += 60
+    with caplog.at_level(logging.INFO, logger='kube_log_watcher.agents.growth'):
+        with agent:
+            agent.remove_log_target(target['id'])
+
+    assert caplog.text == ''
+    assert metrics.get(GROWTH_TOP_METRIC, scope='container', talker=name) is None
@@ -7,7 +7,7 @@ from mock import MagicMock, call
 from kube_log_watcher.kube import PodNotFound
 from kube_log_watcher.main import (
     get_container_label_value, get_containers, sync_containers_log_agents, load_agents,
-    get_new_containers_log_targets, get_container_image_parts, watch)
+    get_new_containers_log_targets, get_container_image_parts, get_container_created, watch, idle)
 
 from .conftest import CLUSTER_ID
 
@@ -49,6 +49,18 @@ def test_get_container_image_parts(monkeypatch, image, res):
     assert get_container_image_parts(config) == res
 
 
+@pytest.mark.parametrize('created,res', (
+    ('2017-02-14T10:00:00Z', 1487066400),
+    ('2017-02-14T10:00:00.250000000Z', 1487066400.25),
+    ('2017-02-14T10:00:00.25+01:00', None),
+    ('0001-01-01T00:00:00Z', -62135596800),
+    ('', None),
+    (None, None),
+))
+def test_get_container_created(created, res):
+    assert get_container_created({'Created': created}) == res
+
+
 @pytest.mark.parametrize(
     'label,val',
     (
@@ -357,7 +369,8 @@ def test_load_configuration(monkeypatch, tmp_path):
     get_containers_mock = MagicMock(return_value=[])
     monkeypatch.setattr('kube_log_watcher.main.get_containers', get_containers_mock)
 
-    load_agents_mock = MagicMock(return_value=[])
+    agents = [[MagicMock()], [MagicMock()], [MagicMock()]]
+    load_agents_mock = MagicMock(side_effect=agents)
     monkeypatch.setattr('kube_log_watcher.main.load_agents', load_agents_mock)
 
     step = 0
@@ -407,3 +420,33 @@ def test_load_configuration(monkeypatch, tmp_path):
         call([], {'foo': 'bar', 'cluster_id': 'kube-cluster'}),
         call([], {'foo': 'baz', 'cluster_id': 'kube-cluster'}),
     ])
+
+    # Replaced agents are closed.
+    assert [a[0].close.call_count for a in agents] == [1, 1, 0]
+
+
+def test_idle(monkeypatch):
+    now = [0]
+
+    def sleep(secs):
+        now[0] += secs
+
+    monkeypatch.setattr('time.sleep', MagicMock(side_effect=sleep))
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+
+    agent = MagicMock(poll_interval=10)
+    agent.poll.side_effect = [None, Exception, None, None]
+
+    idle([agent, MagicMock(poll_interval=None)], 35)
+
+    assert now[0] == 35
+    assert agent.poll.call_count == 4
+
+
+def test_idle_no_polling(monkeypatch):
+    sleep = MagicMock()
+    monkeypatch.setattr('time.sleep', sleep)
+
+    idle(['agent-1', MagicMock(poll_interval=None)], 60)
+
+    sleep.assert_called_once_with(60)
@@ -0,0 +1,40 @@
+from kube_log_watcher import metrics
+from kube_log_watcher.metrics import Registry, COUNTER
+
+
+def test_registry():
+    registry = Registry()
+    registry.describe('writes_total', COUNTER, 'Writes.')
+
+    registry.inc('writes_total', agent='scalyr')
+    registry.inc('writes_total', 2, agent='scalyr')
+    registry.inc('writes_total', agent='appdynamics')
+    registry.gauge('containers', 10)
+
+    assert registry.get('writes_total', agent='scalyr') == 3
+    assert registry.render() == '\n'.join([
+        '# TYPE containers gauge',
+        'containers 10',
+        '# HELP writes_total Writes.',
+        '# TYPE writes_total counter',
+        'writes_total{agent="appdynamics"} 1',
+        'writes_total{agent="scalyr"} 3',
+    ]) + '\n'
+
+    registry.remove('writes_total', agent='scalyr')
+    assert registry.get('writes_total', agent='scalyr') is None
+    assert registry.get('writes_total', agent='appdynamics') == 1
+
+    registry.remove('writes_total')
+    registry.remove('containers')
+    assert registry.render() == ''
+
+
+def test_write(tmp_path):
+    path = str(tmp_path / 'watcher.prom')
+
+    metrics.gauge('test_metric', 1, agent='test')
+    metrics.write(path)
+    metrics.remove('test_metric')
+
+    assert 'test_metric{agent="test"} 1\n' in open(path).read()
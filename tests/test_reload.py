@@ -0,0 +1,116 @@
+import os
+import signal
+
+import pytest
+
+from mock import MagicMock
+
+from kube_log_watcher import metrics
+from kube_log_watcher.reload import ReloadNotifier, from_env, parse_hook
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.parametrize('spec', ('', 'touch', 'touch:', 'exec:/bin/true', 'signal:/run/agent.pid:NOSUCHSIGNAL'))
+def test_parse_hook_invalid(spec):
+    with pytest.raises(ValueError):
+        parse_hook(spec)
+
+
+@pytest.mark.parametrize('spec,signum', (
+    ('signal:{}', signal.SIGHUP),
+    ('signal:{}:usr1', signal.SIGUSR1),
+    ('signal:{}:SIGTERM', signal.SIGTERM),
+))
+def test_signal_hook(monkeypatch, tmp_path, spec, signum):
+    pidfile = tmp_path / 'agent.pid'
+    pidfile.write_text('4242\n')
+
+    kill = MagicMock()
+    monkeypatch.setattr('os.kill', kill)
+
+    parse_hook(spec.format(pidfile))()
+
+    kill.assert_called_once_with(4242, signum)
+
+
+def test_touch_hook(tmp_path):
+    path = tmp_path / 'reload'
+
+    hook = parse_hook('touch:{}'.format(path))
+    hook()
+    assert path.exists()
+
+    os.utime(str(path), (0, 0))
+    hook()
+    assert path.stat().st_mtime > 0
+
+
+def test_post_hook(monkeypatch):
+    post = MagicMock()
+    monkeypatch.setattr('requests.post', post)
+
+    parse_hook('post:http://localhost:8080/reload')()
+
+    post.assert_called_once_with('http://localhost:8080/reload', timeout=5)
+    post.return_value.raise_for_status.assert_called_once_with()
+
+
+def test_reload_notifier():
+    clock = Clock()
+    hook = MagicMock()
+    notifier = ReloadNotifier('Scalyr', hook, window=10, clock=clock)
+
+    # nothing changed
+    notifier.poll()
+    hook.assert_not_called()
+
+    notifier.notify()
+    notifier.poll()
+    assert hook.call_count == 1
+
+    # burst within window: one reload at the end of it
+    for _ in range(5):
+        clock.now += 1
+        notifier.notify()
+        notifier.poll()
+    assert hook.call_count == 1
+
+    clock.now += 5
+    notifier.poll()
+    assert hook.call_count == 2
+
+    clock.now += 100
+    notifier.poll()
+    assert hook.call_count == 2
+    assert metrics.get('watcher_shipper_reloads_total', agent='Scalyr', result='ok') >= 2
+
+
+def test_reload_notifier_failure():
+    notifier = ReloadNotifier('AppDynamics', MagicMock(side_effect=OSError), window=0)
+
+    notifier.notify()
+    notifier.poll()
+
+    assert notifier.pending is False
+    assert metrics.get('watcher_shipper_reloads_total', agent='AppDynamics', result='failed') >= 1
+
+
+def test_from_env(monkeypatch, tmp_path):
+    assert from_env('Scalyr', 'WATCHER_SCALYR') is None
+
+    monkeypatch.setenv('WATCHER_SCALYR_RELOAD', 'touch:{}'.format(tmp_path / 'reload'))
+    monkeypatch.setenv('WATCHER_SCALYR_RELOAD_WINDOW', '30')
+
+    notifier = from_env('Scalyr', 'WATCHER_SCALYR')
+    assert notifier.window == 30
+
+    notifier.notify()
+    notifier.poll()
+    assert (tmp_path / 'reload').exists()
@@ -1,20 +1,24 @@
 import os
 import json
 import copy
+import time
 
 import pytest
 
-from mock import MagicMock
+from mock import MagicMock, ANY
 from urllib.parse import quote_plus
 
-from kube_log_watcher.template_loader import load_template, env
+from kube_log_watcher import metrics
 from kube_log_watcher.agents.scalyr \
-    import ScalyrAgent, SCALYR_CONFIG_PATH, TPL_NAME, JWT_REDACTION_RULE,\
-    get_parser, get_sampling_rules, get_redaction_rules, container_annotation
+    import ScalyrAgent, SCALYR_CONFIG_PATH, JWT_REDACTION_RULE,\
+    get_parser, get_sampling_rules, get_redaction_rules, container_annotation, detect_json_payload, \
+    DETECTED_JSON_PAYLOAD, COPY_FROM_START, copy_from_start, parse_copy_from_start_policy, \
+    parse_rate_limits, SCALYR_ANNOTATION_RATE_LIMIT, parse_adaptive_sampling
+from kube_log_watcher.agents.scalyr_config import render_config
 
 from .conftest \
     import CLUSTER_ID, CLUSTER_ENVIRONMENT, CLUSTER_ALIAS, NODE, APPLICATION, VERSION, COMPONENT, CONTAINER_ID
-from .conftest import SCALYR_KEY, SCALYR_DEST_PATH, SCALYR_JOURNALD_DEFAULTS, SCALYR_DEFAULT_PARSER
+from .conftest import SCALYR_KEY, SCALYR_DEST_PATH, SCALYR_JOURNALD_DEFAULTS, SCALYR_DEFAULT_PARSER, TARGET
 
 DEFAULT_ENV = {
     'CLUSTER_ENVIRONMENT': CLUSTER_ENVIRONMENT,
@@ -242,6 +246,9 @@ def test_add_log_target(monkeypatch, scalyr_env, fx_scalyr):
     assert_agent(agent)
 
     mock_open, mock_fp = patch_open(monkeypatch)
+    mock_fp.read.return_value = SCALYR_KEY
+    write = MagicMock(return_value=True)
+    monkeypatch.setattr(agent.writer, 'write', write)
 
     with agent:
         agent.add_log_target(target)
@@ -255,8 +262,8 @@ def test_add_log_target(monkeypatch, scalyr_env, fx_scalyr):
     makedirs.assert_called_with(os.path.dirname(log_path))
     symlink.assert_called_with(target['kwargs']['log_file_path'], log_path)
 
-    mock_open.assert_called_with(agent.config_path, 'w')
-    mock_fp.write.assert_called_once()
+    write.assert_called_once()
+    assert write.call_args[0][0] == agent.config_path
 
     assert agent.first_run is False
 
@@ -313,6 +320,8 @@ def test_add_log_target_no_change(monkeypatch, scalyr_env, fx_scalyr):
     assert_agent(agent)
 
     mock_open, mock_fp = patch_open(monkeypatch)
+    write = MagicMock(return_value=True)
+    monkeypatch.setattr(agent.writer, 'write', write)
 
     # assuming not the first run
     agent._first_run = False
@@ -325,7 +334,7 @@ def test_add_log_target_no_change(monkeypatch, scalyr_env, fx_scalyr):
     makedirs.assert_called_with(os.path.dirname(log_path))
     symlink.assert_called_with(target['kwargs']['log_file_path'], log_path)
 
-    mock_fp.write.assert_not_called()
+    write.assert_not_called()
 
     assert agent.first_run is False
 
@@ -358,7 +367,10 @@ def test_flush_failure(monkeypatch, scalyr_env, fx_scalyr):
 
     assert_agent(agent)
 
-    mock_open, mock_fp = patch_open(monkeypatch, Exception)
+    mock_open, mock_fp = patch_open(monkeypatch)
+    mock_fp.read.return_value = SCALYR_KEY
+    write = MagicMock(side_effect=OSError)
+    monkeypatch.setattr(agent.writer, 'write', write)
 
     with agent:
         agent.add_log_target(target)
@@ -366,7 +378,8 @@ def test_flush_failure(monkeypatch, scalyr_env, fx_scalyr):
     makedirs.assert_called_with(os.path.dirname(log_path))
     symlink.assert_called_with(target['kwargs']['log_file_path'], log_path)
 
-    assert agent.first_run is False
+    write.assert_called_once()
+    assert agent.first_run is True
 
 
 @pytest.mark.parametrize(
@@ -396,9 +409,6 @@ def test_get_current_log_paths(monkeypatch, scalyr_key_file, config, result):
     exists = MagicMock(side_effect=[True, False, False, True])
     monkeypatch.setattr('os.path.exists', exists)
 
-    get_template = MagicMock()
-    monkeypatch.setattr(env, 'get_template', get_template)
-
     makedirs, symlink, listdir = patch_os(monkeypatch)
 
     agent = ScalyrAgent({
@@ -773,10 +783,8 @@ SERVER_ATTRIBUTES = {
         ),
     )
 )
-def test_tpl_render(monkeypatch, kwargs, expected):
-    tpl = load_template(TPL_NAME)
-
-    config = tpl.render(**kwargs)
+def test_render_config(monkeypatch, kwargs, expected):
+    config = render_config(**kwargs)
 
     assert json.loads(config) == expected
 
@@ -1034,3 +1042,703 @@ def test_add_log_target_with_sampling(monkeypatch, scalyr_env, fx_scalyr):
     agent.add_log_target(target)
 
     assert agent.logs[target['id']]['sampling_rules'] == [{'match_expression': 'INFO', 'sampling_rate': 0}]
+
+
+def test_flush_fragments(monkeypatch, scalyr_key_file, tmp_path):
+    config_dir = tmp_path / 'etc'
+    dest_path = tmp_path / 'dest'
+    config_dir.mkdir()
+    dest_path.mkdir()
+
+    patch_env(monkeypatch, scalyr_key_file, {
+        **DEFAULT_ENV,
+        'WATCHER_SCALYR_CONFIG_PATH': str(config_dir / 'agent.json'),
+        'WATCHER_SCALYR_DEST_PATH': str(dest_path),
+        'WATCHER_SCALYR_CONFIG_FRAGMENTS': 'true',
+    })
+
+    fragments_path = config_dir / 'agent.d'
+    fragments_path.mkdir()
+    # stale fragment of a container removed while the watcher was down, and a fragment not owned by the watcher
+    (fragments_path / 'container-stale.json').write_text('{"logs": []}')
+    (fragments_path / 'other.json').write_text('{}')
+
+    def target(container_id):
+        log_file = tmp_path / '{}-json.log'.format(container_id)
+        log_file.write_text('')
+        return {
+            'id': container_id,
+            'kwargs': {**TARGET['kwargs'], 'container_id': container_id, 'log_file_path': str(log_file)},
+        }
+
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID})
+    assert agent.fragments_path == str(fragments_path)
+
+    with agent:
+        agent.add_log_target(target('cont-1'))
+        agent.add_log_target(target('cont-2'))
+
+    assert sorted(os.listdir(str(fragments_path))) == ['container-cont-1.json', 'container-cont-2.json', 'other.json']
+
+    config = json.loads((config_dir / 'agent.json').read_text())
+    assert config['api_key'] == SCALYR_KEY
+    assert config['logs'] == []
+
+    fragment = json.loads((fragments_path / 'container-cont-1.json').read_text())
+    assert fragment['logs'][0]['path'] == str(dest_path / 'cont-1' / 'app-1-v1.log')
+    assert fragment['logs'][0]['attributes']['container_id'] == 'cont-1'
+
+    write = MagicMock(wraps=agent.writer.write)
+    monkeypatch.setattr(agent.writer, 'write', write)
+
+    with agent:
+        agent.remove_log_target('cont-1')
+        agent.add_log_target(target('cont-3'))
+
+    # only the new container fragment is written
+    write.assert_called_once_with(str(fragments_path / 'container-cont-3.json'), ANY)
+    assert sorted(os.listdir(str(fragments_path))) == ['container-cont-2.json', 'container-cont-3.json', 'other.json']
+
+
+def test_flush_config_state(monkeypatch, scalyr_key_file, tmp_path):
+    config_path = tmp_path / 'agent.json'
+    dest_path = tmp_path / 'dest'
+    dest_path.mkdir()
+
+    patch_env(monkeypatch, scalyr_key_file, {
+        **DEFAULT_ENV,
+        'WATCHER_SCALYR_CONFIG_PATH': str(config_path),
+        'WATCHER_SCALYR_DEST_PATH': str(dest_path),
+    })
+
+    log_file = tmp_path / 'cont-1-json.log'
+    log_file.write_text('')
+
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID})
+
+    with agent:
+        agent.add_log_target({'id': 'cont-1', 'kwargs': {**TARGET['kwargs'], 'log_file_path': str(log_file)}})
+
+    get_current_log_paths = MagicMock(wraps=agent._get_current_log_paths)
+    monkeypatch.setattr(agent, '_get_current_log_paths', get_current_log_paths)
+    write = MagicMock(wraps=agent.writer.write)
+    monkeypatch.setattr(agent.writer, 'write', write)
+
+    # config file is not parsed again
+    with agent:
+        pass
+
+    get_current_log_paths.assert_not_called()
+    write.assert_not_called()
+
+    # config file changed by somebody else
+    config = json.loads(config_path.read_text())
+    config['logs'] = []
+    config_path.write_text(json.dumps(config, indent=4))
+
+    with agent:
+        pass
+
+    get_current_log_paths.assert_called_once_with()
+    write.assert_called_once_with(str(config_path), ANY)
+    assert len(json.loads(config_path.read_text())['logs']) == 1
+
+
+def test_poll_api_key_rotation(monkeypatch, tmp_path):
+    config_path = tmp_path / 'agent.json'
+    dest_path = tmp_path / 'dest'
+    dest_path.mkdir()
+
+    # Kubernetes secret volume layout: api-key -> ..data/api-key, ..data -> ..<timestamp>
+    secret = tmp_path / 'secret'
+    for version, key in (('..v1', 'key-1'), ('..v2', 'key-2')):
+        (secret / version).mkdir(parents=True)
+        (secret / version / 'api-key').write_text(key)
+    (secret / '..data').symlink_to('..v1')
+    (secret / 'api-key').symlink_to('..data/api-key')
+
+    patch_env(monkeypatch, str(secret / 'api-key'), {
+        **DEFAULT_ENV,
+        'WATCHER_SCALYR_CONFIG_PATH': str(config_path),
+        'WATCHER_SCALYR_DEST_PATH': str(dest_path),
+    })
+
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID})
+    assert agent.poll_interval == 10
+
+    # nothing written yet
+    agent.poll()
+    assert not config_path.exists()
+
+    with agent:
+        pass
+
+    assert json.loads(config_path.read_text())['api_key'] == 'key-1'
+
+    flush = MagicMock(wraps=agent.flush)
+    monkeypatch.setattr(agent, 'flush', flush)
+
+    agent.poll()
+    flush.assert_not_called()
+
+    # secret update
+    (secret / '..data_tmp').symlink_to('..v2')
+    os.replace(str(secret / '..data_tmp'), str(secret / '..data'))
+
+    agent.poll()
+    flush.assert_called_once_with()
+    assert json.loads(config_path.read_text())['api_key'] == 'key-2'
+
+
+def test_redaction_rules_shared_annotation(minimal_kwargs):
+    custom_rule = {"match_expression": "foo", "replacement": "bar"}
+    annotations = {
+        "kubernetes-log-watcher/scalyr-redaction-rules": json.dumps(
+            [{"container": "cnt", "redaction-rules": [custom_rule]}]
+        )
+    }
+    get_redaction_rules(annotations, minimal_kwargs)
+
+    assert get_redaction_rules(annotations, minimal_kwargs) == [custom_rule, JWT_REDACTION_RULE]
+
+
+def test_add_log_target_regex_cost(monkeypatch, scalyr_key_file, tmp_path):
+    patch_env(monkeypatch, scalyr_key_file, {
+        **DEFAULT_ENV,
+        'WATCHER_SCALYR_CONFIG_PATH': str(tmp_path / 'agent.json'),
+        'WATCHER_SCALYR_DEST_PATH': str(tmp_path),
+        'WATCHER_SCALYR_REGEX_COST_LIMIT': '100',
+    })
+
+    costs = {'cheap': 0.00001, 'slow': 0.001, JWT_REDACTION_RULE['match_expression']: 0.001}
+    monkeypatch.setattr('kube_log_watcher.agents.scalyr_rules.RegexCostAnalyser._measure',
+                        lambda self, expression, mode: costs[expression])
+
+    log_file = tmp_path / 'cont-1-json.log'
+    log_file.write_text('')
+
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID})
+    assert agent.regex_costs.limit == 0.0001
+
+    sampling_rules = [
+        {'match_expression': 'slow', 'sampling_rate': 0},
+        {'match_expression': 'cheap', 'sampling_rate': 0},
+    ]
+    kwargs = dict(TARGET['kwargs'], log_file_path=str(log_file), pod_annotations={
+        'kubernetes-log-watcher/scalyr-sampling-rules': json.dumps(
+            [{'container': 'app-1-container-1', 'sampling-rules': sampling_rules}]),
+        'kubernetes-log-watcher/scalyr-redaction-rules': json.dumps(
+            [{'container': 'app-1-container-1', 'redaction-rules': [{'match_expression': 'slow'}]}]),
+    })
+    agent.add_log_target({'id': 'cont-1', 'kwargs': kwargs})
+
+    assert agent.logs['cont-1']['sampling_rules'] == [{'match_expression': 'cheap', 'sampling_rate': 0}]
+    # builtin rule is kept
+    assert agent.logs['cont-1']['redaction_rules'] == [JWT_REDACTION_RULE]
+
+
+def test_close_regex_cost_worker(monkeypatch, scalyr_key_file, tmp_path):
+    patch_env(monkeypatch, scalyr_key_file, {
+        **DEFAULT_ENV,
+        'WATCHER_SCALYR_CONFIG_PATH': str(tmp_path / 'agent.json'),
+        'WATCHER_SCALYR_DEST_PATH': str(tmp_path),
+        'WATCHER_SCALYR_REGEX_COST_LIMIT': '100',
+    })
+
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID})
+    assert agent.regex_costs.cost('cheap', 'sampling') is not None
+
+    worker = agent.regex_costs._worker
+    assert worker.poll() is None
+
+    agent.close()
+
+    assert worker.poll() is not None
+    assert agent.regex_costs._worker is None
+
+
+def docker_log(payloads):
+    return ''.join(json.dumps({'log': p + '\n', 'stream': 'stdout', 'time': '2024-01-01T00:00:00Z'}) + '\n'
+                   for p in payloads)
+
+
+@pytest.mark.parametrize('content,result', (
+    (docker_log(['{"level": "info", "msg": "started"}'] * 10), True),
+    (docker_log(['{"level": "info"}'] * 8 + ['panic: something', '']), True),
+    (docker_log(['INFO started', '{"level": "info"}', 'INFO done']), False),
+    # only docker json-file lines are sampled
+    ('2024-01-01T00:00:00Z stdout F {"msg": "hi"}\n' * 5, None),
+    (docker_log(['{"level": "info"}'] * 2), None),
+    # cut line is ignored
+    (docker_log(['{"level": "info"}'] * 2) + '{"log": "{}', None),
+    ('', None),
+))
+def test_detect_json_payload(tmp_path, content, result):
+    log_file = tmp_path / 'cont-1-json.log'
+    log_file.write_text(content)
+
+    assert detect_json_payload(str(log_file)) is result
+
+
+def test_detect_json_payload_sample(tmp_path):
+    log_file = tmp_path / 'cont-1-json.log'
+    head = docker_log(['{"level": "info"}'] * 4)
+    log_file.write_text(head + docker_log(['text'] * 1000))
+
+    assert detect_json_payload(str(log_file), sample_size=len(head) + 10) is True
+    assert detect_json_payload(str(tmp_path / 'missing.log')) is None
+
+    # full sample with too few lines is decided anyway
+    long_line = docker_log(['{"msg": "%s"}' % ('x' * 100)])
+    log_file.write_text(long_line * 2)
+    assert detect_json_payload(str(log_file), sample_size=len(long_line) + 10) is True
+    assert detect_json_payload(str(log_file), sample_size=len(long_line) - 10) is False
+
+
+@pytest.mark.parametrize('payload,parse_lines_as_json,parser', (
+    ('{"level": "info"}', True, 'custom-json-parser'),
+    ('INFO started', False, 'custom-parser'),
+))
+def test_add_log_target_detect_json(monkeypatch, scalyr_key_file, tmp_path, payload, parse_lines_as_json, parser):
+    patch_env(monkeypatch, scalyr_key_file, {
+        **DEFAULT_ENV,
+        'WATCHER_SCALYR_CONFIG_PATH': str(tmp_path / 'agent.json'),
+        'WATCHER_SCALYR_DEST_PATH': str(tmp_path),
+        'WATCHER_SCALYR_DETECT_JSON': 'true',
+        'WATCHER_SCALYR_PARSE_LINES_JSON': 'custom-parser=custom-json-parser',
+    })
+
+    log_file = tmp_path / 'cont-1-json.log'
+    log_file.write_text(docker_log([payload] * 5))
+
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID})
+    agent.add_log_target({'id': 'cont-1', 'kwargs': dict(TARGET['kwargs'], log_file_path=str(log_file))})
+
+    assert agent.logs['cont-1']['parse_lines_as_json'] is parse_lines_as_json
+    assert agent.logs['cont-1']['attributes']['parser'] == parser
+
+    # sampled once
+    log_file.write_text('')
+    agent.add_log_target({'id': 'cont-1', 'kwargs': dict(TARGET['kwargs'], log_file_path=str(log_file))})
+    assert agent.logs['cont-1']['parse_lines_as_json'] is parse_lines_as_json
+
+    agent.remove_log_target('cont-1')
+    assert 'cont-1' not in DETECTED_JSON_PAYLOAD
+
+
+@pytest.mark.parametrize('fragments', (False, True))
+def test_flush_detect_json_later(monkeypatch, scalyr_key_file, tmp_path, fragments):
+    env = {
+        **DEFAULT_ENV,
+        'WATCHER_SCALYR_CONFIG_PATH': str(tmp_path / 'agent.json'),
+        'WATCHER_SCALYR_DEST_PATH': str(tmp_path),
+        'WATCHER_SCALYR_DETECT_JSON': 'true',
+    }
+    if fragments:
+        env['WATCHER_SCALYR_CONFIG_FRAGMENTS'] = 'true'
+    patch_env(monkeypatch, scalyr_key_file, env)
+
+    log_file = tmp_path / 'cont-1-json.log'
+    log_file.write_text(docker_log(['{"level": "info"}']))
+
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID})
+    with agent:
+        agent.add_log_target({'id': 'cont-1', 'kwargs': dict(TARGET['kwargs'], log_file_path=str(log_file))})
+
+    assert agent.logs['cont-1']['parse_lines_as_json'] is False
+    assert 'cont-1' not in DETECTED_JSON_PAYLOAD
+
+    # still too short
+    with agent:
+        pass
+    assert agent.logs['cont-1']['parse_lines_as_json'] is False
+
+    log_file.write_text(docker_log(['{"level": "info"}'] * 5))
+    with agent:
+        pass
+
+    assert agent.logs['cont-1']['parse_lines_as_json'] is True
+    assert DETECTED_JSON_PAYLOAD['cont-1'] is True
+
+    config_file = agent._fragment_file('cont-1') if fragments else str(tmp_path / 'agent.json')
+    with open(config_file) as fp:
+        assert [log['parse_lines_as_json'] for log in json.load(fp)['logs']] == [True]
+
+    agent.remove_log_target('cont-1')
+
+
+def test_flush_detect_json_max_attempts(monkeypatch, scalyr_key_file, tmp_path):
+    patch_env(monkeypatch, scalyr_key_file, {
+        **DEFAULT_ENV,
+        'WATCHER_SCALYR_CONFIG_PATH': str(tmp_path / 'agent.json'),
+        'WATCHER_SCALYR_DEST_PATH': str(tmp_path),
+        'WATCHER_SCALYR_DETECT_JSON': 'true',
+    })
+    monkeypatch.setattr('kube_log_watcher.agents.scalyr.SCALYR_DETECT_JSON_MAX_ATTEMPTS', 3)
+
+    log_file = tmp_path / 'cont-1-json.log'
+    log_file.write_text(docker_log(['{"level": "info"}']))
+
+    detect = MagicMock(side_effect=detect_json_payload)
+    monkeypatch.setattr('kube_log_watcher.agents.scalyr.detect_json_payload', detect)
+
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID})
+    with agent:
+        agent.add_log_target({'id': 'cont-1', 'kwargs': dict(TARGET['kwargs'], log_file_path=str(log_file))})
+
+    # add_log_target, then every flush until attempts are exhausted
+    assert detect.call_count == 2
+    with agent:
+        pass
+    assert detect.call_count == 3
+    assert DETECTED_JSON_PAYLOAD['cont-1'] is False
+    assert agent._undetected == {}
+
+    # decided for good
+    log_file.write_text(docker_log(['{"level": "info"}'] * 5))
+    with agent:
+        pass
+    assert detect.call_count == 3
+    assert agent.logs['cont-1']['parse_lines_as_json'] is False
+
+    agent.remove_log_target('cont-1')
+
+
+def test_flush_prune_container_state(monkeypatch, scalyr_key_file, tmp_path):
+    patch_env(monkeypatch, scalyr_key_file, {
+        **DEFAULT_ENV,
+        'WATCHER_SCALYR_CONFIG_PATH': str(tmp_path / 'agent.json'),
+        'WATCHER_SCALYR_DEST_PATH': str(tmp_path),
+        'WATCHER_SCALYR_DETECT_JSON': 'true',
+    })
+
+    log_file = tmp_path / 'cont-1-json.log'
+    log_file.write_text(docker_log(['{"level": "info"}'] * 5))
+
+    config = {'cluster_id': CLUSTER_ID, 'scalyr_copy_from_start': {'max_size': 1000}}
+    agent = ScalyrAgent(config)
+    with agent:
+        for container_id in ('cont-1', 'cont-2'):
+            agent.add_log_target({'id': container_id, 'kwargs': dict(TARGET['kwargs'], log_file_path=str(log_file))})
+
+    assert set(DETECTED_JSON_PAYLOAD) == set(COPY_FROM_START) == {'cont-1', 'cont-2'}
+
+    # Agents reloaded while cont-2 went away: decisions of cont-1 are kept, cont-2 entries pruned.
+    log_file.write_text('')
+    agent = ScalyrAgent(config)
+    with agent:
+        agent.add_log_target({'id': 'cont-1', 'kwargs': dict(TARGET['kwargs'], log_file_path=str(log_file))})
+
+    assert DETECTED_JSON_PAYLOAD == {'cont-1': True}
+    assert set(COPY_FROM_START) == {'cont-1'}
+    assert agent.logs['cont-1']['parse_lines_as_json'] is True
+
+    agent.remove_log_target('cont-1')
+
+
+@pytest.mark.parametrize('policy,expected', (
+    (None, {}),
+    ({}, {}),
+    ({'max_size': 1024, 'max_age': '3600'}, {'max_size': 1024, 'max_age': 3600}),
+    ({'max_age': 60, 'other': 1}, {'max_age': 60}),
+    ({'max_size': None}, {}),
+    ({'max_size': -1}, {}),
+    ({'max_size': 'big'}, {}),
+    ('max_size', {}),
+))
+def test_parse_copy_from_start_policy(policy, expected):
+    assert parse_copy_from_start_policy(policy) == expected
+
+
+@pytest.mark.parametrize('policy,size,created,expected', (
+    ({}, 10 ** 6, 0, True),
+    ({'max_size': 1000}, 1000, 0, True),
+    ({'max_size': 1000}, 1001, None, False),
+    ({'max_age': 3600}, 10 ** 6, 10000 - 3600, True),
+    ({'max_age': 3600}, 10 ** 6, 10000 - 3601, False),
+    ({'max_age': 3600}, 10 ** 6, None, True),
+    ({'max_age': 3600, 'max_size': 1000}, 1001, 9999, False),
+    ({'max_age': 3600, 'max_size': 1000}, 10, 9999, True),
+))
+def test_copy_from_start(tmp_path, policy, size, created, expected):
+    log_file = tmp_path / 'cont-1-json.log'
+    log_file.write_bytes(b'x' * size)
+
+    assert copy_from_start(policy, str(log_file), created, now=10000) is expected
+
+
+def test_copy_from_start_missing_log(tmp_path):
+    assert copy_from_start({'max_size': 0}, str(tmp_path / 'missing.log'), None) is True
+
+
+def test_add_log_target_copy_from_start(monkeypatch, scalyr_key_file, tmp_path):
+    patch_env(monkeypatch, scalyr_key_file, {
+        **DEFAULT_ENV,
+        'WATCHER_SCALYR_CONFIG_PATH': str(tmp_path / 'agent.json'),
+        'WATCHER_SCALYR_DEST_PATH': str(tmp_path),
+    })
+
+    small_log, big_log = tmp_path / 'small-json.log', tmp_path / 'big-json.log'
+    small_log.write_bytes(b'x' * 10)
+    big_log.write_bytes(b'x' * 2000)
+
+    def target(container_id, log_file, **kwargs):
+        return {'id': container_id, 'kwargs': dict(TARGET['kwargs'], log_file_path=str(log_file), **kwargs)}
+
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID, 'scalyr_copy_from_start': {'max_size': 1000, 'max_age': 3600}})
+    agent.add_log_target(target('cont-1', small_log, container_created=time.time()))
+    agent.add_log_target(target('cont-2', big_log, container_created=time.time()))
+    agent.add_log_target(target('cont-3', small_log, container_created=time.time() - 7200))
+    agent.add_log_target(target('cont-4', small_log))
+
+    assert {k: log['copy_from_start'] for k, log in agent.logs.items()} == {
+        'cont-1': True, 'cont-2': False, 'cont-3': False, 'cont-4': True}
+
+    # decision is kept while the log grows
+    small_log.write_bytes(b'x' * 2000)
+    agent.add_log_target(target('cont-1', small_log, container_created=time.time()))
+    assert agent.logs['cont-1']['copy_from_start'] is True
+
+    for container_id in ('cont-1', 'cont-2', 'cont-3', 'cont-4'):
+        agent.remove_log_target(container_id)
+    assert not COPY_FROM_START
+
+    # no policy: always from start
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID})
+    agent.add_log_target(target('cont-2', big_log, container_created=0))
+    assert agent.logs['cont-2']['copy_from_start'] is True
+
+
+@pytest.mark.parametrize('config,expected', (
+    (None, {}),
+    ([{'write_rate': 1}], {}),
+    ({'default': {'write_rate': 1000, 'write_burst': 20000}, '*': {'write_rate': 5000}},
+     {'default': {'max_write_rate': 1000, 'max_write_burst': 20000}, '*': {'max_write_rate': 5000}}),
+    ({'default': {'write_rate': 0, 'write_burst': 20000}, 'kube': {'write_rate': '1000'}, 'other': 1000},
+     {'default': {'max_write_burst': 20000}}),
+))
+def test_parse_rate_limits(config, expected):
+    assert parse_rate_limits(config) == expected
+
+
+@pytest.mark.parametrize('namespace,annotation,expected', (
+    ('default', None, {'max_write_rate': 1000, 'max_write_burst': 20000}),
+    ('kube', None, {'max_write_rate': 5000}),
+    ('default', '[{"container": "app-1-container-1", "write-rate": 100}]',
+     {'max_write_rate': 100, 'max_write_burst': 20000}),
+    ('kube', '[{"container": "app-1-container-1", "write-rate": 100, "write-burst": 2000}]',
+     {'max_write_rate': 100, 'max_write_burst': 2000}),
+    ('kube', '[{"container": "app-1-container-1", "write-rate": "fast", "write-burst": 2000}]',
+     {'max_write_rate': 5000, 'max_write_burst': 2000}),
+    ('kube', '[{"container": "cont-2", "write-rate": 100}]', {'max_write_rate': 5000}),
+))
+def test_add_log_target_rate_limits(monkeypatch, scalyr_key_file, tmp_path, namespace, annotation, expected):
+    patch_env(monkeypatch, scalyr_key_file, {
+        **DEFAULT_ENV,
+        'WATCHER_SCALYR_CONFIG_PATH': str(tmp_path / 'agent.json'),
+        'WATCHER_SCALYR_DEST_PATH': str(tmp_path),
+    })
+
+    log_file = tmp_path / 'cont-1-json.log'
+    log_file.write_text('')
+
+    annotations = {SCALYR_ANNOTATION_RATE_LIMIT: annotation} if annotation else {}
+    kwargs = dict(TARGET['kwargs'], log_file_path=str(log_file), namespace=namespace, pod_annotations=annotations)
+
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID, 'scalyr_rate_limits': {
+        'default': {'write_rate': 1000, 'write_burst': 20000}, '*': {'write_rate': 5000}}})
+    agent.add_log_target({'id': 'cont-1', 'kwargs': kwargs})
+
+    log = agent.logs['cont-1']
+    assert {k: log[k] for k in ('max_write_rate', 'max_write_burst') if k in log} == expected
+
+    entry = json.loads(agent.builder.fragment('cont-1', log))['logs'][0]
+    assert {k: entry[k] for k in ('max_write_rate', 'max_write_burst') if k in entry} == expected
+
+
+@pytest.mark.parametrize('config,expected', (
+    (None, None),
+    ({'threshold': 1000}, (1000, 500, 300, 2)),
+    ({'threshold': '1000', 'release': 100, 'window': 60, 'levels': [[{'match_expression': 'x', 'sampling_rate': 0}]]},
+     (1000, 100, 60, 1)),
+    ({'release': 100}, None),
+    ({'threshold': 1000, 'release': 2000}, None),
+    ({'threshold': 0}, None),
+    ({'threshold': 1000, 'levels': [{'match_expression': 'x'}]}, None),
+    ({'threshold': 1000, 'levels': [[{'sampling_rate': 0}]]}, None),
+    ('1000', None),
+))
+def test_parse_adaptive_sampling(config, expected):
+    sampler = parse_adaptive_sampling(config)
+
+    if expected is None:
+        assert sampler is None
+    else:
+        assert (sampler.threshold, sampler.release, sampler.window, len(sampler.levels)) == expected
+
+
+def test_flush_adaptive_sampling(monkeypatch, scalyr_key_file, tmp_path):
+    config_path = tmp_path / 'agent.json'
+    patch_env(monkeypatch, scalyr_key_file, {
+        **DEFAULT_ENV,
+        'WATCHER_SCALYR_CONFIG_PATH': str(config_path),
+        'WATCHER_SCALYR_DEST_PATH': str(tmp_path),
+    })
+
+    log_file = tmp_path / 'cont-1-json.log'
+    log_file.write_text('')
+
+    rule = {'match_expression': 'DEBUG', 'sampling_rate': 0}
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID, 'scalyr_adaptive_sampling': {
+        'threshold': 100, 'window': 0, 'levels': [[rule]]}})
+    now = [1000]
+    agent.adaptive_sampling.tracker.clock = lambda: now[0]
+
+    with agent:
+        agent.add_log_target({'id': 'cont-1', 'kwargs': dict(TARGET['kwargs'], log_file_path=str(log_file),
+                                                             pod_annotations={})})
+
+    assert 'sampling_rules' not in json.loads(config_path.read_text())['logs'][0]
+
+    def cycle(size):
+        now[0] += 10
+        with open(str(log_file), 'a') as fp:
+            fp.write('x' * size)
+        with agent:
+            pass
+        return json.loads(config_path.read_text())['logs'][0].get('sampling_rules')
+
+    assert cycle(10000) == [rule]
+    assert cycle(10000) == [rule]
+    assert cycle(0) is None
+
+    agent.remove_log_target('cont-1')
+    assert 'cont-1' not in agent.adaptive_sampling.tracker
+
+
+def test_flush_shipping_lag(monkeypatch, scalyr_key_file, tmp_path):
+    data_path = tmp_path / 'scalyr-data'
+    data_path.mkdir()
+    patch_env(monkeypatch, scalyr_key_file, {
+        **DEFAULT_ENV,
+        'WATCHER_SCALYR_CONFIG_PATH': str(tmp_path / 'agent.json'),
+        'WATCHER_SCALYR_DEST_PATH': str(tmp_path),
+        'WATCHER_SCALYR_CHECKPOINTS_PATH': str(data_path),
+        'WATCHER_SCALYR_CHECKPOINTS_INTERVAL': '0',
+    })
+
+    log_file = tmp_path / 'cont-1-json.log'
+    log_file.write_bytes(b'x' * 1000)
+
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID})
+    with agent:
+        agent.add_log_target({'id': 'cont-1', 'kwargs': dict(TARGET['kwargs'], log_file_path=str(log_file))})
+
+    # no checkpoint yet
+    assert metrics.get('watcher_scalyr_node_shipping_lag_bytes') == 0
+
+    (data_path / 'checkpoints.json').write_text(json.dumps({'time': 1, 'checkpoints': {
+        agent.logs['cont-1']['path']: {'position': 250, 'pending_files': [
+            {'position_start': 0, 'inode': os.stat(str(log_file)).st_ino}]}}}))
+
+    with agent:
+        pass
+
+    labels = {'container_id': 'cont-1', 'namespace': 'default', 'pod': 'pod-1', 'container': 'app-1-container-1'}
+    assert metrics.get('watcher_scalyr_shipping_lag_bytes', **labels) == 750
+    assert metrics.get('watcher_scalyr_node_shipping_lag_bytes') == 750
+
+    agent.remove_log_target('cont-1')
+    assert metrics.get('watcher_scalyr_shipping_lag_bytes', **labels) is None
+
+
+def test_flush_reload_hook(monkeypatch, scalyr_key_file, tmp_path):
+    config_path = tmp_path / 'agent.json'
+    reload_file = tmp_path / 'reload'
+    patch_env(monkeypatch, scalyr_key_file, {
+        **DEFAULT_ENV,
+        'WATCHER_SCALYR_CONFIG_PATH': str(config_path),
+        'WATCHER_SCALYR_DEST_PATH': str(tmp_path),
+        'WATCHER_SCALYR_RELOAD': 'touch:{}'.format(reload_file),
+        'WATCHER_SCALYR_RELOAD_WINDOW': '5',
+    })
+
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID})
+    assert agent.poll_interval == 5
+
+    with agent:
+        pass
+
+    assert config_path.exists()
+    assert reload_file.exists()
+    assert agent.reload.runs == 1
+
+    # unchanged config: no reload
+    with agent:
+        pass
+    agent.poll()
+    assert agent.reload.runs == 1
+
+
+@pytest.mark.parametrize('fragments', (False, True))
+def test_flush_debounced(monkeypatch, scalyr_key_file, tmp_path, fragments):
+    config_path = tmp_path / 'agent.json'
+    patch_env(monkeypatch, scalyr_key_file, {
+        **DEFAULT_ENV,
+        'WATCHER_SCALYR_CONFIG_PATH': str(config_path),
+        'WATCHER_SCALYR_DEST_PATH': str(tmp_path),
+        'WATCHER_SCALYR_CONFIG_FRAGMENTS': 'true' if fragments else '',
+        'WATCHER_SCALYR_FLUSH_MIN_INTERVAL': '60',
+        'WATCHER_SCALYR_FLUSH_MAX_DELAY': '30',
+    })
+
+    agent = ScalyrAgent({'cluster_id': CLUSTER_ID})
+    assert agent.poll_interval == 10
+
+    now = [1000]
+    agent.flush_scheduler.clock = lambda: now[0]
+
+    def shipped():
+        if fragments:
+            return sorted(f for f in os.listdir(agent.fragments_path) if f.startswith('container-'))
+        return sorted(os.path.basename(os.path.dirname(log['path']))
+                      for log in json.loads(config_path.read_text())['logs'])
+
+    def cycle(added=(), removed=(), secs=10):
+        now[0] += secs
+        with agent:
+            for container_id in added:
+                log_file = tmp_path / '{}-json.log'.format(container_id)
+                log_file.write_text('')
+                agent.add_log_target({'id': container_id, 'kwargs': dict(
+                    TARGET['kwargs'], log_file_path=str(log_file), container_id=container_id)})
+            for container_id in removed:
+                agent.remove_log_target(container_id)
+        return shipped()
+
+    def names(*container_ids):
+        return ['container-{}.json'.format(c) for c in container_ids] if fragments else list(container_ids)
+
+    cycle()
+
+    # first new container in a quiet period is written right away
+    assert cycle(added=['cont-1'], secs=100) == names('cont-1')
+
+    # burst is batched
+    assert cycle(added=['cont-2']) == names('cont-1')
+    assert cycle(added=['cont-3'], removed=['cont-1']) == names('cont-1')
+
+    # new targets wait at most max delay, written on poll
+    now[0] += 19
+    agent.poll()
+    assert shipped() == names('cont-1')
+    now[0] += 1
+    agent.poll()
+    assert shipped() == names('cont-2', 'cont-3')
+
+    # removal waits for min interval
+    assert cycle(removed=['cont-2']) == names('cont-2', 'cont-3')
+    now[0] += 50
+    agent.poll()
+    assert shipped() == names('cont-3')
+    assert agent.flush_scheduler.deferred == 3
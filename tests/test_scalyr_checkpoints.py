@@ -0,0 +1,77 @@
+import json
+import os
+
+import pytest
+
+from kube_log_watcher.agents.scalyr_checkpoints import CheckpointReader, parse_checkpoints, uploaded_offset
+
+
+def checkpoint(position, *pending):
+    return {
+        'sequence_id': 'abc', 'sequence_number': 1, 'position': position,
+        'pending_files': [{'position_start': start, 'position_end': None, 'last_size': 0, 'inode': inode}
+                          for start, inode in pending],
+    }
+
+
+def write_checkpoints(path, time, checkpoints):
+    path.write_text(json.dumps({'time': time, 'checkpoints': checkpoints}))
+
+
+@pytest.mark.parametrize('state,inode,expected', (
+    (checkpoint(150, (100, 1)), 1, 50),
+    # rotated file still pending
+    (checkpoint(1150, (0, 1), (1100, 2)), 2, 50),
+    (checkpoint(1150, (0, 1), (1100, 2)), 3, 0),
+    ({'position': 42}, 1, 42),
+    ({'pending_files': []}, 1, None),
+    (checkpoint('x', (100, 1)), 1, None),
+))
+def test_uploaded_offset(state, inode, expected):
+    assert uploaded_offset(state, inode) == expected
+
+
+def test_parse_checkpoints():
+    assert parse_checkpoints('{"time": 1.5, "checkpoints": {"/a": {}}}') == (1.5, {'/a': {}})
+
+    with pytest.raises(ValueError):
+        parse_checkpoints('{"checkpoints": []}')
+
+
+def test_checkpoint_reader_lag(tmp_path):
+    data_path = tmp_path / 'data'
+    data_path.mkdir()
+
+    log_1, log_2, log_3 = (tmp_path / 'log-{}.log'.format(i) for i in (1, 2, 3))
+    log_1.write_bytes(b'x' * 1000)
+    log_2.write_bytes(b'x' * 500)
+    log_3.write_bytes(b'x' * 10)
+    ino_1, ino_2 = os.stat(str(log_1)).st_ino, os.stat(str(log_2)).st_ino
+
+    write_checkpoints(data_path / 'checkpoints.json', 100, {
+        str(log_1): checkpoint(600, (0, ino_1)),
+        str(log_2): checkpoint(0, (0, ino_2)),
+    })
+    # more recent
+    write_checkpoints(data_path / 'active-checkpoints.json', 200, {
+        str(log_2): checkpoint(450, (0, ino_2)),
+    })
+    (data_path / 'other.json').write_text('not checkpoints')
+
+    reader = CheckpointReader(str(data_path))
+    logs = {'cont-1': str(log_1), 'cont-2': str(log_2), 'cont-3': str(log_3), 'cont-4': str(tmp_path / 'missing')}
+
+    assert reader.lag(logs) == {'cont-1': 400, 'cont-2': 50}
+    assert reader.parsed == 2
+
+    # unchanged checkpoint files are not parsed again
+    log_1.write_bytes(b'x' * 2000)
+    assert reader.lag(logs) == {'cont-1': 1400, 'cont-2': 50}
+    assert reader.parsed == 2
+
+    # invalid (e.g. partly written) file keeps previous state
+    (data_path / 'active-checkpoints.json').write_text('{"time": 300, "checkp')
+    assert reader.lag(logs) == {'cont-1': 1400, 'cont-2': 50}
+
+    (data_path / 'active-checkpoints.json').unlink()
+    assert reader.lag(logs) == {'cont-1': 1400, 'cont-2': 500}
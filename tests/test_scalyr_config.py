@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from kube_log_watcher.agents.scalyr_config import ConfigBuilder, render_config
+
+from .conftest import SCALYR_KEY
+
+SERVER_ATTRIBUTES = {'serverHost': 'kube-cluster', 'parser': 'json'}
+JOURNALD = {'journal_path': '/var/log/journal', 'attributes': {'cluster': 'kube-cluster'}, 'write_rate': 1,
+            'write_burst': 2}
+
+
+def make_log(container_id, **kwargs):
+    return dict({
+        'path': '/mnt/scalyr-logs/{}/app-1-v1.log'.format(container_id),
+        'attributes': {'application': 'app 1', 'version': 'v1', 'container_id': container_id},
+        'redaction_rules': [{'match_expression': 'secret'}],
+        'parse_lines_as_json': False,
+    }, **kwargs)
+
+
+@pytest.mark.parametrize('indent', (None, 4))
+def test_render(indent):
+    logs = {'cont-1': make_log('cont-1'),
+            'cont-2': make_log('cont-2', sampling_rules=[{'match_expression': 'x'}], copy_from_start=False)}
+    builder = ConfigBuilder(indent=indent)
+
+    config = builder.render(logs, SCALYR_KEY, SERVER_ATTRIBUTES, monitor_journald=JOURNALD,
+                            scalyr_server='https://scalyr', enable_profiling=True)
+
+    assert config == render_config(SCALYR_KEY, SERVER_ATTRIBUTES, logs.values(), monitor_journald=JOURNALD,
+                                   scalyr_server='https://scalyr', enable_profiling=True, indent=indent)
+
+    config = json.loads(config)
+    assert [log['path'] for log in config['logs']] == [log['path'] for log in logs.values()]
+    assert config['logs'][0]['rename_logfile'] == '?application=app+1&component=&version=v1&container_id=cont-1'
+    assert config['logs'][1]['sampling_rules'] == [{'match_expression': 'x'}]
+    assert 'parse_lines_as_json' not in config['logs'][0]
+    assert [log['copy_from_start'] for log in config['logs']] == [True, False]
+    assert config['journald_logs'] == [
+        {'attributes': {'cluster': 'kube-cluster'}, 'journald_unit': '.*', 'parser': 'journald_monitor'}]
+
+
+def test_render_cached_entries():
+    logs = {'cont-1': make_log('cont-1'), 'cont-2': make_log('cont-2')}
+    builder = ConfigBuilder()
+
+    builder.render(logs, SCALYR_KEY, SERVER_ATTRIBUTES)
+    assert builder.serialised == 2
+
+    # unchanged logs are not serialised again
+    logs['cont-3'] = make_log('cont-3')
+    config = builder.render(logs, SCALYR_KEY, SERVER_ATTRIBUTES)
+    assert builder.serialised == 3
+    assert len(json.loads(config)['logs']) == 3
+
+    # replaced log is serialised again
+    logs['cont-1'] = make_log('cont-1', parse_lines_as_json=True)
+    config = builder.render(logs, SCALYR_KEY, SERVER_ATTRIBUTES)
+    assert builder.serialised == 4
+    assert json.loads(config)['logs'][0]['parse_lines_as_json'] is True
+
+    builder.discard('cont-1')
+    builder.discard('cont-1')
+    del logs['cont-1']
+    assert len(json.loads(builder.render(logs, SCALYR_KEY, SERVER_ATTRIBUTES))['logs']) == 2
+
+
+@pytest.mark.parametrize('indent', (None, 2))
+def test_fragment(indent):
+    log = make_log('cont-1')
+    builder = ConfigBuilder(indent=indent)
+
+    fragment = builder.fragment('cont-1', log)
+
+    assert fragment == json.dumps({'logs': [json.loads(builder.entry('cont-1', log))]}, indent=indent,
+                                  separators=None if indent else (',', ':'))
+    assert builder.serialised == 1
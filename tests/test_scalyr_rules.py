@@ -0,0 +1,258 @@
+import binascii
+import json
+import logging
+import math
+
+import pytest
+
+from kube_log_watcher import metrics
+from kube_log_watcher.agents.growth import LogGrowthTracker
+from kube_log_watcher.agents.scalyr_rules import AdaptiveSampler, AnnotationIndex, RegexCostAnalyser, SamplingRuleIndex
+
+KEY = 'kubernetes-log-watcher/scalyr-parser'
+
+
+def test_annotation_index():
+    annotations = {KEY: json.dumps([
+        {'container': 'cnt-1', 'parser': 'parser-1'},
+        {'container': 'cnt-2'},
+        {'container': 'cnt-1', 'parser': 'ignored'},
+        'not a dict',
+    ])}
+    index = AnnotationIndex()
+
+    assert index.lookup(annotations, 'cnt-1', 'pod-1', KEY, 'parser', 'json') == 'parser-1'
+    assert index.lookup(annotations, 'cnt-2', 'pod-1', KEY, 'parser', 'json') == 'json'
+    assert index.lookup(annotations, 'cnt-3', 'pod-1', KEY, 'parser', 'json') == 'json'
+    # same annotation value in another pod
+    assert index.lookup(dict(annotations), 'cnt-1', 'pod-2', KEY, 'parser', 'json') == 'parser-1'
+
+    assert (index.parsed, index.hits) == (1, 3)
+
+    assert index.lookup({}, 'cnt-1', 'pod-1', KEY, 'parser', 'json') == 'json'
+    assert index.lookup(None, 'cnt-1', 'pod-1', KEY, 'parser', 'json') == 'json'
+    assert index.parsed == 1
+
+
+def test_annotation_index_invalid(caplog):
+    index = AnnotationIndex()
+
+    with caplog.at_level(logging.WARNING):
+        for container in ('cnt-1', 'cnt-2', 'cnt-1'):
+            assert index.lookup({KEY: '{"container": "cnt-1"}'}, container, 'pod-1', KEY, 'parser') is None
+            assert index.lookup({KEY: '[{]'}, container, 'pod-1', KEY, 'parser', 'json') == 'json'
+
+    assert index.parsed == 2
+    assert len(caplog.records) == 2
+
+
+def test_annotation_index_max_size():
+    index = AnnotationIndex(max_size=2)
+
+    for i in range(3):
+        index.get({KEY: json.dumps([{'container': 'cnt-{}'.format(i)}])}, KEY, 'pod-{}'.format(i))
+
+    assert len(index._index) == 2
+    assert index.get({KEY: json.dumps([{'container': 'cnt-2'}])}, KEY, 'pod-2') == {'cnt-2': {'container': 'cnt-2'}}
+    assert index.hits == 1
+
+    index.clear()
+    assert not index._index
+
+
+RULES = [
+    {'application': 'app-1', 'component': 'comp-1', 'probability': 0.5, 'value': '[{"container": "cnt", "v": 1}]'},
+    {'component': 'comp-1', 'value': '[{"container": "cnt", "v": 2}]'},
+    {'application': 'app-1', 'probability': 0.2, 'value': '[{"container": "cnt", "v": 3}]'},
+    {'application': 'app-1', 'component': 'comp-1', 'value': '[{"container": "cnt", "v": 4}]'},
+    {'application': 'app-2', 'value': '{"not": "a list"}'},
+    {'probability': 0.1, 'value': '[]'},
+    {'application': 'app-3', 'component': 'comp-3', 'value': '[{"container": "cnt", "v": 5}]'},
+]
+
+
+def linear_match(rules, application, component, container_id):
+    for rule in rules:
+        if 'application' in rule and rule['application'] != application:
+            continue
+        if 'component' in rule and rule['component'] != component:
+            continue
+        if 'probability' in rule:
+            if ((binascii.crc32(container_id.encode()) % 100) + 1) > rule['probability'] * 100:
+                continue
+        return rule['value']
+
+
+def test_sampling_rule_index():
+    index = SamplingRuleIndex(RULES)
+    assert len(index) == len(RULES)
+
+    for application in ('app-1', 'app-2', 'app-3', 'app-4'):
+        for component in ('comp-1', 'comp-3', 'comp-4'):
+            for i in range(100):
+                container_id = 'container-{}'.format(i)
+                rule = index.match(application, component, container_id)
+                assert (rule.value if rule else None) == linear_match(RULES, application, component, container_id)
+
+
+def test_sampling_rule_index_values():
+    index = SamplingRuleIndex(RULES)
+
+    assert index.match('app-3', 'comp-3', 'cont-1').containers == {'cnt': {'container': 'cnt', 'v': 5}}
+    assert index.match('app-2', 'comp-4', 'cont-1').containers == {}
+    assert SamplingRuleIndex([]).match('app-1', 'comp-1', 'cont-1') is None
+
+
+def test_sampling_rule_index_invalid_keys():
+    rules = [
+        {'application': ['app-1'], 'value': '[{"container": "cnt", "v": 1}]'},
+        {'component': {'name': 'comp-1'}, 'value': '[{"container": "cnt", "v": 2}]'},
+        {'application': 'app-1', 'value': '[{"container": "cnt", "v": 3}]'},
+    ]
+    index = SamplingRuleIndex(rules)
+
+    assert len(index) == 1
+    assert index.match('app-1', 'comp-1', 'cont-1').value == rules[2]['value']
+
+
+def test_regex_cost_analyser():
+    analyser = RegexCostAnalyser(limit=0.001, timeout=0.5, corpus=['a' * 40 + '!', 'INFO request processed'])
+
+    try:
+        assert analyser.affordable('INFO')
+        assert analyser.cost('INFO', 'sampling') < 0.001
+        # catastrophic backtracking, worker is killed and replaced
+        assert analyser.cost('(a+)+$') == math.inf
+        assert analyser.cost('[') is None
+        assert analyser.affordable('request')
+    finally:
+        analyser.close()
+
+    # cached
+    assert analyser.cost('(a+)+$') == math.inf
+    assert analyser._worker is None
+
+    assert metrics.get('watcher_scalyr_regex_cost_seconds', type='redaction', expression='(a+)+$') == math.inf
+
+
+def test_regex_cost_analyser_filter():
+    analyser = RegexCostAnalyser(limit=0.001)
+    costs = {'cheap': 0.0001, 'expensive': 0.01, 'builtin': 0.01, 'invalid': None}
+    analyser._measure = lambda expression, mode: costs[expression]
+
+    rules = [
+        {'match_expression': 'cheap'},
+        {'match_expression': 'expensive'},
+        {'match_expression': 'invalid'},
+        {'match_expression': 'builtin'},
+        {'sampling_rate': 0},
+    ]
+
+    assert analyser.filter(rules, 'redaction', 'pod-1', keep=[{'match_expression': 'builtin'}]) == [
+        {'match_expression': 'cheap'}, {'match_expression': 'builtin'}, {'sampling_rate': 0}]
+    assert analyser.filter({'match_expression': 'expensive'}, 'sampling', 'pod-1') == {
+        'match_expression': 'expensive'}
+    assert analyser.filter(None, 'sampling', 'pod-1') is None
+
+
+def test_regex_cost_analyser_worker_failure(monkeypatch):
+    analyser = RegexCostAnalyser(limit=0.001, corpus=['INFO request processed'])
+
+    def start():
+        raise OSError('Regex cost worker failed to start')
+
+    monkeypatch.setattr(analyser, '_start', start)
+
+    rules = [{'match_expression': 'secret=\\w+', 'replacement': 'secret=***'}]
+    assert analyser.filter(rules, 'redaction', 'pod-1') == rules
+    assert metrics.get('watcher_scalyr_regex_cost_errors_total', type='redaction') >= 1
+
+    # Not cached, measured once the worker is back.
+    monkeypatch.undo()
+    try:
+        assert analyser.cost('secret=\\w+') < 0.001
+        assert analyser.cost('[') is None
+        assert analyser.filter([{'match_expression': '['}], 'redaction', 'pod-1') == []
+    finally:
+        analyser.close()
+
+
+def test_regex_cost_analyser_worker_exit():
+    analyser = RegexCostAnalyser(limit=0.001, corpus=['INFO request processed'])
+
+    try:
+        assert analyser.affordable('INFO')
+        analyser._worker.kill()
+        analyser._worker.wait()
+
+        with pytest.raises(OSError):
+            analyser.cost('DEBUG')
+        assert analyser._worker is None
+        assert ('DEBUG', 'redaction') not in analyser._costs
+        assert analyser.affordable('DEBUG')
+    finally:
+        analyser.close()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+DEBUG_RULE = {'match_expression': 'DEBUG', 'sampling_rate': 0}
+INFO_RULE = {'match_expression': 'INFO', 'sampling_rate': 0.1}
+OWN_RULE = {'match_expression': 'health', 'sampling_rate': 0}
+
+
+def test_adaptive_sampler(tmp_path):
+    clock = Clock()
+    sampler = AdaptiveSampler([[DEBUG_RULE], [INFO_RULE]], threshold=100, release=50, window=120,
+                              tracker=LogGrowthTracker(clock=clock))
+
+    log = tmp_path / 'cont-1-json.log'
+    log.write_bytes(b'')
+    sampler.add('cont-1', str(log), [OWN_RULE])
+    sampler.add('cont-2', str(tmp_path / 'missing.log'), None)
+
+    def cycle(rate, secs=60):
+        clock.now += secs
+        with open(str(log), 'ab') as fp:
+            fp.write(b'x' * int(rate * secs))
+        return sampler.update()
+
+    assert cycle(0) == set()
+    assert sampler.rules('cont-1') == [OWN_RULE]
+    assert sampler.rules('cont-2') is None
+
+    # above threshold, for less than window
+    assert cycle(200) == set()
+    assert cycle(200) == set()
+    assert cycle(200) == {'cont-1'}
+    assert sampler.rules('cont-1') == [DEBUG_RULE, OWN_RULE]
+    assert metrics.get('watcher_scalyr_adaptive_sampling_containers') == 1
+
+    # next level after another window, then capped at last level
+    assert cycle(200) == set()
+    assert cycle(200) == {'cont-1'}
+    assert sampler.rules('cont-1') == [DEBUG_RULE, INFO_RULE, OWN_RULE]
+    assert cycle(200, secs=600) == set()
+
+    # between release and threshold: no change, and pending change is reset
+    assert cycle(10) == set()
+    assert cycle(75, secs=600) == set()
+    assert cycle(10) == set()
+    assert cycle(10) == set()
+    assert cycle(10) == {'cont-1'}
+    assert sampler.rules('cont-1') == [DEBUG_RULE, OWN_RULE]
+
+    assert cycle(10) == set()
+    assert cycle(10) == {'cont-1'}
+    assert sampler.rules('cont-1') == [OWN_RULE]
+    assert sampler.level == {}
+
+    sampler.remove('cont-1')
+    assert 'cont-1' not in sampler.tracker
+    assert sampler.rules('cont-1') is None
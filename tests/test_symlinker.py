@@ -1,3 +1,8 @@
+import json
+import shutil
+
+import pytest
+
 from kube_log_watcher.agents.symlinker import Symlinker
 
 
@@ -139,3 +144,200 @@ def test_cleanup_dangling_symlinks(tmp_path):
 
     assert not(bad_link.is_symlink())
     assert not(bad_dir.exists())
+
+
+def test_load_links_on_startup(tmp_path, monkeypatch):
+    target = helper_target(tmp_path)
+
+    symlink_dir = tmp_path / "links"
+    symlink_dir.mkdir()
+
+    agent = Symlinker({'symlink_dir': str(symlink_dir)})
+    with agent:
+        agent.add_log_target(target)
+
+    (symlink_dir / 'container-empty').mkdir()
+
+    agent = Symlinker({'symlink_dir': str(symlink_dir)})
+
+    link = symlink_dir / 'container-1' / 'app_with_slashes' / 'comp_with_spaces' \
+        / 'default' / 'test' / 'v1_5' / 'app-1-container-1' / 'pod-123.log'
+    assert agent.links == {
+        'container-1': (link, target['kwargs']['log_file_path']),
+        'container-empty': (None, None),
+    }
+
+    with agent:
+        agent.add_log_target(target)
+
+    assert set(agent.links) == {'container-1'}
+    assert not (symlink_dir / 'container-empty').exists()
+    assert link.samefile(target['kwargs']['log_file_path'])
+
+    # Links are only verified once, unchanged targets and idle flushes do not touch the filesystem.
+    def fail(*args, **kwargs):
+        raise AssertionError('unexpected filesystem access')
+
+    monkeypatch.setattr('os.walk', fail)
+    monkeypatch.setattr('os.scandir', fail)
+    monkeypatch.setattr('pathlib.Path.exists', fail)
+    monkeypatch.setattr('pathlib.Path.mkdir', fail)
+
+    with agent:
+        agent.add_log_target(target)
+
+
+def test_add_log_target_metadata_changed(tmp_path):
+    target = helper_target(tmp_path)
+
+    symlink_dir = tmp_path / "links"
+    symlink_dir.mkdir()
+
+    agent = Symlinker({'symlink_dir': str(symlink_dir)})
+
+    with agent:
+        agent.add_log_target(target)
+
+    link_ino = (symlink_dir / 'container-1' / 'app_with_slashes' / 'comp_with_spaces' / 'default' / 'test' / 'v1_5'
+                / 'app-1-container-1' / 'pod-123.log').lstat().st_ino
+
+    target['kwargs']['version'] = 'v2'
+
+    with agent:
+        agent.add_log_target(target)
+
+    link = symlink_dir / 'container-1' / 'app_with_slashes' / 'comp_with_spaces' \
+        / 'default' / 'test' / 'v2' / 'app-1-container-1' / 'pod-123.log'
+
+    assert not (symlink_dir / 'container-1' / 'app_with_slashes' / 'comp_with_spaces' / 'default' / 'test'
+                / 'v1_5').exists()
+    assert link.samefile(target['kwargs']['log_file_path'])
+    # Link was moved, not recreated.
+    assert link.lstat().st_ino == link_ino
+    assert agent.links['container-1'] == (link, target['kwargs']['log_file_path'])
+
+
+@pytest.mark.parametrize('removed', ('link', 'container_dir'))
+def test_add_log_target_link_removed(tmp_path, removed):
+    target = helper_target(tmp_path)
+
+    symlink_dir = tmp_path / "links"
+    symlink_dir.mkdir()
+
+    agent = Symlinker({'symlink_dir': str(symlink_dir)})
+
+    with agent:
+        agent.add_log_target(target)
+
+    link, _ = agent.links['container-1']
+    if removed == 'link':
+        link.unlink()
+    else:
+        shutil.rmtree(str(symlink_dir / 'container-1'))
+
+    with agent:
+        agent.add_log_target(target)
+
+    assert link.is_symlink()
+    assert link.samefile(target['kwargs']['log_file_path'])
+    assert agent.links['container-1'] == (link, target['kwargs']['log_file_path'])
+
+
+def test_manifest(tmp_path, monkeypatch):
+    target = helper_target(tmp_path)
+
+    symlink_dir = tmp_path / "links"
+    symlink_dir.mkdir()
+    manifest = symlink_dir / 'manifest.jsonl'
+
+    monkeypatch.setenv('WATCHER_SYMLINK_MANIFEST', 'true')
+
+    agent = Symlinker({'symlink_dir': str(symlink_dir)})
+    assert agent.manifest_path == str(manifest)
+
+    with agent:
+        pass
+
+    assert manifest.read_text() == ''
+
+    with agent:
+        agent.add_log_target(target)
+
+    assert [json.loads(line) for line in manifest.read_text().splitlines()] == [{
+        'log_file_path': target['kwargs']['log_file_path'],
+        'container_id': 'container-1',
+        'container_name': 'app-1-container-1',
+        'pod_name': 'pod-123',
+        'namespace': 'default',
+        'application': 'app/with/slashes',
+        'component': 'comp with spaces',
+        'environment': 'test',
+        'version': 'v1.5',
+        'release': '2016',
+        'node_name': 'node-1',
+        'cluster_id': 'kube-cluster',
+    }]
+    # No links in manifest mode.
+    assert sorted(p.name for p in symlink_dir.iterdir()) == ['manifest.jsonl']
+
+    with agent:
+        agent.add_log_target(target)
+
+    assert agent.writer.written == 2
+    assert agent.writer.skipped == 0
+
+    other = dict(target, id='container-0', kwargs=dict(target['kwargs'], container_id='container-0', version='v2'))
+    with agent:
+        agent.add_log_target(other)
+
+    assert [json.loads(line)['container_id'] for line in manifest.read_text().splitlines()] == [
+        'container-0', 'container-1']
+
+    with agent:
+        agent.remove_log_target('container-1')
+        agent.remove_log_target('container-2')
+
+    assert [json.loads(line)['version'] for line in manifest.read_text().splitlines()] == ['v2']
+    assert agent.writer.written == 4
+
+
+def test_manifest_path(tmp_path, monkeypatch):
+    symlink_dir = tmp_path / "links"
+    symlink_dir.mkdir()
+
+    monkeypatch.setenv('WATCHER_SYMLINK_MANIFEST', 'true')
+    monkeypatch.setenv('WATCHER_SYMLINK_MANIFEST_PATH', str(tmp_path / 'logs.jsonl'))
+
+    agent = Symlinker({'symlink_dir': str(symlink_dir)})
+    with agent:
+        pass
+
+    assert (tmp_path / 'logs.jsonl').read_text() == ''
+
+
+def test_add_log_target_metadata_changed_move_failed(tmp_path, monkeypatch):
+    target = helper_target(tmp_path)
+
+    symlink_dir = tmp_path / "links"
+    symlink_dir.mkdir()
+
+    agent = Symlinker({'symlink_dir': str(symlink_dir)})
+
+    with agent:
+        agent.add_log_target(target)
+
+    def fail(*args):
+        raise OSError('rename failed')
+
+    monkeypatch.setattr('os.rename', fail)
+
+    target['kwargs']['pod_name'] = 'pod-456'
+
+    with agent:
+        agent.add_log_target(target)
+
+    link = symlink_dir / 'container-1' / 'app_with_slashes' / 'comp_with_spaces' \
+        / 'default' / 'test' / 'v1_5' / 'app-1-container-1' / 'pod-456.log'
+
+    assert [p.name for p in link.parent.iterdir()] == ['pod-456.log']
+    assert link.samefile(target['kwargs']['log_file_path'])
@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from mock import MagicMock
+
+from kube_log_watcher import template_loader
+from kube_log_watcher.agents.appdynamics import TPL_NAME
+
+
+@pytest.fixture
+def clear_cache():
+    template_loader.get_env.cache_clear()
+    template_loader.load_template.cache_clear()
+    yield
+    template_loader.get_env.cache_clear()
+    template_loader.load_template.cache_clear()
+
+
+def test_load_template(monkeypatch, clear_cache):
+    monkeypatch.delenv('WATCHER_TEMPLATE_CACHE_DIR', raising=False)
+
+    tpl = template_loader.load_template(TPL_NAME)
+
+    assert template_loader.load_template(TPL_NAME) is tpl
+    assert template_loader.get_env().bytecode_cache is None
+    assert template_loader.get_env().filters['quote_plus'](None) == ''
+
+
+def test_load_template_bytecode_cache(monkeypatch, tmp_path, clear_cache):
+    cache_dir = tmp_path / 'cache'
+    monkeypatch.setenv('WATCHER_TEMPLATE_CACHE_DIR', str(cache_dir))
+
+    tpl = template_loader.load_template(TPL_NAME)
+    job = tpl.render(container_path='/mnt/containers/container-1', log_file_name='container-1-json.log')
+
+    assert len(os.listdir(str(cache_dir))) == 1
+
+    # New process: template is loaded from bytecode cache.
+    template_loader.get_env.cache_clear()
+    template_loader.load_template.cache_clear()
+
+    monkeypatch.setattr('jinja2.Environment.compile', MagicMock(side_effect=AssertionError('compiled again')))
+
+    tpl = template_loader.load_template(TPL_NAME)
+    assert tpl.render(container_path='/mnt/containers/container-1', log_file_name='container-1-json.log') == job
+
+
+def test_jinja2_not_imported_on_startup():
+    code = 'import sys, kube_log_watcher.main; print("jinja2" in sys.modules)'
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(__file__)))
+    assert output.decode().strip() == 'False'
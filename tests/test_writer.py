@@ -0,0 +1,131 @@
+import os
+
+import pytest
+
+from mock import MagicMock
+
+from kube_log_watcher import metrics
+from kube_log_watcher.writer import ConfigWriter, FlushScheduler, atomic_write, content_hash
+
+
+def test_atomic_write(tmp_path):
+    path = str(tmp_path / 'agent.json')
+
+    atomic_write(path, '{}')
+
+    assert open(path).read() == '{}'
+    assert os.listdir(str(tmp_path)) == ['agent.json']
+
+
+def test_atomic_write_failure(monkeypatch, tmp_path):
+    path = str(tmp_path / 'agent.json')
+    atomic_write(path, 'old')
+
+    monkeypatch.setattr('os.replace', MagicMock(side_effect=OSError))
+
+    with pytest.raises(OSError):
+        atomic_write(path, 'new')
+
+    assert open(path).read() == 'old'
+    assert os.listdir(str(tmp_path)) == ['agent.json']
+
+
+def test_config_writer(tmp_path):
+    path = str(tmp_path / 'agent.json')
+    writer = ConfigWriter('test-agent')
+    written = metrics.get('watcher_config_writes_total', agent='test-agent', result='written') or 0
+
+    assert writer.write(path, 'config-1') is True
+    assert writer.write(path, 'config-1') is False
+    assert writer.write(path, 'config-2') is True
+
+    assert open(path).read() == 'config-2'
+    assert writer.current_hash(path) == content_hash('config-2')
+    assert (writer.written, writer.skipped) == (2, 1)
+    assert metrics.get('watcher_config_writes_total', agent='test-agent', result='written') == written + 2
+
+
+def test_config_writer_external_change(tmp_path):
+    path = str(tmp_path / 'agent.json')
+    writer = ConfigWriter('test-agent')
+
+    writer.write(path, 'config-1')
+
+    # file changed by somebody else
+    with open(path, 'w') as fp:
+        fp.write('something else!')
+
+    assert writer.write(path, 'config-1') is True
+    assert open(path).read() == 'config-1'
+
+    writer.remove(path)
+    assert not os.path.exists(path)
+    assert writer.write(path, 'config-1') is True
+
+
+def test_config_writer_on_change(tmp_path):
+    on_change = MagicMock()
+    writer = ConfigWriter('Scalyr', on_change=on_change)
+    path = str(tmp_path / 'agent.json')
+
+    writer.write(path, '{}')
+    writer.write(path, '{}')
+    assert on_change.call_count == 1
+
+    writer.remove(path)
+    assert on_change.call_count == 2
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_flush_scheduler():
+    clock = Clock()
+    scheduler = FlushScheduler('Scalyr', min_interval=60, max_delay=20, clock=clock)
+
+    assert scheduler.due() is False
+
+    # first change after quiet period
+    scheduler.change(added=True)
+    assert scheduler.pending is True
+    assert scheduler.due() is True
+    scheduler.done()
+    assert scheduler.pending is False
+
+    # removals wait for min interval
+    clock.now += 10
+    scheduler.change()
+    assert scheduler.due() is False
+    scheduler.defer()
+    clock.now += 49
+    assert scheduler.due() is False
+    clock.now += 1
+    assert scheduler.due() is True
+    scheduler.done()
+
+    # new targets wait for max delay
+    clock.now += 5
+    scheduler.change(added=True)
+    clock.now += 10
+    scheduler.change(added=True)
+    assert scheduler.due() is False
+    clock.now += 10
+    assert scheduler.due() is True
+    scheduler.done()
+
+    assert scheduler.deferred == 1
+    assert metrics.get('watcher_config_flushes_deferred_total', agent='Scalyr') >= 1
+
+
+def test_flush_scheduler_disabled():
+    scheduler = FlushScheduler('Scalyr')
+
+    for _ in range(3):
+        scheduler.change()
+        assert scheduler.due() is True
+        scheduler.done()